@@ -1,17 +1,36 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Post, Comment, Like, Friendship, FriendRequest, Conversation, Message
+from . import deletion
+from .models import User, Post, Comment, Like, Friendship, FriendRequest, Conversation, ConversationMember, Message, Job, Notification, MessageArchiveSegment, TrendingScore
+
+
+class SoftDeleteMixin:
+    """Deleting marks rows deleted and leaves the cascade to the background purge (core.deletion)."""
+    soft_delete = None
+
+    def get_deleted_objects(self, objs, request):
+        # Collecting every dependent row just to list it is as slow as deleting it
+        return [str(obj) for obj in objs], {}, set(), []
+
+    def delete_model(self, request, obj):
+        self.soft_delete([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        self.soft_delete(list(queryset.values_list('pk', flat=True)))
 
 
 @admin.register(User)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(SoftDeleteMixin, UserAdmin):
+    soft_delete = staticmethod(deletion.delete_users)
+    list_display = UserAdmin.list_display + ('deleted_at',)
     fieldsets = UserAdmin.fieldsets + (
         ('Additional Info', {'fields': ('bio', 'profile_photo', 'cover_photo', 'date_of_birth', 'location', 'website')}),
     )
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(SoftDeleteMixin, admin.ModelAdmin):
+    soft_delete = staticmethod(deletion.delete_posts)
     list_display = ('user', 'content', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('content', 'user__username')
@@ -19,8 +38,9 @@ class PostAdmin(admin.ModelAdmin):
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
-    list_display = ('user', 'post', 'content', 'created_at')
+    list_display = ('user', 'post', 'parent', 'content', 'reply_count', 'created_at')
     list_filter = ('created_at',)
+    raw_id_fields = ('post', 'user', 'parent')
 
 
 @admin.register(Like)
@@ -41,13 +61,46 @@ class FriendRequestAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
 
 
+class ConversationMemberInline(admin.TabularInline):
+    model = ConversationMember
+    raw_id_fields = ('user',)
+    extra = 0
+
+
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('id', 'created_at', 'updated_at')
-    list_filter = ('created_at',)
+    list_display = ('id', 'title', 'is_group', 'created_at', 'updated_at')
+    list_filter = ('is_group', 'created_at')
+    inlines = [ConversationMemberInline]
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('sender', 'conversation', 'content', 'created_at', 'is_read')
-    list_filter = ('created_at', 'is_read')
+    list_display = ('sender', 'conversation', 'content', 'created_at')
+    list_filter = ('created_at',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'attempts', 'run_at', 'created_at')
+    list_filter = ('status', 'task')
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'verb', 'post', 'actor_count', 'is_read', 'updated_at')
+    list_filter = ('verb', 'is_read')
+
+
+@admin.register(TrendingScore)
+class TrendingScoreAdmin(admin.ModelAdmin):
+    list_display = ('window', 'post', 'epoch', 'score')
+    list_filter = ('window',)
+    raw_id_fields = ('post',)
+
+
+@admin.register(MessageArchiveSegment)
+class MessageArchiveSegmentAdmin(admin.ModelAdmin):
+    list_display = ('conversation', 'first_message_id', 'last_message_id', 'message_count', 'last_created_at')
+    exclude = ('data',)
+
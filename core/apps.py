@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.contrib.admin import apps as admin_apps
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+
+
+class CoreAdminConfig(admin_apps.AdminConfig):
+    # Listed in INSTALLED_APPS by path; 'core' itself still gets CoreConfig
+    default = False
+    default_site = 'core.sites.AdminSite'
@@ -0,0 +1,167 @@
+"""
+Cold storage for old messages.
+
+`archive_old_messages` moves messages older than a retention window out of
+the hot Message table into compact per-conversation MessageArchiveSegment
+rows (zlib-compressed JSON lines). The hot table and its indexes then only
+hold recent traffic; older history is read back from segments on demand
+when a user scrolls up in a conversation.
+
+Attachment files stay where they are; segments keep their storage names.
+Segments sit on their conversation's shard next to its messages (see
+core.sharding).
+"""
+
+import json
+import zlib
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import sharding
+from .models import Message, MessageArchiveSegment, SearchDocument
+
+DEFAULT_RETENTION_DAYS = 180
+DEFAULT_SEGMENT_SIZE = 500
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+
+
+class ArchivedMessage:
+    """Read-only stand-in for a Message restored from an archive segment."""
+
+    archived = True
+
+    def __init__(self, data):
+        self.id = data['id']
+        self.sender_id = data['sender_id']
+        self.content = data['content']
+        self.attachment_name = data['attachment']
+        self.created_at = parse_datetime(data['created_at'])
+
+    @property
+    def attachment(self):
+        return self.attachment_name
+
+    def get_attachment_url(self):
+        if self.attachment_name:
+            return default_storage.url(self.attachment_name)
+        return None
+
+    def is_image(self):
+        if self.attachment_name:
+            return self.attachment_name.lower().split('.')[-1] in IMAGE_EXTENSIONS
+        return False
+
+
+def _encode(messages):
+    lines = [
+        json.dumps({
+            'id': message.id,
+            'sender_id': message.sender_id,
+            'content': message.content,
+            'attachment': message.attachment.name if message.attachment else '',
+            'created_at': message.created_at.isoformat(),
+        }, separators=(',', ':'))
+        for message in messages
+    ]
+    return zlib.compress('\n'.join(lines).encode('utf-8'), 9)
+
+
+def _decode_lines(segment):
+    raw = zlib.decompress(bytes(segment.data)).decode('utf-8')
+    return [json.loads(line) for line in raw.split('\n') if line]
+
+
+def decode(segment):
+    return [ArchivedMessage(data) for data in _decode_lines(segment)]
+
+
+def drop_senders(segment, sender_ids):
+    """Rewrite `segment` without the messages sent by `sender_ids`, deleting it once empty.
+
+    Returns the attachment names of the dropped messages; the caller deletes
+    the files once the rewrite has committed.
+    """
+    lines = _decode_lines(segment)
+    kept = [data for data in lines if data['sender_id'] not in sender_ids]
+    if len(kept) == len(lines):
+        return []
+    if not kept:
+        segment.delete()
+    else:
+        segment.first_message_id = kept[0]['id']
+        segment.last_message_id = kept[-1]['id']
+        segment.first_created_at = parse_datetime(kept[0]['created_at'])
+        segment.last_created_at = parse_datetime(kept[-1]['created_at'])
+        segment.message_count = len(kept)
+        segment.data = zlib.compress(
+            '\n'.join(json.dumps(data, separators=(',', ':')) for data in kept).encode('utf-8'), 9
+        )
+        segment.save()
+    return [data['attachment'] for data in lines if data['sender_id'] in sender_ids and data['attachment']]
+
+
+def archive_conversation(conversation_id, cutoff, segment_size=DEFAULT_SEGMENT_SIZE):
+    """Archive one conversation's messages created before `cutoff`. Returns the number moved."""
+    shard = sharding.shard_for(conversation_id)
+    moved = 0
+    while True:
+        # One transaction per segment keeps locks short on busy conversations
+        with transaction.atomic(using=shard):
+            batch = list(
+                Message.objects.using(shard).filter(conversation_id=conversation_id, created_at__lt=cutoff)
+                .order_by('id')[:segment_size]
+            )
+            if not batch:
+                return moved
+            MessageArchiveSegment.objects.using(shard).create(
+                conversation_id=conversation_id,
+                first_message_id=batch[0].id,
+                last_message_id=batch[-1].id,
+                first_created_at=batch[0].created_at,
+                last_created_at=batch[-1].created_at,
+                message_count=len(batch),
+                data=_encode(batch),
+            )
+            message_ids = [message.id for message in batch]
+            Message.objects.using(shard).filter(id__in=message_ids).delete()
+        # The delete only cascades to search documents on the same database
+        SearchDocument.objects.filter(message_id__in=message_ids).delete()
+        moved += len(batch)
+        if len(batch) < segment_size:
+            return moved
+
+
+def archive_old_messages(retention_days=DEFAULT_RETENTION_DAYS, segment_size=DEFAULT_SEGMENT_SIZE):
+    """Archive messages older than `retention_days` everywhere. Returns {conversation_id: moved}."""
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    conversation_ids = (
+        Message.objects.filter(created_at__lt=cutoff)
+        .order_by('conversation_id')
+        .values_list('conversation_id', flat=True)
+        .distinct()
+    )
+    return {
+        conversation_id: archive_conversation(conversation_id, cutoff, segment_size)
+        for shard in sharding.each_shard(conversation_ids)
+        for conversation_id in list(shard)
+    }
+
+
+def archived_before(conversation_id, before_id=None, limit=50):
+    """Newest archived messages with id < before_id, returned oldest first."""
+    segments = MessageArchiveSegment.objects.for_conversation(conversation_id).filter(conversation_id=conversation_id)
+    if before_id is not None:
+        segments = segments.filter(first_message_id__lt=before_id)
+
+    collected = []
+    for segment in segments.order_by('-last_message_id').iterator(chunk_size=4):
+        messages = [m for m in decode(segment) if before_id is None or m.id < before_id]
+        collected = messages[-(limit - len(collected)):] + collected
+        if len(collected) >= limit:
+            break
+    return collected
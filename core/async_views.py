@@ -0,0 +1,98 @@
+"""
+Async versions of the endpoints messages.js and conversation.js poll.
+
+Served instead of their core.views counterparts when settings.ASYNC_VIEWS
+is on, which social_connect/asgi.py does. They run on the event loop and
+leave it only for the ORM queries themselves, so a client waiting on a poll
+does not hold a worker thread for the whole request the way a WSGI worker
+does. Responses are built by the same helpers as the sync views.
+
+like_post still toggles in a thread: the async ORM cannot open the
+transaction likes.toggle_like needs.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect
+
+from . import comments, conversations, likes
+from .middleware import auser
+from .models import Post, User
+from .ratelimit import coalesce, ratelimit
+from .views import (
+    _after_id, _comments_payload, _is_reset, _messages_payload, _page_cursor, _polled_messages, _status_payload,
+)
+
+
+def login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await auser(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@login_required
+@ratelimit('poll')
+@coalesce
+async def get_messages_json(request, conversation_id):
+    membership = await conversations.aget_membership(conversation_id, request.user)
+    if membership is None:
+        raise Http404('Conversation not found')
+    conversation = membership.conversation
+    after_id = _after_id(request)
+    fetched = [msg async for msg in _polled_messages(conversation, after_id)][::-1]
+    messages_list = conversations.visible(fetched)
+
+    # Polling only writes when new messages have arrived since the last poll
+    if fetched:
+        await conversations.amark_read(membership, fetched[-1].id)
+
+    watermarks = await conversations.aother_watermarks(conversation.id, request.user)
+    return JsonResponse(
+        _messages_payload(conversation, messages_list, watermarks, request.user, _is_reset(after_id, fetched))
+    )
+
+
+@login_required
+@ratelimit('poll')
+@coalesce
+async def get_user_status(request, user_id):
+    try:
+        user = await User.objects.only('id', 'last_active').aget(id=user_id)
+    except User.DoesNotExist:
+        raise Http404('No User matches the given query.')
+    return JsonResponse(_status_payload(user))
+
+
+@login_required
+async def get_comments(request, post_id):
+    try:
+        post = await Post.objects.only('id', 'comment_count').aget(id=post_id)
+    except Post.DoesNotExist:
+        raise Http404('No Post matches the given query.')
+    rows = [comment async for comment in comments.top_level(post.id, _page_cursor(request))]
+    page, next_cursor = comments.split_page(rows, comments.COMMENT_PAGE_SIZE)
+    return JsonResponse(_comments_payload(request, page, post.comment_count, next_cursor))
+
+
+@login_required
+@ratelimit('write')
+async def like_post(request, post_id):
+    if not await Post.objects.filter(id=post_id).aexists():
+        raise Http404('No Post matches the given query.')
+    liked, like_count = await sync_to_async(likes.toggle_like)(post_id, request.user.id)
+
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.content_type == 'application/json':
+        return JsonResponse({
+            'success': True,
+            'liked': liked,
+            'like_count': like_count
+        })
+
+    return redirect('home')
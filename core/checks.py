@@ -0,0 +1,36 @@
+"""
+System checks for the settings core depends on.
+
+Problems with MESSAGE_SHARDS show up here, when `manage.py check`,
+runserver or migrate start, instead of on the first write to a shard.
+"""
+
+from django.conf import settings
+from django.core.checks import Error, register
+from django.db import connections
+
+from . import sharding
+
+
+@register()
+def check_message_shards(app_configs, **kwargs):
+    shards = sharding.aliases()
+    if len(shards) == 1:
+        # Unsharded: message ids are never moved into per-shard ranges
+        return []
+    errors = []
+    for alias in shards:
+        if alias not in settings.DATABASES:
+            errors.append(Error(
+                f"MESSAGE_SHARDS names {alias!r}, which is not in DATABASES.",
+                id='core.E001',
+            ))
+            continue
+        vendor = connections[alias].vendor
+        if vendor not in sharding.SUPPORTED_VENDORS:
+            errors.append(Error(
+                f"Message shard {alias!r} uses {vendor}, which cannot be sharded.",
+                hint=f"Shards need a database whose id counter can be moved: {', '.join(sharding.SUPPORTED_VENDORS)}.",
+                id='core.E002',
+            ))
+    return errors
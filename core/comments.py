@@ -0,0 +1,75 @@
+"""
+Threaded comments with keyset pagination and denormalized counters.
+
+Comments are one level deep: a top-level comment on a post, and replies
+pointing at it. Both lists are read a page at a time in id order, starting
+after the last id the client has seen, so every page is one range scan on
+an index however many comments a post has. Replies are only fetched when a
+reader expands a thread.
+
+Post.comment_count (all comments, replies included) and Comment.reply_count
+are bumped in the same transaction as the insert, so showing them never
+needs a COUNT(*). Deletes made outside this module (cascades, the admin)
+are folded back in by reconcile_comment_counts().
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Post
+
+COMMENT_PAGE_SIZE = 20
+REPLY_PAGE_SIZE = 10
+
+
+def add_comment(post, user, content, parent=None):
+    """Comment on `post`, or reply to `parent`. Returns (comment, post's comment count)."""
+    # Replying to a reply continues the same thread
+    parent_id = (parent.parent_id or parent.id) if parent is not None else None
+    with transaction.atomic():
+        comment = Comment.objects.create(post=post, user=user, content=content, parent_id=parent_id)
+        Post.objects.filter(id=post.id).update(comment_count=F('comment_count') + 1)
+        if parent_id:
+            Comment.objects.filter(id=parent_id).update(reply_count=F('reply_count') + 1)
+        comment_count = Post.objects.values_list('comment_count', flat=True).get(id=post.id)
+    return comment, comment_count
+
+
+def _page(queryset, after, size):
+    # Comments of deleted accounts are hidden until core.deletion purges them
+    queryset = queryset.filter(user__deleted_at__isnull=True).select_related('user').order_by('id')
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    # One extra row tells whether there is a next page
+    return queryset[:size + 1]
+
+
+def top_level(post_id, after=None):
+    """Queryset for the page of `post_id`'s top-level comments after id `after`."""
+    return _page(Comment.objects.filter(post_id=post_id, parent__isnull=True), after, COMMENT_PAGE_SIZE)
+
+
+def replies(comment_id, after=None):
+    """Queryset for the page of replies to `comment_id` after id `after`."""
+    return _page(Comment.objects.filter(parent_id=comment_id), after, REPLY_PAGE_SIZE)
+
+
+def split_page(rows, size):
+    """(page, cursor for the next page or None) from rows fetched by top_level() or replies()."""
+    if len(rows) > size:
+        return rows[:size], rows[size - 1].id
+    return rows, None
+
+
+def reconcile_comment_counts(post_ids=None):
+    """Recompute comment_count and reply_count from the Comment table (for repair jobs)."""
+    totals = Comment.objects.filter(post=OuterRef('pk')).values('post').annotate(n=Count('id')).values('n')
+    reply_totals = Comment.objects.filter(parent=OuterRef('pk')).values('parent').annotate(n=Count('id')).values('n')
+    posts = Post.objects.all()
+    threads = Comment.objects.filter(parent__isnull=True)
+    if post_ids is not None:
+        posts = posts.filter(id__in=post_ids)
+        threads = threads.filter(post_id__in=post_ids)
+    threads.update(reply_count=Coalesce(Subquery(reply_totals), 0))
+    return posts.update(comment_count=Coalesce(Subquery(totals), 0))
@@ -0,0 +1,327 @@
+"""
+Conversation membership and read state.
+
+Each participant has a ConversationMember row holding a `last_read_message_id`
+watermark: every message with an id at or below it counts as read by that
+participant. Marking a conversation read is a single conditional UPDATE that
+only touches the row when the watermark actually moves, so repeated polls of
+an unchanged conversation do not write. Unread counts and read receipts are
+plain id comparisons against the watermarks.
+
+One-to-one conversations carry a `direct_key` built from the ordered pair of
+user ids. It is unique, so finding a pair's conversation is one index probe
+and concurrent attempts to start the same conversation converge on one row.
+
+Group conversations can have hundreds of members, so nothing here does work
+per member: sending a message is one INSERT plus the sender's watermark,
+members are added with one bulk INSERT, and the membership set used for
+presence is cached and invalidated whenever it changes. Access checks never
+use that cache: with a per-process backend another process could keep
+serving a removed member, so is_member() asks the shard every time.
+
+Conversations are sharded by id (see core.sharding): everything about one
+conversation is read from its shard, and inbox() and unread_counts() run
+their queries once per shard.
+
+The a-prefixed functions are the async ORM versions used by core.async_views.
+"""
+
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+
+from . import sharding
+from .models import Conversation, ConversationDirectory, ConversationMember, Message, User
+
+MEMBERS_CACHE_TIMEOUT = 300
+
+
+def direct_key(user_id, other_id):
+    low, high = sorted((user_id, other_id))
+    return f'{low}:{high}'
+
+
+def get_or_create_direct(user, other):
+    """Return (conversation, created) for the one-to-one conversation between two users."""
+    key = direct_key(user.id, other.id)
+    # The pair's id is claimed in the directory, then the conversation is made on its shard.
+    # A claim whose conversation never got made (a crash in between) is finished here.
+    conversation_id = ConversationDirectory.objects.filter(direct_key=key).values_list('id', flat=True).first()
+    if conversation_id is None:
+        try:
+            with transaction.atomic():
+                conversation_id = ConversationDirectory.objects.create(direct_key=key).id
+        except IntegrityError:
+            # Someone else claimed it between our probe and insert
+            conversation_id = ConversationDirectory.objects.get(direct_key=key).id
+
+    shard = sharding.shard_for(conversation_id)
+    with transaction.atomic(using=shard):
+        conversation, created = Conversation.objects.using(shard).get_or_create(
+            id=conversation_id, defaults={'direct_key': key}
+        )
+        if created:
+            ConversationMember.objects.using(shard).bulk_create([
+                ConversationMember(conversation=conversation, user=user),
+                ConversationMember(conversation=conversation, user=other),
+            ])
+    if created:
+        invalidate_members(conversation.id)
+    return conversation, created
+
+
+def create_group(creator, title, users):
+    conversation_id = ConversationDirectory.objects.create().id
+    shard = sharding.shard_for(conversation_id)
+    with transaction.atomic(using=shard):
+        conversation = Conversation.objects.using(shard).create(id=conversation_id, is_group=True, title=title)
+        ConversationMember.objects.using(shard).bulk_create(
+            [ConversationMember(conversation=conversation, user=creator, is_admin=True)]
+            + [ConversationMember(conversation=conversation, user=user) for user in users if user != creator]
+        )
+    invalidate_members(conversation.id)
+    return conversation
+
+
+def bulk_create(conversation_list, batch_size=1000):
+    """Insert unsaved conversations on their shards, numbered by the directory. Returns them with ids set.
+
+    A one-to-one conversation whose pair already has one takes that one's id
+    and is not inserted again. Members are up to the caller.
+    """
+    for start in range(0, len(conversation_list), batch_size):
+        batch = conversation_list[start:start + batch_size]
+        direct = [conversation for conversation in batch if conversation.direct_key]
+        groups = [conversation for conversation in batch if not conversation.direct_key]
+        ConversationDirectory.objects.bulk_create(
+            [ConversationDirectory(direct_key=conversation.direct_key) for conversation in direct],
+            ignore_conflicts=True,
+        )
+        ids = dict(
+            ConversationDirectory.objects.filter(direct_key__in=[conversation.direct_key for conversation in direct])
+            .values_list('direct_key', 'id')
+        )
+        for conversation in direct:
+            conversation.id = ids[conversation.direct_key]
+        entries = ConversationDirectory.objects.bulk_create([ConversationDirectory() for _ in groups])
+        for conversation, entry in zip(groups, entries):
+            conversation.id = entry.id
+        sharding.bulk_create(Conversation, batch, ignore_conflicts=True)
+    return conversation_list
+
+
+def add_members(conversation, users):
+    """Add `users` to a group in one INSERT. Returns the number of new members."""
+    existing = members(conversation.id)
+    # New members start caught up instead of with the whole history unread
+    latest = conversation.messages.order_by('-id').values_list('id', flat=True).first() or 0
+    new_members = [
+        ConversationMember(conversation=conversation, user=user, last_read_message_id=latest)
+        for user in users if user.id not in existing
+    ]
+    ConversationMember.objects.for_conversation(conversation.id).bulk_create(
+        new_members, ignore_conflicts=True, batch_size=500
+    )
+    invalidate_members(conversation.id)
+    return len(new_members)
+
+
+def remove_member(conversation, user_id):
+    shard = sharding.shard_for(conversation.id)
+    with transaction.atomic(using=shard):
+        ConversationMember.objects.using(shard).filter(conversation=conversation, user_id=user_id).delete()
+        # A group never loses its last admin; the longest-standing member takes over
+        remaining = ConversationMember.objects.using(shard).filter(conversation=conversation)
+        if not remaining.filter(is_admin=True).exists():
+            successor = remaining.order_by('joined_at', 'id').first()
+            if successor:
+                remaining.filter(pk=successor.pk).update(is_admin=True)
+    invalidate_members(conversation.id)
+
+
+def _members_key(conversation_id):
+    return f'conversation:{conversation_id}:members'
+
+
+def members(conversation_id):
+    """{user_id: is_admin} for a conversation, served from the cache."""
+    key = _members_key(conversation_id)
+    result = cache.get(key)
+    if result is None:
+        result = dict(
+            ConversationMember.objects.for_conversation(conversation_id)
+            .filter(conversation_id=conversation_id).values_list('user_id', 'is_admin')
+        )
+        cache.set(key, result, MEMBERS_CACHE_TIMEOUT)
+    return result
+
+
+def invalidate_members(conversation_id):
+    key = _members_key(conversation_id)
+    cache.delete(key)
+    # Also drop anything cached from the old state before our transaction committed
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def is_member(conversation_id, user_id):
+    # One probe of the (conversation, user) unique index, so removals take effect at once
+    return (
+        ConversationMember.objects.for_conversation(conversation_id)
+        .filter(conversation_id=conversation_id, user_id=user_id).exists()
+    )
+
+
+def presence(conversation_id):
+    """Members with their online status, in one query over the cached membership set."""
+    membership = members(conversation_id)
+    users = (
+        User.objects.filter(id__in=list(membership))
+        .only('id', 'username', 'profile_photo', 'last_active')
+        .order_by('username')
+    )
+    return [
+        {
+            'id': user.id,
+            'username': user.username,
+            'avatar': user.get_profile_photo_url(),
+            'is_admin': membership[user.id],
+            'is_online': user.is_online(),
+            'status': user.get_last_active_display(),
+        }
+        for user in users
+    ]
+
+
+def get_membership(conversation_id, user):
+    return (
+        ConversationMember.objects.for_conversation(conversation_id).select_related('conversation')
+        .filter(conversation_id=conversation_id, user=user)
+        .first()
+    )
+
+
+async def aget_membership(conversation_id, user):
+    return await (
+        ConversationMember.objects.for_conversation(conversation_id).select_related('conversation')
+        .filter(conversation_id=conversation_id, user=user)
+        .afirst()
+    )
+
+
+def mark_read(membership, message_id):
+    """Advance `membership`'s watermark to `message_id`. Returns True if it moved."""
+    if not message_id or message_id <= membership.last_read_message_id:
+        return False
+    moved = ConversationMember.objects.for_conversation(membership.conversation_id).filter(
+        pk=membership.pk, last_read_message_id__lt=message_id
+    ).update(last_read_message_id=message_id)
+    membership.last_read_message_id = max(membership.last_read_message_id, message_id)
+    return bool(moved)
+
+
+async def amark_read(membership, message_id):
+    if not message_id or message_id <= membership.last_read_message_id:
+        return False
+    moved = await ConversationMember.objects.for_conversation(membership.conversation_id).filter(
+        pk=membership.pk, last_read_message_id__lt=message_id
+    ).aupdate(last_read_message_id=message_id)
+    membership.last_read_message_id = max(membership.last_read_message_id, message_id)
+    return bool(moved)
+
+
+def other_watermarks(conversation_id, user):
+    """Sorted watermarks of everyone else in the conversation, for read receipts."""
+    return sorted(
+        ConversationMember.objects.for_conversation(conversation_id).filter(conversation_id=conversation_id)
+        .exclude(user=user)
+        .values_list('last_read_message_id', flat=True)
+    )
+
+
+async def aother_watermarks(conversation_id, user):
+    return sorted([
+        watermark async for watermark in
+        ConversationMember.objects.for_conversation(conversation_id).filter(conversation_id=conversation_id)
+        .exclude(user=user)
+        .values_list('last_read_message_id', flat=True)
+    ])
+
+
+def seen_by(watermarks, message_id):
+    """How many of `watermarks` (sorted) have reached `message_id`."""
+    return len(watermarks) - bisect_left(watermarks, message_id)
+
+
+def unread_counts(user):
+    """{conversation_id: unread message count} for every conversation of `user` with unread messages."""
+    rows = (
+        Message.objects.filter(
+            conversation__memberships__user=user,
+            id__gt=F('conversation__memberships__last_read_message_id'),
+        )
+        .exclude(sender=user)
+        .values('conversation_id')
+        .annotate(unread=Count('id'))
+    )
+    return {row['conversation_id']: row['unread'] for shard in sharding.each_shard(rows) for row in shard}
+
+
+def conversation_ids(user):
+    """Ids of every conversation `user` belongs to, from all shards."""
+    memberships = ConversationMember.objects.filter(user=user).values_list('conversation_id', flat=True)
+    return [conversation_id for shard in sharding.each_shard(memberships) for conversation_id in shard]
+
+
+def inbox(user):
+    """`user`'s conversations, most recently active first.
+
+    Each carries member_count, last_message, unread_count and, for one-to-one
+    conversations, other_user. Four queries per shard plus one for the users.
+    """
+    mine = ConversationMember.objects.filter(user=user).values('conversation_id')
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-id').values('id')[:1]
+    unread = unread_counts(user)
+
+    conversation_list, others = [], {}
+    for shard in sharding.aliases():
+        rows = list(
+            Conversation.objects.using(shard).filter(id__in=mine)
+            .annotate(member_count=Count('memberships'), last_message_id=Subquery(latest))
+        )
+        last_messages = Message.objects.using(shard).in_bulk(
+            [row.last_message_id for row in rows if row.last_message_id]
+        )
+        # The other side of every one-to-one conversation; groups show their title
+        others.update(
+            ConversationMember.objects.using(shard)
+            .filter(conversation_id__in=[row.id for row in rows if not row.is_group])
+            .exclude(user=user).values_list('conversation_id', 'user_id')
+        )
+        for conversation in rows:
+            conversation.last_message = last_messages.get(conversation.last_message_id)
+            conversation.unread_count = unread.get(conversation.id, 0)
+        conversation_list.extend(rows)
+
+    senders = {conversation.last_message.sender_id for conversation in conversation_list if conversation.last_message}
+    users = User.objects.in_bulk(set(others.values()) | senders)
+    for conversation in conversation_list:
+        conversation.other_user = users.get(others.get(conversation.id))
+        last_message = conversation.last_message
+        if last_message and (last_message.sender_id not in users or users[last_message.sender_id].deleted_at):
+            conversation.last_message = None
+    conversation_list.sort(key=lambda conversation: conversation.updated_at, reverse=True)
+    return conversation_list
+
+
+def with_senders(messages):
+    """`messages` with their senders loaded: joined when they share a database, otherwise fetched from 'default'."""
+    if messages.db == DEFAULT_DB_ALIAS:
+        return messages.select_related('sender')
+    return messages.prefetch_related('sender')
+
+
+def visible(messages):
+    """Loaded `messages` minus those of accounts deleted but not purged yet (see core.deletion)."""
+    return [message for message in messages if message.sender.deleted_at is None]
@@ -0,0 +1,169 @@
+"""
+Soft deletion of posts and accounts, purged in the background.
+
+Model.delete() collects every dependent row (likes, comments, shares,
+messages, ...) in Python and deletes the lot in one transaction, holding
+SQLite's write lock for as long as that takes. Here a delete only stamps
+deleted_at. Post.objects stops returning the post at once; a deleted user
+is also made inactive, which logs them out and hides their posts the same
+way.
+
+The `purge_deleted` job then removes the rows children first, at most
+BATCH_SIZE rows of one table per transaction, and deletes their media files
+once that transaction commits, unless a remaining row (a share of the post)
+still uses the file. After each batch it re-queues itself
+PAUSE_SECONDS later, so other writers and jobs get the database in between.
+Likes and comments a deleted user left on other people's posts are taken
+out of those posts' counters by a reconcile_counters job. Messages and
+memberships are purged on every shard (see core.sharding), by user id since
+shards cannot join the user table. Before a deleted user's membership goes,
+their lines are cut out of that conversation's archive segments.
+"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import archive, jobs, sharding, usercache
+from .models import (
+    Comment, ConversationMember, FriendRequest, Friendship, Job, Like, Message, MessageArchiveSegment, Notification, Post,
+    SearchDocument, User,
+)
+
+DEFAULTS = {
+    'BATCH_SIZE': 500,
+    'PAUSE_SECONDS': 1,
+}
+
+_doomed_post = Q(post__deleted_at__isnull=False)
+
+
+def _doomed_user(*fields):
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}__deleted_at__isnull': False})
+    return condition
+
+
+def _doomed_user_ids(field):
+    # Evaluated per batch: a Q over the ids themselves, for tables on other databases
+    def condition():
+        doomed = User._base_manager.filter(deleted_at__isnull=False).values_list('id', flat=True)
+        return Q(**{f'{field}__in': list(doomed)})
+    return condition
+
+
+# (model, rows to purge, file fields, whether the rows are counted on Post), in purge order.
+# Each table is emptied before the ones its rows point at, so no DELETE has much to cascade.
+_STEPS = (
+    (Comment, _doomed_post & Q(parent__isnull=False), (), False),
+    (Comment, _doomed_post, (), False),
+    (Like, _doomed_post, (), False),
+    (Post, Q(deleted_at__isnull=False), ('image',), False),
+    (Comment, Q(parent__isnull=False) & _doomed_user('user', 'parent__user'), (), True),
+    (Comment, _doomed_user('user'), (), True),
+    (Like, _doomed_user('user'), (), True),
+    (Message, _doomed_user_ids('sender'), ('attachment',), False),
+    (Notification, _doomed_user('recipient', 'latest_actor'), (), False),
+    (Friendship, _doomed_user('user', 'friend'), (), False),
+    (FriendRequest, _doomed_user('from_user', 'to_user'), (), False),
+    (ConversationMember, _doomed_user_ids('user'), (), False),
+    (SearchDocument, _doomed_user('author', 'post_owner'), (), False),
+    (User, Q(deleted_at__isnull=False), ('profile_photo', 'cover_photo'), False),
+)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DELETION', {})}
+
+
+def delete_posts(post_ids):
+    """Hide posts at once and queue their purge."""
+    Post.objects.filter(id__in=list(post_ids)).update(deleted_at=timezone.now())
+    schedule_purge()
+
+
+def delete_users(user_ids):
+    """Deactivate accounts, hide their posts at once and queue the purge of everything they own."""
+    user_ids = list(user_ids)
+    now = timezone.now()
+    with transaction.atomic():
+        User.objects.filter(id__in=user_ids, deleted_at__isnull=True).update(is_active=False, deleted_at=now)
+        Post.objects.filter(user_id__in=user_ids).update(deleted_at=now)
+        # Once the rows are committed, or a concurrent request could cache the still-active user again
+        transaction.on_commit(lambda: usercache.invalidate_users(user_ids))
+    schedule_purge()
+
+
+def _delete_files(model, names, alias=DEFAULT_DB_ALIAS):
+    for field_name, name in names:
+        # Shared posts point at the original's file, so it goes only once nothing references it
+        if model._base_manager.using(alias).filter(**{field_name: name}).exists():
+            continue
+        model._meta.get_field(field_name).storage.delete(name)
+
+
+def _scrub_archive(doomed_user_ids):
+    """Drop deleted users' lines from one conversation's archive, then their membership there."""
+    for alias in sharding.aliases():
+        conversation_id = (
+            ConversationMember.objects.using(alias)
+            .filter(user_id__in=doomed_user_ids, conversation__archive_segments__isnull=False)
+            .values_list('conversation_id', flat=True).first()
+        )
+        if conversation_id is None:
+            continue
+        names = []
+        with transaction.atomic(using=alias):
+            segments = MessageArchiveSegment.objects.using(alias).filter(conversation_id=conversation_id)
+            for segment in segments.select_for_update().order_by('id'):
+                names.extend(archive.drop_senders(segment, doomed_user_ids))
+            # The membership is what led here, so the next batch moves on to another conversation
+            ConversationMember.objects.using(alias).filter(
+                conversation_id=conversation_id, user_id__in=doomed_user_ids
+            ).delete()
+            if names:
+                transaction.on_commit(
+                    lambda: _delete_files(Message, [('attachment', name) for name in names], alias), using=alias
+                )
+        return True
+    return False
+
+
+def purge_batch(batch_size=None):
+    """Delete one batch of soft-deleted rows in its own transaction. Returns False once nothing is left."""
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    doomed_user_ids = set(User._base_manager.filter(deleted_at__isnull=False).values_list('id', flat=True))
+    if doomed_user_ids and _scrub_archive(doomed_user_ids):
+        return True
+    for model, condition, file_fields, counted in _STEPS:
+        if callable(condition):
+            condition = condition()
+        for alias in sharding.aliases() if sharding.is_sharded(model) else [DEFAULT_DB_ALIAS]:
+            ids = list(model._base_manager.using(alias).filter(condition).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                continue
+
+            rows = model._base_manager.using(alias).filter(pk__in=ids)
+            names = [
+                (field_name, name)
+                for field_name in file_fields
+                for name in rows.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list(field_name, flat=True)
+            ]
+            with transaction.atomic(using=alias):
+                post_ids = sorted(set(rows.values_list('post_id', flat=True))) if counted else []
+                rows.delete()
+                if post_ids:
+                    jobs.enqueue('reconcile_counters', post_ids=post_ids)
+                if names:
+                    transaction.on_commit(lambda: _delete_files(model, names, alias), using=alias)
+            return True
+    return False
+
+
+def schedule_purge(delay=None):
+    """Queue a purge_deleted run unless one is already waiting."""
+    if not Job.objects.filter(task='purge_deleted', status=Job.STATUS_PENDING).exists():
+        jobs.enqueue('purge_deleted', delay=delay)
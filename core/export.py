@@ -0,0 +1,210 @@
+"""
+Account export as a streamed zip archive.
+
+export_chunks() yields the archive a piece at a time: NDJSON files for the
+account's posts, comments, likes, friends and messages, followed by its
+media files. Rows are read with chunked .iterator() queries and archived
+message segments are decoded one at a time. Each piece is handed on as
+soon as roughly CHUNK_SIZE bytes of compressed output exist, so memory use
+does not grow with the size of the account. The zip is written with data
+descriptors, which need no seeking, so it can go straight into a
+StreamingHttpResponse or a file. Under ASGI, aexport_chunks() hands the
+same pieces to the response one at a time; Django would read a sync
+iterator into a list there before sending any of it.
+
+Messages cover every conversation the user belongs to, including other
+members' messages; conversations.ndjson maps their sender ids to usernames.
+Media holds the user's own uploads: photos, post images and the attachments
+they sent. Messaging rows are read shard by shard (see core.sharding).
+"""
+
+import json
+import zipfile
+
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from . import archive, conversations, sharding
+from .models import Comment, ConversationMember, Friendship, Like, Message, MessageArchiveSegment, Post, User
+
+CHUNK_SIZE = 64 * 1024
+QUERY_CHUNK_SIZE = 2000
+
+
+class _Sink:
+    """Write-only file the archive is written into; export_chunks() drains it as it goes."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def _by_shard(model, user):
+    """`model` rows of `user`'s conversations, one queryset per shard."""
+    groups = sharding.group_by_shard(conversations.conversation_ids(user))
+    return [
+        model.objects.using(shard).filter(conversation_id__in=conversation_ids)
+        for shard, conversation_ids in groups.items()
+    ]
+
+
+def _archived_messages(user, sender_only=False):
+    for segments in _by_shard(MessageArchiveSegment, user):
+        for segment in segments.order_by('id').iterator(chunk_size=4):
+            for message in archive.decode(segment):
+                if not sender_only or message.sender_id == user.id:
+                    yield segment.conversation_id, message
+
+
+def _members(user):
+    # Usernames come from the default database, a chunk of members at a time
+    for members in _by_shard(ConversationMember, user):
+        rows = members.order_by('conversation_id', 'user_id').values(
+            'conversation_id', 'conversation__title', 'conversation__is_group', 'user_id'
+        ).iterator(chunk_size=QUERY_CHUNK_SIZE)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= QUERY_CHUNK_SIZE:
+                yield from _with_usernames(chunk)
+                chunk = []
+        yield from _with_usernames(chunk)
+
+
+def _with_usernames(rows):
+    usernames = dict(User.objects.filter(id__in={row['user_id'] for row in rows}).values_list('id', 'username'))
+    for row in rows:
+        row['user__username'] = usernames.get(row['user_id'])
+        yield row
+
+
+def _messages(user):
+    for hot in _by_shard(Message, user):
+        yield from hot.order_by('id').values(
+            'id', 'conversation_id', 'sender_id', 'content', 'attachment', 'created_at'
+        ).iterator(chunk_size=QUERY_CHUNK_SIZE)
+    for conversation_id, message in _archived_messages(user):
+        yield {
+            'id': message.id,
+            'conversation_id': conversation_id,
+            'sender_id': message.sender_id,
+            'content': message.content,
+            'attachment': message.attachment_name,
+            'created_at': message.created_at,
+        }
+
+
+def _tables(user):
+    """(file name, rows) for each NDJSON file."""
+    yield 'posts.ndjson', (
+        Post.objects.filter(user=user).order_by('id')
+        .values('id', 'content', 'image', 'shared_from_id', 'like_count', 'comment_count', 'created_at')
+        .iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    yield 'comments.ndjson', (
+        Comment.objects.filter(user=user).order_by('id')
+        .values('id', 'post_id', 'parent_id', 'content', 'created_at')
+        .iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    yield 'likes.ndjson', (
+        Like.objects.filter(user=user).order_by('id')
+        .values('post_id', 'created_at')
+        .iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    yield 'friends.ndjson', (
+        Friendship.objects.filter(user=user).order_by('id')
+        .values('friend_id', 'friend__username', 'created_at')
+        .iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    yield 'conversations.ndjson', _members(user)
+    yield 'messages.ndjson', _messages(user)
+
+
+def _media_names(user):
+    for field in (user.profile_photo, user.cover_photo):
+        if field:
+            yield field.name
+    yield from (
+        Post.objects.filter(user=user).exclude(image='').exclude(image__isnull=True).order_by('id')
+        .values_list('image', flat=True).iterator(chunk_size=QUERY_CHUNK_SIZE)
+    )
+    sent = Message.objects.filter(sender=user).exclude(attachment='').exclude(attachment__isnull=True)
+    for shard in sharding.each_shard(sent):
+        yield from shard.order_by('id').values_list('attachment', flat=True).iterator(chunk_size=QUERY_CHUNK_SIZE)
+    for _, message in _archived_messages(user, sender_only=True):
+        if message.attachment_name:
+            yield message.attachment_name
+
+
+def _profile(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'bio': user.bio,
+        'location': user.location,
+        'website': user.website,
+        'date_of_birth': user.date_of_birth,
+        'date_joined': user.date_joined,
+        'exported_at': timezone.now(),
+    }
+
+
+def export_chunks(user):
+    """Yield the bytes of a zip archive holding `user`'s data."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('profile.json', json.dumps(_profile(user), cls=DjangoJSONEncoder, indent=2))
+
+        for name, rows in _tables(user):
+            with zf.open(name, 'w', force_zip64=True) as fh:
+                for row in rows:
+                    fh.write(json.dumps(row, cls=DjangoJSONEncoder).encode('utf-8') + b'\n')
+                    if sink.size >= CHUNK_SIZE:
+                        yield sink.drain()
+            yield sink.drain()
+
+        for name in _media_names(user):
+            try:
+                src = default_storage.open(name, 'rb')
+            except FileNotFoundError:
+                continue  # The row outlived its file
+            # Images are compressed already; store them as they are
+            info = zipfile.ZipInfo(f'media/{name}', date_time=timezone.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with src, zf.open(info, 'w', force_zip64=True) as fh:
+                for chunk in src.chunks(CHUNK_SIZE):
+                    fh.write(chunk)
+                    if sink.size >= CHUNK_SIZE:
+                        yield sink.drain()
+    yield sink.drain()
+
+
+async def aexport_chunks(user):
+    """export_chunks() as an async iterator, each piece built in the sync thread as it is asked for."""
+    chunks = export_chunks(user)
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # Closes the zip and its open querysets when the client goes away half way
+        await sync_to_async(chunks.close)()
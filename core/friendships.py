@@ -0,0 +1,77 @@
+"""
+Friendship graph mutations.
+
+A friendship is stored as two Friendship rows (one per direction). Every
+mutation here writes both rows in a single transaction so the graph never
+ends up asymmetric, and uses bulk statements to keep round trips low.
+"""
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Friendship, FriendRequest, Notification, User
+from .notifications import notify, notify_many
+
+
+def _pair_rows(user_id, friend_id):
+    return [
+        Friendship(user_id=user_id, friend_id=friend_id),
+        Friendship(user_id=friend_id, friend_id=user_id),
+    ]
+
+
+def _pair_filter(user_id, friend_id):
+    return Q(user_id=user_id, friend_id=friend_id) | Q(user_id=friend_id, friend_id=user_id)
+
+
+def unfriend(user, friend):
+    # Both directions in one DELETE
+    Friendship.objects.filter(_pair_filter(user.id, friend.id)).delete()
+
+
+def accept_request(friend_request):
+    with transaction.atomic():
+        # Deleting first makes a double accept a no-op for the loser
+        deleted, _ = FriendRequest.objects.filter(id=friend_request.id).delete()
+        if not deleted:
+            return False
+        Friendship.objects.bulk_create(
+            _pair_rows(friend_request.to_user_id, friend_request.from_user_id),
+            ignore_conflicts=True,
+        )
+        notify(Notification.VERB_FRIEND_ACCEPT, friend_request.from_user_id, friend_request.to_user_id)
+    return True
+
+
+def accept_all_requests(user):
+    with transaction.atomic():
+        sender_ids = list(
+            FriendRequest.objects.filter(to_user=user).values_list('from_user_id', flat=True)
+        )
+        if not sender_ids:
+            return 0
+        rows = []
+        for sender_id in sender_ids:
+            rows.extend(_pair_rows(user.id, sender_id))
+        Friendship.objects.bulk_create(rows, ignore_conflicts=True)
+        FriendRequest.objects.filter(to_user=user, from_user_id__in=sender_ids).delete()
+        notify_many(Notification.VERB_FRIEND_ACCEPT, sender_ids, user.id)
+    return len(sender_ids)
+
+
+def import_friends(user, usernames, batch_size=500):
+    # Befriend every existing user in `usernames`; unknown names are skipped
+    friend_ids = list(
+        User.objects.filter(username__in=set(usernames)).exclude(id=user.id).values_list('id', flat=True)
+    )
+    if not friend_ids:
+        return 0
+    rows = []
+    for friend_id in friend_ids:
+        rows.extend(_pair_rows(user.id, friend_id))
+    with transaction.atomic():
+        Friendship.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+        FriendRequest.objects.filter(
+            Q(from_user=user, to_user_id__in=friend_ids) | Q(to_user=user, from_user_id__in=friend_ids)
+        ).delete()
+    return len(friend_ids)
@@ -0,0 +1,341 @@
+"""
+Bulk import of users, friendships, posts, comments, likes, conversations
+and messages, for migrating communities in and seeding staging.
+
+import_directory() reads `<kind>.csv` or `<kind>.ndjson` for each kind in
+KINDS, in that order, and writes every BATCH_SIZE rows with one
+bulk_create in its own transaction. Records name users by username and
+posts, comments and conversations by the `id` column of their own file;
+those ids are mapped to database ids as rows go in, so a file can only
+point at rows from the same import. Rows that point at nothing are
+skipped and counted.
+
+Columns (optional ones in brackets):
+    users          username [email first_name last_name bio location website
+                   date_joined password password_hash]
+    friendships    user friend  (one row makes both directions)
+    posts          id user [content image created_at]
+    comments       post user [id parent content created_at]
+    likes          post user [created_at]
+    conversations  id members [title is_group]  (members: a list, or "a;b" in CSV)
+    messages       conversation sender [content created_at]
+
+Users, friendships, likes, conversation members and one-to-one
+conversations are inserted with ignore_conflicts, so importing them again
+is harmless; users that already exist are counted as skipped. Posts,
+comments and messages have no natural key and are added every time.
+
+Password hashing is deliberately slow, so it is kept out of the row loop.
+A `password_hash` already in Django's format is stored as it is. Rows
+without one share a single hash of the --password default, and plain
+`password` values are hashed once per distinct value.
+
+Conversations are numbered by the conversation directory and written with
+their members and messages to their shard (see core.sharding).
+
+Bulk inserts send no signals. Search documents are written per batch, and
+like, comment and reply counts and read watermarks are rebuilt at the end.
+"""
+
+import csv
+import json
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import conversations, search, sharding
+from .comments import reconcile_comment_counts
+from .conversations import direct_key
+from .friendships import _pair_rows
+from .likes import reconcile_like_counts
+from .models import Comment, Conversation, ConversationMember, Friendship, Like, Message, Post, User
+
+KINDS = ('users', 'friendships', 'posts', 'comments', 'likes', 'conversations', 'messages')
+BATCH_SIZE = 1000
+
+USER_FIELDS = ('email', 'first_name', 'last_name', 'bio', 'location', 'website')
+
+
+def read_rows(path):
+    """Yield dicts from a .csv file (with a header row) or an .ndjson file."""
+    path = Path(path)
+    with open(path, newline='', encoding='utf-8') as fh:
+        if path.suffix == '.csv':
+            yield from csv.DictReader(fh)
+        else:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _datetime(value, default):
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'Bad datetime {value!r}')
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def _members(value):
+    # A JSON list in NDJSON; "alice;bob" in CSV
+    if isinstance(value, list):
+        return value
+    return [name for name in (value or '').split(';') if name]
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+class Importer:
+    def __init__(self, batch_size=BATCH_SIZE, password=None):
+        self.batch_size = batch_size
+        # Unusable unless a default is given; either way it is hashed once for every row
+        self.default_hash = make_password(password)
+        self.hashes = {}
+        self.user_ids = {}
+        self.post_ids = {}  # source id -> post id
+        self.comment_ids = {}  # source id -> (comment id, top-level comment id)
+        self.conversation_ids = {}
+        self.stats = {}
+
+    def import_directory(self, directory):
+        """Import every `<kind>.csv` / `<kind>.ndjson` in `directory`. Returns {kind: stats}."""
+        directory = Path(directory)
+        for kind in KINDS:
+            for suffix in ('.csv', '.ndjson'):
+                path = directory / f'{kind}{suffix}'
+                if path.exists():
+                    self.import_file(kind, path)
+        started = time.perf_counter()
+        self.rebuild_summaries()
+        self.stats['summaries'] = {'rows': 0, 'skipped': 0, 'seconds': time.perf_counter() - started}
+        return self.stats
+
+    def import_file(self, kind, path):
+        stats = self.stats.setdefault(kind, {'rows': 0, 'skipped': 0, 'seconds': 0.0})
+        started = time.perf_counter()
+        load = getattr(self, f'load_{kind}')
+        if kind == 'comments':
+            # Replies need their thread's id, so the file is read twice: top-level comments first
+            sources = [
+                (row for row in read_rows(path) if not row.get('parent')),
+                (row for row in read_rows(path) if row.get('parent')),
+            ]
+        else:
+            sources = [read_rows(path)]
+        for rows in sources:
+            for batch in _batches(rows, self.batch_size):
+                # One transaction per database; they commit one after the other
+                with ExitStack() as stack:
+                    for alias in {DEFAULT_DB_ALIAS, *sharding.aliases()}:
+                        stack.enter_context(transaction.atomic(using=alias))
+                    loaded = load(batch)
+                stats['rows'] += loaded
+                stats['skipped'] += len(batch) - loaded
+        stats['seconds'] += time.perf_counter() - started
+        return stats
+
+    def _password(self, row):
+        if row.get('password_hash'):
+            return row['password_hash']
+        if row.get('password'):
+            if row['password'] not in self.hashes:
+                self.hashes[row['password']] = make_password(row['password'])
+            return self.hashes[row['password']]
+        return self.default_hash
+
+    def _resolve_users(self, usernames):
+        missing = {name for name in usernames if name not in self.user_ids}
+        if missing:
+            self.user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        return self.user_ids
+
+    def load_users(self, rows):
+        now = timezone.now()
+        # bulk_create(ignore_conflicts=True) does not say which rows it dropped, so existing
+        # usernames, and repeats within the batch, are left out (and counted as skipped) up front
+        existing = set(
+            User.objects.filter(username__in=[row['username'] for row in rows]).values_list('username', flat=True)
+        )
+        new_rows = {}
+        for row in rows:
+            if row['username'] not in existing:
+                new_rows.setdefault(row['username'], row)
+        users = [
+            User(
+                username=row['username'],
+                password=self._password(row),
+                date_joined=_datetime(row.get('date_joined'), now),
+                **{field: row.get(field) or '' for field in USER_FIELDS},
+            )
+            for row in new_rows.values()
+        ]
+        User.objects.bulk_create(users, ignore_conflicts=True)
+        return len(users)
+
+    def load_friendships(self, rows):
+        user_ids = self._resolve_users([name for row in rows for name in (row['user'], row['friend'])])
+        pairs = [
+            (user_ids[row['user']], user_ids[row['friend']])
+            for row in rows
+            if row['user'] in user_ids and row['friend'] in user_ids and row['user'] != row['friend']
+        ]
+        Friendship.objects.bulk_create(
+            [friendship for pair in pairs for friendship in _pair_rows(*pair)], ignore_conflicts=True
+        )
+        return len(pairs)
+
+    def load_posts(self, rows):
+        now = timezone.now()
+        user_ids = self._resolve_users(row['user'] for row in rows)
+        rows = [row for row in rows if row['user'] in user_ids]
+        posts = Post.objects.bulk_create([
+            Post(
+                user_id=user_ids[row['user']],
+                content=row.get('content') or '',
+                image=row.get('image') or None,
+                created_at=_datetime(row.get('created_at'), now),
+            )
+            for row in rows
+        ])
+        for row, post in zip(rows, posts):
+            self.post_ids[str(row['id'])] = post.id
+        search.bulk_index(Post.objects.filter(id__in=[post.id for post in posts]), self.batch_size)
+        return len(posts)
+
+    def load_comments(self, rows):
+        now = timezone.now()
+        user_ids = self._resolve_users(row['user'] for row in rows)
+        threads = {}  # source id -> top-level comment id, for replies earlier in this batch
+        kept, comments = [], []
+        for row in rows:
+            if row['user'] not in user_ids or str(row['post']) not in self.post_ids:
+                continue
+            parent_id = None
+            if row.get('parent'):
+                # Replies to a reply join the top-level thread, as in core.comments.add_comment
+                parent = str(row['parent'])
+                parent_id = self.comment_ids[parent][1] if parent in self.comment_ids else threads.get(parent)
+                if parent_id is None:
+                    continue
+                if row.get('id'):
+                    threads[str(row['id'])] = parent_id
+            kept.append(row)
+            comments.append(Comment(
+                post_id=self.post_ids[str(row['post'])],
+                user_id=user_ids[row['user']],
+                parent_id=parent_id,
+                content=row.get('content') or '',
+                created_at=_datetime(row.get('created_at'), now),
+            ))
+        comments = Comment.objects.bulk_create(comments)
+        for row, comment in zip(kept, comments):
+            if row.get('id'):
+                self.comment_ids[str(row['id'])] = (comment.id, comment.parent_id or comment.id)
+        search.bulk_index(Comment.objects.filter(id__in=[comment.id for comment in comments]), self.batch_size)
+        return len(comments)
+
+    def load_likes(self, rows):
+        now = timezone.now()
+        user_ids = self._resolve_users(row['user'] for row in rows)
+        likes = [
+            Like(
+                post_id=self.post_ids[str(row['post'])],
+                user_id=user_ids[row['user']],
+                created_at=_datetime(row.get('created_at'), now),
+            )
+            for row in rows
+            if row['user'] in user_ids and str(row['post']) in self.post_ids
+        ]
+        Like.objects.bulk_create(likes, ignore_conflicts=True)
+        return len(likes)
+
+    def load_conversations(self, rows):
+        user_ids = self._resolve_users(name for row in rows for name in _members(row.get('members')))
+        direct, groups = [], []
+        for row in rows:
+            members = [user_ids[name] for name in _members(row.get('members')) if name in user_ids]
+            if _flag(row.get('is_group')) or len(members) > 2:
+                groups.append((row, members))
+            elif len(members) == 2:
+                direct.append((row, members))
+
+        # One-to-one conversations are unique per pair; an existing one is reused
+        pairs = conversations.bulk_create(
+            [Conversation(direct_key=direct_key(*members)) for _, members in direct], self.batch_size
+        )
+        created = conversations.bulk_create(
+            [Conversation(is_group=True, title=row.get('title') or '') for row, _ in groups], self.batch_size
+        )
+
+        memberships = []
+        for (row, members), conversation in zip(direct, pairs):
+            self.conversation_ids[str(row['id'])] = conversation.id
+            memberships.extend(ConversationMember(conversation_id=conversation.id, user_id=user_id) for user_id in members)
+        for (row, members), conversation in zip(groups, created):
+            self.conversation_ids[str(row['id'])] = conversation.id
+            # The first member listed created the group
+            memberships.extend(
+                ConversationMember(conversation_id=conversation.id, user_id=user_id, is_admin=i == 0)
+                for i, user_id in enumerate(members)
+            )
+        sharding.bulk_create(ConversationMember, memberships, ignore_conflicts=True)
+        return len(direct) + len(groups)
+
+    def load_messages(self, rows):
+        now = timezone.now()
+        user_ids = self._resolve_users(row['sender'] for row in rows)
+        messages = sharding.bulk_create(Message, [
+            Message(
+                conversation_id=self.conversation_ids[str(row['conversation'])],
+                sender_id=user_ids[row['sender']],
+                content=row.get('content') or '',
+                created_at=_datetime(row.get('created_at'), now),
+            )
+            for row in rows
+            if row['sender'] in user_ids and str(row['conversation']) in self.conversation_ids
+        ])
+        # Message ids are unique across shards
+        for shard in sharding.each_shard(Message.objects.filter(id__in=[message.id for message in messages])):
+            search.bulk_index(shard, self.batch_size)
+        return len(messages)
+
+    def rebuild_summaries(self):
+        post_ids = list(self.post_ids.values())
+        for start in range(0, len(post_ids), self.batch_size):
+            with transaction.atomic():
+                reconcile_like_counts(post_ids[start:start + self.batch_size])
+                reconcile_comment_counts(post_ids[start:start + self.batch_size])
+
+        # Imported history counts as read; only messages sent from now on are unread
+        conversation_ids = list(set(self.conversation_ids.values()))
+        latest = Message.objects.filter(conversation_id=OuterRef('conversation_id')).order_by('-id').values('id')[:1]
+        for shard, ids in sharding.group_by_shard(conversation_ids).items():
+            for start in range(0, len(ids), self.batch_size):
+                ConversationMember.objects.using(shard).filter(
+                    conversation_id__in=ids[start:start + self.batch_size]
+                ).update(last_read_message_id=Coalesce(Subquery(latest), 0))
+
+
+def import_directory(directory, batch_size=BATCH_SIZE, password=None):
+    return Importer(batch_size=batch_size, password=password).import_directory(directory)
@@ -0,0 +1,187 @@
+"""
+Lightweight DB-backed job queue.
+
+Views enqueue follow-up work with `enqueue()` and return immediately; the
+`run_jobs` management command claims pending jobs in batches and runs them.
+Jobs live in the regular database, so no external broker is needed.
+
+Handlers are registered with the `task` decorator. A handler registered with
+`batch=True` receives a list of payloads so many queued jobs of the same kind
+can be collapsed into a single bulk statement.
+
+With settings.JOB_QUEUE_EAGER enabled jobs run in-process right after the
+enqueuing transaction commits, which is convenient for development.
+
+The queue looks after itself with a `maintain_queue` job that re-queues
+itself every MAINTENANCE_INTERVAL: it puts jobs of crashed workers back
+and deletes finished jobs once they are a week old.
+"""
+
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+MAINTENANCE_INTERVAL = timedelta(minutes=5)
+
+
+class Task:
+    def __init__(self, name, func, batch=False, max_attempts=5):
+        self.name = name
+        self.func = func
+        self.batch = batch
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def run(self, payloads):
+        if self.batch:
+            self.func(payloads)
+        else:
+            for payload in payloads:
+                self.func(**payload)
+
+
+def task(name=None, batch=False, max_attempts=5):
+    def decorator(func):
+        task_name = name or func.__name__
+        _registry[task_name] = Task(task_name, func, batch=batch, max_attempts=max_attempts)
+        return _registry[task_name]
+    return decorator
+
+
+def get_task(name):
+    _load_tasks()
+    return _registry[name]
+
+
+def _load_tasks():
+    # Handlers live in core.tasks; import it lazily to avoid an import cycle
+    from . import tasks  # noqa: F401
+
+
+def enqueue(task_name, delay=None, **payload):
+    return enqueue_many(task_name, [payload], delay=delay)[0]
+
+
+def enqueue_many(task_name, payloads, delay=None):
+    handler = get_task(task_name)
+    run_at = timezone.now() + (delay or timedelta())
+    jobs = [
+        Job(task=task_name, payload=payload, run_at=run_at, max_attempts=handler.max_attempts)
+        for payload in payloads
+    ]
+
+    if getattr(settings, 'JOB_QUEUE_EAGER', False) and delay is None:
+        transaction.on_commit(lambda: _run_eager(handler, [job.payload for job in jobs]))
+        return jobs
+
+    return Job.objects.bulk_create(jobs)
+
+
+def _run_eager(handler, payloads):
+    try:
+        handler.run(payloads)
+    except Exception:
+        logger.exception('Eager job %s failed', handler.name)
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(2 ** attempts, 3600))
+
+
+def claim_jobs(batch_size=100):
+    token = str(uuid.uuid4())
+    now = timezone.now()
+    candidate_ids = list(
+        Job.objects.filter(status=Job.STATUS_PENDING, run_at__lte=now)
+        .order_by('run_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not candidate_ids:
+        return []
+    # Conditional UPDATE so two workers never claim the same job
+    Job.objects.filter(id__in=candidate_ids, status=Job.STATUS_PENDING).update(
+        status=Job.STATUS_RUNNING, locked_by=token, locked_at=now
+    )
+    return list(Job.objects.filter(locked_by=token, status=Job.STATUS_RUNNING))
+
+
+def _finish(jobs, error=None):
+    now = timezone.now()
+    if error is None:
+        Job.objects.filter(id__in=[job.id for job in jobs]).update(
+            status=Job.STATUS_DONE, locked_by='', last_error=''
+        )
+        return
+
+    for job in jobs:
+        job.attempts += 1
+        job.last_error = error
+        job.locked_by = ''
+        if job.attempts >= job.max_attempts:
+            job.status = Job.STATUS_FAILED
+        else:
+            job.status = Job.STATUS_PENDING
+            job.run_at = now + _backoff(job.attempts)
+    Job.objects.bulk_update(jobs, ['attempts', 'last_error', 'locked_by', 'status', 'run_at'])
+
+
+def run_jobs(batch_size=100):
+    """Claim and run one batch of due jobs. Returns the number of jobs processed."""
+    jobs = claim_jobs(batch_size)
+    if not jobs:
+        return 0
+
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.task, []).append(job)
+
+    for task_name, group in groups.items():
+        try:
+            handler = get_task(task_name)
+        except KeyError:
+            _finish(group, error=f'Unknown task {task_name!r}')
+            continue
+
+        try:
+            with transaction.atomic():
+                handler.run([job.payload for job in group])
+        except Exception:
+            logger.exception('Job batch %s failed', task_name)
+            _finish(group, error=traceback.format_exc())
+        else:
+            _finish(group)
+
+    return len(jobs)
+
+
+def release_stale_jobs(timeout=timedelta(minutes=10)):
+    # Jobs left running by a crashed worker go back to the queue
+    cutoff = timezone.now() - timeout
+    return Job.objects.filter(status=Job.STATUS_RUNNING, locked_at__lt=cutoff).update(
+        status=Job.STATUS_PENDING, locked_by=''
+    )
+
+
+def purge_finished_jobs(older_than=timedelta(days=7)):
+    cutoff = timezone.now() - older_than
+    deleted, _ = Job.objects.filter(status=Job.STATUS_DONE, run_at__lt=cutoff).delete()
+    return deleted
+
+
+def schedule_maintenance(delay=None):
+    """Queue the next maintain_queue run unless one is already waiting."""
+    if not Job.objects.filter(task='maintain_queue', status=Job.STATUS_PENDING).exists():
+        enqueue('maintain_queue', delay=delay)
@@ -0,0 +1,66 @@
+"""
+Like toggling backed by the denormalized Post.like_count counter.
+
+The counter only moves when a row is actually inserted or deleted, so
+concurrent toggles (double clicks, several tabs) can never drift it away
+from the real number of Like rows.
+"""
+
+import sqlite3
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import trending
+from .models import Like, Post
+
+
+def _supports_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def _bump_like_count(post_id, delta):
+    # Adjust the counter and read it back, in one statement where the backend allows it
+    if _supports_returning():
+        table = Post._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET like_count = like_count + %s WHERE id = %s RETURNING like_count',
+                [delta, post_id],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
+    Post.objects.filter(id=post_id).update(like_count=F('like_count') + delta)
+    return Post.objects.values_list('like_count', flat=True).get(id=post_id)
+
+
+def toggle_like(post_id, user_id):
+    """Like or unlike a post. Returns (liked, like_count)."""
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(post_id=post_id, user_id=user_id).delete()
+        if deleted:
+            # Likes are scored by a post_save signal; deletes send none, so unlikes are recorded here
+            trending.record(post_id, 'like', sign=-1)
+            return False, _bump_like_count(post_id, -1)
+
+        try:
+            with transaction.atomic():
+                Like.objects.create(post_id=post_id, user_id=user_id)
+        except IntegrityError:
+            # A concurrent request inserted the same like first; it already counted it
+            return True, Post.objects.values_list('like_count', flat=True).get(id=post_id)
+        return True, _bump_like_count(post_id, 1)
+
+
+def reconcile_like_counts(post_ids=None):
+    """Recompute like_count from the Like table (for repair jobs)."""
+    counts = Like.objects.filter(post=OuterRef('pk')).values('post').annotate(n=Count('id')).values('n')
+    posts = Post.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(id__in=post_ids)
+    return posts.update(like_count=Coalesce(Subquery(counts), 0))
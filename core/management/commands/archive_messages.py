@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import archive, sharding
+from core.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Move messages older than the retention window into compressed archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=archive.DEFAULT_RETENTION_DAYS,
+                            help='Keep this many days of messages in the hot table')
+        parser.add_argument('--segment-size', type=int, default=archive.DEFAULT_SEGMENT_SIZE,
+                            help='Messages per archive segment')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many messages would move')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+            old = Message.objects.filter(created_at__lt=cutoff)
+            count = sum(shard.count() for shard in sharding.each_shard(old))
+            self.stdout.write(f'{count} message(s) older than {options["days"]} days would be archived')
+            return
+
+        moved = archive.archive_old_messages(options['days'], options['segment_size'])
+        total = sum(moved.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total} message(s) from {len(moved)} conversation(s)'
+        ))
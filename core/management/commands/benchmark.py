@@ -0,0 +1,187 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from core import conversations, sharding, synthetic
+from core.models import Post
+
+DEFAULT_SIZES = '50,200'
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def test_databases():
+    """Throwaway test databases for 'default' and every message shard, destroyed on exit."""
+    created = []
+    try:
+        for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *sharding.aliases()]):
+            db = connections[alias]
+            old_name = db.settings_dict['NAME']
+            db.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+            # Recorded only once created, so a failure never destroys a real database
+            created.append((db, old_name))
+        yield
+    finally:
+        for db, old_name in reversed(created):
+            db.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark core views against synthetic data sets of several sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated user counts')
+        parser.add_argument('--repeat', type=int, default=20, help='Requests per view')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write results as a JSON baseline to this path')
+        parser.add_argument('--compare', help='Compare against a previously saved JSON baseline')
+        parser.add_argument('--max-slowdown', type=float, default=0.25,
+                            help='Allowed p95 latency growth vs. the baseline (0.25 = 25%%)')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        setup_test_environment()
+        # Each size runs in throwaway test databases, never the real ones or their shards
+        try:
+            results = {}
+            for size in sizes:
+                with test_databases():
+                    results[str(size)] = self.run_size(size, options)
+        finally:
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'commit': _git_commit(),
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+                fh.write('\n')
+            self.stdout.write(f"Baseline written to {options['output']}")
+
+        if options['compare']:
+            self.compare(report, options['compare'], options['max_slowdown'])
+
+    def run_size(self, size, options):
+        summary = synthetic.generate(users=size, seed=options['seed'])
+        self.stdout.write(f'\n== {size} users: ' + ', '.join(f'{k}={v}' for k, v in summary.items()))
+
+        viewer = synthetic.hub_user()
+        post = Post.objects.filter(user=viewer).first() or Post.objects.first()
+        conversation_id = next(iter(conversations.conversation_ids(viewer)), None)
+        targets = {
+            'home_view': reverse('home'),
+            'profile_view': reverse('profile', args=[viewer.username]),
+            'messages_view': reverse('messages'),
+            'find_friends_view': reverse('find_friends'),
+        }
+        if conversation_id:
+            targets['get_messages_json'] = reverse('get_messages_json', args=[conversation_id])
+        if post:
+            targets['get_comments'] = reverse('get_comments', args=[post.id])
+
+        client = Client()
+        client.force_login(viewer)
+
+        results = {'data': summary}
+        for name, url in targets.items():
+            # Back-to-back requests from one user would otherwise be throttled
+            with override_settings(RATE_LIMITS={'ENABLED': False}):
+                results[name] = self.measure(client, url, options['repeat'])
+            r = results[name]
+            self.stdout.write(
+                f"{name:<20} p50={r['p50_ms']:8.2f}ms p95={r['p95_ms']:8.2f}ms "
+                f"p99={r['p99_ms']:8.2f}ms queries={r['queries']:4d} peak={r['peak_kib']:9.1f}KiB"
+            )
+        return results
+
+    def measure(self, client, url, repeat):
+        # Warm-up request fills caches and template loaders
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'{url} returned {response.status_code}')
+
+        with CaptureQueriesContext(connection) as ctx:
+            client.get(url)
+        queries = len(ctx.captured_queries)
+
+        tracemalloc.start()
+        client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            client.get(url)
+            samples.append((time.perf_counter() - start) * 1000)
+
+        return {
+            'p50_ms': round(_percentile(samples, 50), 3),
+            'p95_ms': round(_percentile(samples, 95), 3),
+            'p99_ms': round(_percentile(samples, 99), 3),
+            'mean_ms': round(statistics.mean(samples), 3),
+            'queries': queries,
+            'peak_kib': round(peak / 1024, 1),
+        }
+
+    def compare(self, report, path, max_slowdown):
+        try:
+            with open(path) as fh:
+                baseline = json.load(fh)
+        except FileNotFoundError:
+            raise CommandError(f'Baseline {path} not found')
+
+        self.stdout.write(f"\n== Compared with {path} (commit {baseline['meta'].get('commit')})")
+        regressions = []
+        for size, views in report['results'].items():
+            for name, current in views.items():
+                previous = baseline['results'].get(size, {}).get(name)
+                if name == 'data' or not previous:
+                    continue
+                slowdown = current['p95_ms'] / previous['p95_ms'] - 1 if previous['p95_ms'] else 0
+                line = (
+                    f"[{size}] {name:<20} p95 {previous['p95_ms']:.2f} -> {current['p95_ms']:.2f}ms "
+                    f"({slowdown:+.0%}), queries {previous['queries']} -> {current['queries']}"
+                )
+                self.stdout.write(line)
+                if current['queries'] > previous['queries'] or slowdown > max_slowdown:
+                    regressions.append(line)
+
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
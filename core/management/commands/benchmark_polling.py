@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from core import sharding, synthetic
+from core.management.commands.benchmark import _git_commit, _percentile, test_databases
+from core.models import ConversationMember, Friendship, Post, User
+
+MODES = ('wsgi', 'asgi')
+DEFAULT_CONCURRENCY = '10,50,200'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare how many concurrent polling clients the site sustains under WSGI '
+        '(sync views, fixed worker threads) and ASGI (core.async_views)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Synthetic users; each client polls as its own user')
+        parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY, help='Comma separated client counts')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per client at each level')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write results as JSON to this path')
+        # Internal: run one mode in this process and print its results as JSON
+        parser.add_argument('--mode', choices=MODES, help='Run a single mode (used by the parent process)')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            self.stdout.write(json.dumps(self.run_mode(options)))
+            return
+
+        # Each mode runs in its own process: settings.ASYNC_VIEWS is fixed once the URLconf loads
+        results = {}
+        for mode in MODES:
+            results[mode] = self.spawn(mode, options)
+
+        report = {
+            'meta': {
+                'commit': _git_commit(),
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'users': options['users'],
+                'requests': options['requests'],
+                'wsgi_threads': options['threads'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+        self.print_report(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+                fh.write('\n')
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def spawn(self, mode, options):
+        command = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark_polling', '--mode', mode,
+            '--users', str(options['users']), '--concurrency', options['concurrency'],
+            '--requests', str(options['requests']), '--threads', str(options['threads']),
+            '--seed', str(options['seed']),
+        ]
+        env = {**os.environ, 'SOCIAL_CONNECT_ASYNC_VIEWS': '1' if mode == 'asgi' else '0'}
+        self.stdout.write(f'Running {mode.upper()} workload...')
+        proc = subprocess.run(command, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise CommandError(f'{mode} run failed:\n{proc.stderr}')
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def print_report(self, results):
+        self.stdout.write(
+            f"\n{'clients':>8} {'mode':>5} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7} {'threads':>8}"
+        )
+        for level in results[MODES[0]]:
+            for mode in MODES:
+                r = results[mode][level]
+                self.stdout.write(
+                    f"{level:>8} {mode:>5} {r['throughput_rps']:9.1f} {r['p50_ms']:7.2f}ms "
+                    f"{r['p95_ms']:7.2f}ms {r['p99_ms']:7.2f}ms {r['errors']:7d} {r['peak_threads']:8d}"
+                )
+
+    def run_mode(self, options):
+        expected = options['mode'] == 'asgi'
+        if settings.ASYNC_VIEWS != expected:
+            raise CommandError(f"settings.ASYNC_VIEWS is {settings.ASYNC_VIEWS} for a {options['mode']} run")
+
+        setup_test_environment()
+        try:
+            with test_databases():
+                synthetic.generate(users=options['users'], seed=options['seed'])
+                clients = self.clients()
+                levels = [int(level) for level in options['concurrency'].split(',') if level]
+                # Clients are throttled per user; that is not what is being measured here
+                with override_settings(RATE_LIMITS={'ENABLED': False}):
+                    self.warm_up(clients)
+                    return {
+                        str(level): self.run_level(options, clients, level)
+                        for level in levels
+                    }
+        finally:
+            teardown_test_environment()
+
+    def clients(self):
+        """Session cookie and polling URLs for every synthetic user with a conversation."""
+        friends = dict(Friendship.objects.values_list('user_id', 'friend_id'))
+        memberships = ConversationMember.objects.values_list('user_id', 'conversation_id')
+        conversations = dict(row for shard in sharding.each_shard(memberships) for row in shard)
+        posts = list(Post.objects.values_list('id', flat=True)[:100])
+        clients = []
+        for user in User.objects.filter(id__in=list(conversations)).order_by('id'):
+            client = Client()
+            client.force_login(user)
+            clients.append({
+                'cookie': f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}",
+                # The same mix the pages poll: messages every 3s, status every 10s, comments on open
+                'urls': [
+                    reverse('get_messages_json', args=[conversations[user.id]]),
+                    reverse('get_user_status', args=[friends.get(user.id, user.id)]),
+                    reverse('get_messages_json', args=[conversations[user.id]]),
+                    reverse('get_comments', args=[posts[user.id % len(posts)]]),
+                ],
+            })
+        if not clients:
+            raise CommandError('Synthetic data has no conversations to poll')
+        return clients
+
+    def warm_up(self, clients):
+        # The first poll of each conversation moves the read watermark; measure steady-state polls only
+        for client in clients:
+            for url in client['urls']:
+                _, status = self.request(client, url)
+                if status != 200:
+                    raise CommandError(f'{url} returned {status}')
+
+    def request(self, client, url):
+        if settings.ASYNC_VIEWS:
+            return asyncio.run(_asgi_get(self.asgi_handler, url, client['cookie']))
+        return _wsgi_get(self.wsgi_handler, url, client['cookie'])
+
+    @cached_property
+    def wsgi_handler(self):
+        return WSGIHandler()
+
+    @cached_property
+    def asgi_handler(self):
+        return ASGIHandler()
+
+    def run_level(self, options, clients, level):
+        active = [clients[i % len(clients)] for i in range(level)]
+        peak = _ThreadPeak()
+        if settings.ASYNC_VIEWS:
+            samples, errors, elapsed = asyncio.run(self.drive_asgi(active, options['requests'], peak))
+        else:
+            samples, errors, elapsed = asyncio.run(self.drive_wsgi(active, options['requests'], options['threads'], peak))
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'throughput_rps': round(len(samples) / elapsed, 1),
+            'p50_ms': round(_percentile(samples, 50), 3),
+            'p95_ms': round(_percentile(samples, 95), 3),
+            'p99_ms': round(_percentile(samples, 99), 3),
+            'mean_ms': round(statistics.mean(samples), 3),
+            'peak_threads': peak.value,
+        }
+
+    async def drive_wsgi(self, clients, requests, threads, peak):
+        # Every client waits for one of `threads` workers, as with a threaded WSGI server
+        loop = asyncio.get_running_loop()
+        handler = self.wsgi_handler
+        with ThreadPoolExecutor(threads) as pool:
+            return await _drive(
+                clients, requests, peak,
+                lambda client, url: loop.run_in_executor(pool, _wsgi_get, handler, url, client['cookie']),
+            )
+
+    async def drive_asgi(self, clients, requests, peak):
+        handler = self.asgi_handler
+        return await _drive(clients, requests, peak, lambda client, url: _asgi_get(handler, url, client['cookie']))
+
+
+class _ThreadPeak:
+    def __init__(self):
+        self.value = threading.active_count()
+
+    def sample(self):
+        self.value = max(self.value, threading.active_count())
+
+
+async def _drive(clients, requests, peak, get):
+    """Run every client's polls back to back, all clients at once; latency includes queueing."""
+    samples = []
+    errors = 0
+
+    async def run_client(client):
+        nonlocal errors
+        for i in range(requests):
+            start = time.perf_counter()
+            _, status = await get(client, client['urls'][i % len(client['urls'])])
+            samples.append((time.perf_counter() - start) * 1000)
+            peak.sample()
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(client) for client in clients))
+    return samples, errors, time.perf_counter() - start
+
+
+def _wsgi_get(handler, path, cookie):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'testserver',
+        'HTTP_COOKIE': cookie,
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    response = handler(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+    try:
+        body = b''.join(response)
+    finally:
+        response.close()
+    return body, int(status[0].split()[0])
+
+
+async def _asgi_get(handler, path, cookie):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    status = None
+    body = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+
+    await handler(scope, receive, send)
+    return b''.join(body), status
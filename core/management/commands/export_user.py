@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import export
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = "Write a user's posts, comments, messages and media to a zip file, streaming it chunk by chunk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', help='Zip file to write (default: <username>-export.zip)')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}")
+
+        output = options['output'] or f'{user.username}-export.zip'
+        written = 0
+        with open(output, 'wb') as fh:
+            for chunk in export.export_chunks(user):
+                fh.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Exported {user.username} to {output} ({written} bytes)'))
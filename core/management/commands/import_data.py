@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import users, friendships, posts, comments, likes, conversations and messages '
+        'from <kind>.csv / <kind>.ndjson files in a directory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE, help='Rows per INSERT and transaction')
+        parser.add_argument('--password', help='Password for imported users without one (default: unusable)')
+
+    def handle(self, *args, **options):
+        directory = Path(options['directory'])
+        if not directory.is_dir():
+            raise CommandError(f'{directory} is not a directory')
+
+        stats = importer.import_directory(directory, batch_size=options['batch_size'], password=options['password'])
+
+        self.stdout.write(f"{'kind':<14} {'rows':>9} {'skipped':>8} {'seconds':>8} {'rows/s':>10}")
+        total_rows = total_seconds = 0
+        for kind, row in stats.items():
+            rate = row['rows'] / row['seconds'] if row['seconds'] else 0
+            self.stdout.write(
+                f"{kind:<14} {row['rows']:9d} {row['skipped']:8d} {row['seconds']:8.2f} {rate:10.0f}"
+            )
+            total_rows += row['rows']
+            total_seconds += row['seconds']
+        rate = total_rows / total_seconds if total_seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total_rows} row(s) in {total_seconds:.2f}s ({rate:.0f} rows/s)'
+        ))
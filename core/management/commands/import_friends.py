@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import friendships
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = 'Befriend a user with every account listed in a file of usernames, one per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('file', help="File of usernames, one per line ('-' for stdin)")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}")
+
+        if options['file'] == '-':
+            usernames = [line.strip() for line in sys.stdin]
+        else:
+            try:
+                with open(options['file']) as fh:
+                    usernames = [line.strip() for line in fh]
+            except OSError as exc:
+                raise CommandError(f"Cannot read {options['file']}: {exc}")
+        usernames = [name for name in usernames if name]
+
+        added = friendships.import_friends(user, usernames, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{user.username} is now friends with {added} of {len(set(usernames))} listed users'
+        ))
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from core import sharding
+from core.models import Conversation, ConversationMember, Message, MessageArchiveSegment
+
+# Copied after their conversation and deleted before it
+CHILD_MODELS = (ConversationMember, MessageArchiveSegment, Message)
+
+# Numbered by each database on its own, so their ids would collide on the target;
+# nothing refers to them by id. Conversation and message ids are unique across shards.
+RENUMBERED_MODELS = (ConversationMember, MessageArchiveSegment)
+
+
+def _aliases(value):
+    return [alias.strip() for alias in (value or '').split(',') if alias.strip()]
+
+
+def _rows(model, conversation_id, using):
+    field = 'id' if model is Conversation else 'conversation_id'
+    return model._base_manager.using(using).filter(**{field: conversation_id}).order_by('pk')
+
+
+class Command(BaseCommand):
+    help = (
+        'Move every conversation, with its members, archive segments and messages, to the shard its id '
+        'maps to. Ids are kept. Stop writes to conversations while it runs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='sources',
+                            help='Comma-separated databases to move rows out of (default: every configured one)')
+        parser.add_argument('--to', dest='shards',
+                            help='Comma-separated shard list, in order (default: settings.MESSAGE_SHARDS)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT and per DELETE')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would move')
+
+    def handle(self, *args, **options):
+        shards = _aliases(options['shards']) or sharding.aliases()
+        sources = _aliases(options['sources']) or list(settings.DATABASES)
+        unknown = sorted({*shards, *sources} - set(connections.databases))
+        if unknown:
+            raise CommandError(f"Unknown database(s): {', '.join(unknown)}")
+
+        moves = {}
+        for source in sources:
+            conversation_ids = Conversation._base_manager.using(source).order_by('id').values_list('id', flat=True)
+            for conversation_id in list(conversation_ids):
+                target = sharding.shard_for(conversation_id, shards)
+                if target == source:
+                    continue
+                messages = _rows(Message, conversation_id, source).count()
+                if not options['dry_run']:
+                    self.move(conversation_id, source, target, options['batch_size'])
+                counts = moves.setdefault((source, target), [0, 0])
+                counts[0] += 1
+                counts[1] += messages
+
+        if not options['dry_run']:
+            # Moved messages keep their ids, which may lie in another shard's range
+            for shard in shards:
+                sharding.reserve_message_ids(shard, shards, among=shards)
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        for (source, target), (conversation_count, message_count) in moves.items():
+            self.stdout.write(f'{source} -> {target}: {conversation_count} conversation(s), {message_count} message(s)')
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {sum(c for c, _ in moves.values())} conversation(s) '
+            f'and {sum(m for _, m in moves.values())} message(s)'
+        ))
+
+    def move(self, conversation_id, source, target, batch_size):
+        updated_at = _rows(Conversation, conversation_id, source).values_list('updated_at', flat=True).get()
+        # The target gets the whole conversation or nothing; leftovers of an interrupted run are replaced
+        with transaction.atomic(using=target):
+            self.delete(conversation_id, target, batch_size)
+            for model in (Conversation, *CHILD_MODELS):
+                batch = []
+                for row in _rows(model, conversation_id, source).iterator(chunk_size=batch_size):
+                    if model in RENUMBERED_MODELS:
+                        row.pk = None
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        model._base_manager.using(target).bulk_create(batch)
+                        batch = []
+                model._base_manager.using(target).bulk_create(batch)
+            # bulk_create stamps auto_now fields, which would reorder inboxes
+            _rows(Conversation, conversation_id, target).update(updated_at=updated_at)
+        self.delete(conversation_id, source, batch_size)
+
+    def delete(self, conversation_id, using, batch_size):
+        # Raw deletes, children first: a cascading delete would also remove the
+        # search documents in 'default', which still point at the right ids
+        for model in (*CHILD_MODELS, Conversation):
+            rows = _rows(model, conversation_id, using)
+            while True:
+                ids = list(rows.values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    break
+                model._base_manager.using(using).filter(pk__in=ids)._raw_delete(using)
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import deletion, jobs, trending
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain due jobs once and exit')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        released = jobs.release_stale_jobs()
+        if released:
+            self.stdout.write(f'Released {released} stale job(s)')
+        # Periodic jobs re-queue themselves; make sure each chain is running
+        trending.schedule_refresh()
+        deletion.schedule_purge()
+        jobs.schedule_maintenance()
+
+        try:
+            while True:
+                processed = jobs.run_jobs(batch_size=batch_size)
+                if processed:
+                    self.stdout.write(f'Processed {processed} job(s)')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Worker stopped')
@@ -0,0 +1,93 @@
+"""
+In-process request metrics, rendered in the Prometheus text format.
+
+Filled by core.middleware.InstrumentationMiddleware and exposed by the
+`metrics` view. Each worker process keeps its own numbers; Prometheus sums
+them across scrape targets.
+"""
+
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.queries_sum = 0
+        self.query_buckets = [0] * len(QUERY_BUCKETS)
+        self.db_time_sum = 0.0
+        self.template_time_sum = 0.0
+        self.budget_exceeded = 0
+        self.n_plus_one = 0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, latency, queries, db_time, template_time, over_budget, n_plus_one):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = _ViewStats()
+            stats.requests += 1
+            stats.latency_sum += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    stats.latency_buckets[i] += 1
+            stats.queries_sum += queries
+            for i, bound in enumerate(QUERY_BUCKETS):
+                if queries <= bound:
+                    stats.query_buckets[i] += 1
+            stats.db_time_sum += db_time
+            stats.template_time_sum += template_time
+            stats.budget_exceeded += int(over_budget)
+            stats.n_plus_one += int(n_plus_one)
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def render(self):
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = []
+
+            def family(name, kind, help_text):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+            def histogram(name, help_text, bounds, attr_buckets, attr_sum):
+                family(name, 'histogram', help_text)
+                for view, stats in views:
+                    for bound, count in zip(bounds, getattr(stats, attr_buckets)):
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{view="{view}",le="+Inf"}} {stats.requests}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {getattr(stats, attr_sum)}')
+                    lines.append(f'{name}_count{{view="{view}"}} {stats.requests}')
+
+            def counter(name, help_text, attr):
+                family(name, 'counter', help_text)
+                for view, stats in views:
+                    lines.append(f'{name}{{view="{view}"}} {getattr(stats, attr)}')
+
+            histogram('socialconnect_request_duration_seconds', 'Total request latency.',
+                      LATENCY_BUCKETS, 'latency_buckets', 'latency_sum')
+            histogram('socialconnect_db_queries_per_request', 'Database queries issued per request.',
+                      QUERY_BUCKETS, 'query_buckets', 'queries_sum')
+            counter('socialconnect_db_query_seconds_total', 'Time spent in database queries.', 'db_time_sum')
+            counter('socialconnect_template_render_seconds_total', 'Time spent rendering templates.',
+                    'template_time_sum')
+            counter('socialconnect_query_budget_exceeded_total', 'Requests over their query budget.',
+                    'budget_exceeded')
+            counter('socialconnect_n_plus_one_total', 'Requests with repeated identical SQL shapes.',
+                    'n_plus_one')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
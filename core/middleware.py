@@ -0,0 +1,431 @@
+"""
+Opt-in request instrumentation and profiling.
+
+Enable with settings.INSTRUMENTATION['ENABLED']. When disabled the
+middleware removes itself at startup (MiddlewareNotUsed), so it costs
+nothing per request.
+
+For every request it records the number and total time of DB queries,
+template render time and total latency, labelled by the URL name from
+core/urls.py, into core.metrics.registry. Requests that go over their
+query budget, or that issue the same SQL shape many times (the usual N+1
+pattern), are logged.
+
+ProfilingMiddleware (settings.PROFILING) captures cProfile/stack samples
+for a fraction of requests and for slow ones; see core.profiling.
+
+Both are sync- and async-capable, so under ASGI the async polling views
+(core.async_views) stay on the event loop with either of them enabled.
+
+CachedAuthenticationMiddleware replaces Django's AuthenticationMiddleware
+and, with settings.AUTH_USER_CACHE enabled, serves request.user from
+core.usercache instead of the database. Async views get the user through
+auser(), which does the lazy lookup off the event loop.
+"""
+
+import contextvars
+import cProfile
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model, load_backend
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject, empty
+
+from . import profiling, usercache
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DEFAULT_QUERY_BUDGET': None,
+    'QUERY_BUDGETS': {},
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'METRICS_TOKEN': None,
+}
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+_IN_LIST = re.compile(r'\bIN \([^)]*\)', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SELECT_LIST = re.compile(r'^SELECT .*? FROM ', re.DOTALL)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+def sql_shape(sql):
+    shape = _IN_LIST.sub('IN (...)', sql)
+    shape = _STRING.sub('?', shape)
+    return _NUMBER.sub('?', shape)
+
+
+def _short_shape(shape):
+    return _SELECT_LIST.sub('SELECT ... FROM ', shape)[:200]
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.shapes = Counter()
+
+    def observe(self, sql, duration):
+        self.db_time += duration
+        self.queries += 1
+        self.shapes[sql_shape(sql)] += 1
+
+
+def _count_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.observe(sql, time.perf_counter() - start)
+
+
+def _add_query_counter(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+_connections_patched = False
+
+
+def _instrument_connections():
+    # Once per connection rather than per request: Django keeps one connection per thread,
+    # and under ASGI the ORM runs on worker threads the middleware never sees. The metrics
+    # reach those threads through the `_current` context variable.
+    global _connections_patched
+    if _connections_patched:
+        return
+    connection_created.connect(_add_query_counter, dispatch_uid='core.middleware.count_queries')
+    for connection in connections.all(initialized_only=True):
+        _add_query_counter(connection)
+    _connections_patched = True
+
+
+_templates_patched = False
+
+
+def _instrument_templates():
+    # Time only the outermost render so {% include %} is not counted twice
+    global _templates_patched
+    if _templates_patched:
+        return
+    original_render = Template.render
+
+    def render(self, context):
+        metrics = _current.get()
+        if metrics is None or metrics.template_depth:
+            return original_render(self, context)
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original_render(self, context)
+        finally:
+            metrics.template_depth -= 1
+            metrics.template_time += time.perf_counter() - start
+
+    Template.render = render
+    _templates_patched = True
+
+
+def _wrap_connections(stack, wrapper):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+class InstrumentationMiddleware:
+    # Async views stay async: under ASGI the chain is awaited, not adapted to sync
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.budgets = config['QUERY_BUDGETS']
+        self.default_budget = config['DEFAULT_QUERY_BUDGET']
+        self.n_plus_one_threshold = config['N_PLUS_ONE_THRESHOLD']
+        _instrument_templates()
+        _instrument_connections()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            # Requests that raise are recorded too
+            _current.reset(token)
+            self.finish(request, metrics, start)
+
+    async def __acall__(self, request):
+        # sync_to_async copies this context into the ORM's worker thread, so its queries count here too
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            _current.reset(token)
+            self.finish(request, metrics, start)
+
+    def finish(self, request, metrics, start):
+        latency = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name if match else None) or 'unmatched'
+        self.record(request, view, metrics, latency)
+
+    def record(self, request, view, metrics, latency):
+        budget = self.budgets.get(view, self.default_budget)
+        over_budget = budget is not None and metrics.queries > budget
+        if over_budget:
+            logger.warning(
+                'Query budget exceeded for %s (%s): %d queries, budget %d',
+                view, request.path, metrics.queries, budget,
+            )
+
+        repeated = [
+            (shape, count) for shape, count in metrics.shapes.most_common(3)
+            if count >= self.n_plus_one_threshold
+        ]
+        if repeated:
+            logger.warning(
+                'Possible N+1 in %s (%s): %s',
+                view, request.path,
+                '; '.join(f'{count}x {_short_shape(shape)}' for shape, count in repeated),
+            )
+
+        registry.observe(
+            view, latency, metrics.queries, metrics.db_time, metrics.template_time,
+            over_budget, bool(repeated),
+        )
+
+
+class _SQLRecorder:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append({'sql': sql, 'ms': round((time.perf_counter() - start) * 1000, 3)})
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = profiling.get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.sample_rate = config['SAMPLE_RATE']
+        self.threshold = config['SLOW_THRESHOLD_MS'] / 1000 if config['SLOW_THRESHOLD_MS'] else None
+        self.store = profiling.ProfileStore(config['DIRECTORY'], config['MAX_PROFILES'])
+        self.interval_ms = config['SAMPLE_INTERVAL_MS']
+        self.watchdog = None
+        if self.threshold is not None:
+            self.watchdog = profiling.get_watchdog(self.interval_ms / 1000)
+
+    def sampled(self):
+        return bool(self.sample_rate) and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if self.sampled():
+            return self.profile(request)
+        if self.watchdog is None:
+            return self.get_response(request)
+        return self.watch(request)
+
+    async def __acall__(self, request):
+        if self.sampled():
+            return await self.aprofile(request)
+        if self.watchdog is None:
+            return await self.get_response(request)
+        return await self.awatch(request)
+
+    def profile(self, request):
+        recorder = _SQLRecorder()
+        prof = cProfile.Profile()
+        start = time.perf_counter()
+        prof.enable()
+        try:
+            with ExitStack() as stack:
+                _wrap_connections(stack, recorder)
+                response = self.get_response(request)
+        finally:
+            prof.disable()
+        self.save_profile(request, time.perf_counter() - start, recorder, prof)
+        return response
+
+    async def aprofile(self, request):
+        # cProfile follows the event loop thread, so other requests' work there shows up too
+        recorder = _SQLRecorder()
+        prof = cProfile.Profile()
+        stack = ExitStack()
+        # The recorder goes on the connections of the thread async views run their queries on
+        await sync_to_async(_wrap_connections)(stack, recorder)
+        start = time.perf_counter()
+        prof.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            prof.disable()
+            await sync_to_async(stack.close)()
+        # request.user may still need its session and user queries, which cannot run on the event loop
+        await sync_to_async(self.save_profile)(request, time.perf_counter() - start, recorder, prof)
+        return response
+
+    def watch(self, request):
+        # No execute_wrapper here: the watchdog samples the SQL a slow request is waiting on
+        record = profiling.InFlight(threading.get_ident(), self.threshold)
+        start = time.perf_counter()
+        self.watchdog.track(record)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.watchdog.untrack(record)
+        self.save_slow(request, time.perf_counter() - start, record)
+        return response
+
+    async def awatch(self, request):
+        record = profiling.InFlight(threading.get_ident(), self.threshold)
+        start = time.perf_counter()
+        self.watchdog.track(record)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.watchdog.untrack(record)
+        duration = time.perf_counter() - start
+        if record.slow or duration >= self.threshold:
+            await sync_to_async(self.save_slow)(request, duration, record)
+        return response
+
+    def save_profile(self, request, duration, recorder, prof):
+        meta = self.meta(request, 'sampled', duration, recorder.statements)
+        meta['stats'] = profiling.format_stats(prof)
+        self.save(meta, prof)
+
+    def save_slow(self, request, duration, record):
+        if not record.slow and duration < self.threshold:
+            return
+        # Sampled statements, with their time estimated from the number of samples
+        statements = [
+            {'sql': sql, 'ms': samples * self.interval_ms, 'samples': samples}
+            for sql, samples in record.sql.most_common()
+        ]
+        meta = self.meta(request, 'slow', duration, statements)
+        meta['stacks'] = [
+            {'stack': stack.split(';'), 'samples': count}
+            for stack, count in record.stacks.most_common(20)
+        ]
+        self.save(meta)
+
+    def meta(self, request, kind, duration, statements):
+        match = getattr(request, 'resolver_match', None)
+        user = getattr(request, 'user', None)
+        return {
+            'kind': kind,
+            'view': (match.url_name if match else None) or 'unmatched',
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'duration_ms': round(duration * 1000, 3),
+            'created_at': timezone.now().isoformat(),
+            'sql': statements,
+        }
+
+    def save(self, meta, prof=None):
+        try:
+            self.store.save(meta, prof)
+        except OSError:
+            logger.exception('Could not write profile for %s', meta['path'])
+
+
+def get_cached_user(request):
+    """django.contrib.auth.get_user, with the user row served from core.usercache."""
+    try:
+        user_id = get_user_model()._meta.pk.to_python(request.session[SESSION_KEY])
+        backend_path = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+
+    user = usercache.get_user(user_id, load_backend(backend_path))
+    if user is None:
+        return AnonymousUser()
+
+    # Same session verification as Django, so password changes still log other sessions out
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    session_auth_hash = user.get_session_auth_hash()
+    if session_hash and constant_time_compare(session_hash, session_auth_hash):
+        return user
+    if session_hash and any(
+        constant_time_compare(session_hash, fallback) for fallback in user.get_session_auth_fallback_hash()
+    ):
+        request.session.cycle_key()
+        request.session[HASH_SESSION_KEY] = session_auth_hash
+        return user
+    request.session.flush()
+    return AnonymousUser()
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        if not usercache.get_config()['ENABLED']:
+            return super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_cached_user(request))
+
+
+async def auser(request):
+    """request.user for async views, like Django 5's request.auser().
+
+    The session and user lookups behind the lazy request.user are sync ORM
+    calls, so they run in a thread; afterwards request.user is safe to use
+    on the event loop.
+    """
+    user = request.user
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        await sync_to_async(user._setup)()
+    return user
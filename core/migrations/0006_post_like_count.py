@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_like_count(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Like = apps.get_model('core', 'Like')
+    db = schema_editor.connection.alias
+    counts = Like.objects.filter(post=OuterRef('pk')).values('post').annotate(n=Count('id')).values('n')
+    Post.objects.using(db).update(like_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_post_shared_from'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_like_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_watermarks(apps, schema_editor):
+    ConversationMember = apps.get_model('core', 'ConversationMember')
+    Message = apps.get_model('core', 'Message')
+    db = schema_editor.connection.alias
+    # Last message the member either sent or had marked read
+    last_read = (
+        Message.objects.filter(conversation_id=OuterRef('conversation_id'))
+        .filter(Q(sender_id=OuterRef('user_id')) | Q(is_read=True))
+        .order_by('-id')
+        .values('id')[:1]
+    )
+    ConversationMember.objects.using(db).update(last_read_message_id=Coalesce(Subquery(last_read), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_message_history_indexes'),
+    ]
+
+    operations = [
+        # Adopt the existing participants table as an explicit through model
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ConversationMember',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.conversation')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'core_conversation_participants',
+                        'unique_together': {('conversation', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='participants',
+                    field=models.ManyToManyField(related_name='conversations', through='core.ConversationMember', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='last_read_message_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
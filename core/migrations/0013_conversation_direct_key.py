@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:44
+
+from django.db import migrations, models
+
+
+def backfill_direct_keys(apps, schema_editor):
+    Conversation = apps.get_model('core', 'Conversation')
+    ConversationMember = apps.get_model('core', 'ConversationMember')
+    db = schema_editor.connection.alias
+    members = {}
+    rows = ConversationMember.objects.using(db).values_list('conversation_id', 'user_id')
+    for conversation_id, user_id in rows.iterator():
+        members.setdefault(conversation_id, []).append(user_id)
+
+    # Racing clicks may already have produced duplicates; the most recently active one keeps the key
+    claimed = set()
+    newest_first = Conversation.objects.using(db).order_by('-updated_at', '-id').values_list('id', flat=True)
+    for conversation_id in newest_first.iterator():
+        user_ids = members.get(conversation_id, [])
+        if len(user_ids) != 2:
+            continue
+        key = '%d:%d' % tuple(sorted(user_ids))
+        if key in claimed:
+            continue
+        claimed.add(key)
+        Conversation.objects.using(db).filter(id=conversation_id).update(direct_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_conversation_read_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='direct_key',
+            field=models.CharField(blank=True, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_direct_keys, migrations.RunPython.noop),
+    ]
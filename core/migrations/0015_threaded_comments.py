@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:07
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_comment_counts(apps, schema_editor):
+    # Every existing comment is top-level, so only the per-post totals need filling in
+    Comment = apps.get_model('core', 'Comment')
+    Post = apps.get_model('core', 'Post')
+    db = schema_editor.connection.alias
+    totals = (
+        Comment.objects.filter(post=models.OuterRef('pk'))
+        .values('post').annotate(n=models.Count('id')).values('n')
+    )
+    Post.objects.using(db).update(comment_count=Coalesce(models.Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_group_conversations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='core.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'parent', 'id'], name='comment_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent', 'id'], name='comment_reply_idx'),
+        ),
+        migrations.RunPython(backfill_comment_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_threaded_comments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=10)),
+                ('epoch', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trending_scores', to='core.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', 'epoch', '-score'], name='trending_rank_idx')],
+                'unique_together': {('window', 'post')},
+            },
+        ),
+    ]
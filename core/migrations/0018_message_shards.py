@@ -0,0 +1,92 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:31
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# SQLite rebuilds core_searchdocument to drop its foreign key constraints,
+# which drops the triggers keeping the full-text index in sync (see 0009)
+SQLITE_FTS_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS core_searchdocument_ai',
+    'DROP TRIGGER IF EXISTS core_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS core_searchdocument_au',
+    """CREATE TRIGGER core_searchdocument_ai AFTER INSERT ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER core_searchdocument_ad AFTER DELETE ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(core_searchdocument_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER core_searchdocument_au AFTER UPDATE OF content ON core_searchdocument BEGIN
+        INSERT INTO core_searchdocument_fts(core_searchdocument_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO core_searchdocument_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+
+def restore_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_FTS_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+def fill_directory(apps, schema_editor):
+    # Existing conversations keep their ids; new ones are numbered after them
+    Conversation = apps.get_model('core', 'Conversation')
+    ConversationDirectory = apps.get_model('core', 'ConversationDirectory')
+    db = schema_editor.connection.alias
+    rows = Conversation.objects.using(db).order_by('id').values_list('id', 'direct_key', 'created_at')
+    ConversationDirectory.objects.using(db).bulk_create(
+        [ConversationDirectory(id=id, direct_key=key, created_at=created_at) for id, key, created_at in rows],
+        batch_size=500,
+    )
+    # SQLite's counter follows explicit ids by itself; sequences elsewhere need moving on
+    for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [ConversationDirectory]):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_soft_delete'),
+    ]
+
+    operations = [
+        # Undoing the AlterFields below rebuilds the table again; this runs last on the way back
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.CreateModel(
+            name='ConversationDirectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direct_key', models.CharField(blank=True, max_length=41, null=True, unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'conversation directory',
+            },
+        ),
+        migrations.AlterField(
+            model_name='conversationmember',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sender',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='sent_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='searchdocument',
+            name='conversation',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.conversation'),
+        ),
+        migrations.AlterField(
+            model_name='searchdocument',
+            name='message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.message'),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+        migrations.RunPython(fill_directory, migrations.RunPython.noop),
+    ]
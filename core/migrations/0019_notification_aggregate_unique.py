@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_aggregates(apps, schema_editor):
+    # Concurrent workers may have written the same aggregate twice; fold each group into its oldest row
+    Notification = apps.get_model('core', 'Notification')
+    User = apps.get_model('core', 'User')
+    db = schema_editor.connection.alias
+    notifications = Notification.objects.using(db)
+    duplicates = (
+        notifications.values('recipient_id', 'verb', 'post_id', 'window_start')
+        .annotate(rows=Count('id')).filter(rows__gt=1)
+    )
+    recipient_ids = set()
+    for group in duplicates.iterator():
+        rows = list(notifications.filter(
+            recipient_id=group['recipient_id'], verb=group['verb'], post_id=group['post_id'],
+            window_start=group['window_start'],
+        ).order_by('id'))
+        keep, latest = rows[0], max(rows, key=lambda row: row.updated_at)
+        for row in rows[1:]:
+            keep.actor_ids += [actor_id for actor_id in row.actor_ids if actor_id not in keep.actor_ids]
+        keep.actor_ids = keep.actor_ids[:50]
+        keep.actor_count = max(len(keep.actor_ids), max(row.actor_count for row in rows))
+        keep.latest_actor_id, keep.updated_at = latest.latest_actor_id, latest.updated_at
+        keep.is_read = all(row.is_read for row in rows)
+        keep.save()
+        notifications.filter(id__in=[row.id for row in rows[1:]]).delete()
+        recipient_ids.add(group['recipient_id'])
+
+    for recipient_id in recipient_ids:
+        unread = notifications.filter(recipient_id=recipient_id, is_read=False).count()
+        User.objects.using(db).filter(id=recipient_id).update(unread_notifications=unread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_message_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_aggregates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='core_notifi_recipie_9f5c6e_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', False)), fields=('recipient', 'verb', 'post', 'window_start'), name='notification_post_aggregate'),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', True)), fields=('recipient', 'verb', 'window_start'), name='notification_aggregate'),
+        ),
+    ]
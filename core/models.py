@@ -2,6 +2,10 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 
+from . import sharding
+
+DEFAULT_AVATAR_URL = '/media/defaults/default-avatar.jpg'
+
 
 class User(AbstractUser):
     bio = models.TextField(blank=True)
@@ -13,11 +17,14 @@ class User(AbstractUser):
     gender = models.CharField(max_length=10, choices=[('male', 'Male'), ('female', 'Female')], blank=True)
     relationship_status = models.CharField(max_length=10, choices=[('single', 'Single'), ('married', 'Married')], blank=True)
     last_active = models.DateTimeField(default=timezone.now)
+    unread_notifications = models.PositiveIntegerField(default=0)
+    # Set when the account is deleted; the rows go in the background (see core.deletion)
+    deleted_at = models.DateTimeField(null=True, blank=True)
     
     def get_profile_photo_url(self):
         if self.profile_photo:
             return self.profile_photo.url
-        return '/media/defaults/default-avatar.jpg'
+        return DEFAULT_AVATAR_URL
     
     def get_cover_photo_url(self):
         if self.cover_photo:
@@ -50,6 +57,11 @@ class User(AbstractUser):
             return 'Active just now'
 
 
+class LivePostManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField()
@@ -57,9 +69,20 @@ class Post(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     shared_from = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='shared_posts')
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Soft-deleted posts are hidden from `objects` until core.deletion purges them
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = LivePostManager()
+    all_objects = models.Manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Only holds posts waiting to be purged
+            models.Index(fields=['deleted_at'], name='post_deleted_idx', condition=models.Q(deleted_at__isnull=False)),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.created_at}"
@@ -68,11 +91,22 @@ class Post(models.Model):
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
+    # Replies point at a top-level comment; threads are one level deep
+    parent = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies', db_index=False
+    )
     content = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
+    reply_count = models.PositiveIntegerField(default=0)
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Keyset pages of a post's top-level comments and of a comment's replies
+            models.Index(fields=['post', 'parent', 'id'], name='comment_thread_idx'),
+            # Also serves the parent FK, so that column has no index of its own
+            models.Index(fields=['parent', 'id'], name='comment_reply_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} on {self.post}"
@@ -90,6 +124,24 @@ class Like(models.Model):
         return f"{self.user.username} likes {self.post}"
 
 
+class TrendingScore(models.Model):
+    """A post's time-decayed engagement in one trending window; see core.trending."""
+    window = models.CharField(max_length=10)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='trending_scores')
+    # Scores are relative to the window's landmark number `epoch`
+    epoch = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0)
+    
+    class Meta:
+        unique_together = ('window', 'post')
+        indexes = [
+            models.Index(fields=['window', 'epoch', '-score'], name='trending_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.post_id} in {self.window}: {self.score:.3g}"
+
+
 class Friendship(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friendships')
     friend = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friends')
@@ -114,25 +166,89 @@ class FriendRequest(models.Model):
         return f"{self.from_user.username} → {self.to_user.username}"
 
 
+class ShardedManager(models.Manager):
+    """Manager for the messaging models, whose rows live on their conversation's shard (see core.sharding)."""
+
+    def for_conversation(self, conversation_id):
+        return self.using(sharding.shard_for(conversation_id))
+
+    def create(self, **kwargs):
+        # Save through the router, which knows the new row's conversation, instead of the default database
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+
+class ConversationDirectory(models.Model):
+    # Hands out conversation ids, which pick a conversation's shard, and keeps
+    # direct_key unique across shards. Always in the default database.
+    direct_key = models.CharField(max_length=41, unique=True, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = 'conversation directory'
+
+    def __str__(self):
+        return f"Conversation {self.id}"
+
+
 class Conversation(models.Model):
-    participants = models.ManyToManyField(User, related_name='conversations')
+    participants = models.ManyToManyField(User, related_name='conversations', through='ConversationMember')
+    # "<low user id>:<high user id>" for one-to-one conversations, see core.conversations.direct_key
+    direct_key = models.CharField(max_length=41, unique=True, null=True, blank=True)
+    is_group = models.BooleanField(default=False)
+    title = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShardedManager()
     
     def __str__(self):
         return f"Conversation {self.id}"
+    
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            # Ids come from the directory so they are unique across shards; bulk_create callers allocate their own
+            self.pk = ConversationDirectory.objects.create(direct_key=self.direct_key).pk
+        super().save(*args, **kwargs)
+
+
+class ConversationMember(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='memberships')
+    # Users stay in the default database, so shards hold no constraint on them
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='conversation_memberships', db_constraint=False
+    )
+    # Everything up to and including this message id has been read by `user`
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+    is_admin = models.BooleanField(default=False)
+    joined_at = models.DateTimeField(default=timezone.now)
+
+    objects = ShardedManager()
+    
+    class Meta:
+        # Keeps the table of the former auto-created participants relation
+        db_table = 'core_conversation_participants'
+        unique_together = ('conversation', 'user')
+    
+    def __str__(self):
+        return f"{self.user.username} in {self.conversation}"
 
 
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
-    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages', db_constraint=False)
     content = models.TextField(blank=True)
     attachment = models.FileField(upload_to='message_attachments/', blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
-    is_read = models.BooleanField(default=False)
+
+    objects = ShardedManager()
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.sender.username} in {self.conversation}"
@@ -147,3 +263,156 @@ class Message(models.Model):
             ext = self.attachment.name.lower().split('.')[-1]
             return ext in ['jpg', 'jpeg', 'png', 'gif', 'webp']
         return False
+
+
+class Job(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=36, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.task} #{self.id} ({self.status})"
+
+
+class Notification(models.Model):
+    VERB_LIKE = 'like'
+    VERB_COMMENT = 'comment'
+    VERB_FRIEND_REQUEST = 'friend_request'
+    VERB_FRIEND_ACCEPT = 'friend_accept'
+    VERB_CHOICES = [
+        (VERB_LIKE, 'Like'),
+        (VERB_COMMENT, 'Comment'),
+        (VERB_FRIEND_REQUEST, 'Friend request'),
+        (VERB_FRIEND_ACCEPT, 'Friend request accepted'),
+    ]
+    MAX_TRACKED_ACTORS = 50
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    verb = models.CharField(max_length=20, choices=VERB_CHOICES)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
+    window_start = models.DateTimeField()
+    latest_actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    actor_ids = models.JSONField(default=list)
+    actor_count = models.PositiveIntegerField(default=0)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['recipient', '-updated_at']),
+        ]
+        # One row per aggregate; NULLs never collide in a unique index, so posts and none get one each
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'verb', 'post', 'window_start'], condition=models.Q(post__isnull=False),
+                name='notification_post_aggregate',
+            ),
+            models.UniqueConstraint(
+                fields=['recipient', 'verb', 'window_start'], condition=models.Q(post__isnull=True),
+                name='notification_aggregate',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.recipient.username}: {self.get_message()}"
+    
+    def get_message(self):
+        actor = self.latest_actor.username
+        if self.actor_count > 1:
+            others = self.actor_count - 1
+            actor = f"{actor} and {others} other{'s' if others > 1 else ''}"
+        if self.verb == self.VERB_LIKE:
+            return f"{actor} liked your post"
+        if self.verb == self.VERB_COMMENT:
+            return f"{actor} commented on your post"
+        if self.verb == self.VERB_FRIEND_REQUEST:
+            return f"{actor} sent you a friend request"
+        return f"{actor} accepted your friend request"
+
+
+class SearchDocument(models.Model):
+    KIND_POST = 'post'
+    KIND_COMMENT = 'comment'
+    KIND_MESSAGE = 'message'
+    KIND_CHOICES = [
+        (KIND_POST, 'Post'),
+        (KIND_COMMENT, 'Comment'),
+        (KIND_MESSAGE, 'Message'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # Visibility: posts and comments follow the post owner, messages the conversation
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    post_owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, null=True, blank=True, related_name='+', db_constraint=False
+    )
+    # Deleting the source row removes its document through these cascades, except for messages
+    # on another shard, which core.views.delete_message and core.archive unindex themselves
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, null=True, blank=True, related_name='+', db_constraint=False
+    )
+    content = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ('kind', 'object_id')
+        indexes = [
+            models.Index(fields=['post_owner', '-id']),
+            models.Index(fields=['conversation', '-id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} #{self.object_id}"
+
+
+class MessageArchiveSegment(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archive_segments')
+    first_message_id = models.PositiveBigIntegerField()
+    last_message_id = models.PositiveBigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    # zlib-compressed JSON lines, one archived message per line, oldest first
+    data = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = ShardedManager()
+    
+    class Meta:
+        ordering = ['conversation', 'first_message_id']
+        indexes = [
+            models.Index(fields=['conversation', '-last_message_id']),
+        ]
+    
+    def __str__(self):
+        return f"Conversation {self.conversation_id} messages {self.first_message_id}-{self.last_message_id}"
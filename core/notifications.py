@@ -0,0 +1,177 @@
+"""
+Aggregated notifications.
+
+Events are queued as jobs and written in batches: all events for the same
+(recipient, verb, post, time window) fold into one Notification row, so a
+post that gets 500 likes in an hour produces a single "x and 499 others
+liked your post" entry. Each user's unread total is kept in
+User.unread_notifications so the header badge never needs a COUNT query.
+A unique constraint keeps concurrent workers from writing one aggregate
+twice, and deleted notifications (say, of a purged post) are counted out
+again by recount_unread(), once per recipient when the deleting transaction
+commits.
+"""
+
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import jobs, usercache
+from .models import Notification, Post, User
+
+NOTIFICATION_WINDOW = timedelta(hours=1)
+
+
+def window_start(moment):
+    seconds = int(NOTIFICATION_WINDOW.total_seconds())
+    return moment - timedelta(seconds=int(moment.timestamp()) % seconds, microseconds=moment.microsecond)
+
+
+def notify(verb, recipient_id, actor_id, post_id=None):
+    # recipient_id may be None for post events; the post's author is resolved in the batch
+    notify_many(verb, [recipient_id], actor_id, post_id)
+
+
+def notify_many(verb, recipient_ids, actor_id, post_id=None):
+    at = timezone.now().isoformat()
+    payloads = [
+        {'verb': verb, 'recipient_id': recipient_id, 'actor_id': actor_id, 'post_id': post_id, 'at': at}
+        for recipient_id in recipient_ids
+        if recipient_id != actor_id
+    ]
+    if payloads:
+        jobs.enqueue_many('record_notifications', payloads)
+
+
+def _resolve_post_recipients(events):
+    post_ids = {e['post_id'] for e in events if e.get('recipient_id') is None and e.get('post_id')}
+    authors = dict(Post.objects.filter(id__in=post_ids).values_list('id', 'user_id')) if post_ids else {}
+    resolved = []
+    for event in events:
+        if event.get('recipient_id') is None:
+            recipient_id = authors.get(event.get('post_id'))
+            if recipient_id is None:
+                continue  # Post is gone
+            event = dict(event, recipient_id=recipient_id)
+        if event['recipient_id'] != event['actor_id']:
+            resolved.append(event)
+    return resolved
+
+
+def record_events(events):
+    events = _resolve_post_recipients(events)
+    if not events:
+        return
+
+    # Group events by the row they aggregate into
+    groups = {}
+    for event in events:
+        at = parse_datetime(event['at'])
+        key = (event['recipient_id'], event['verb'], event.get('post_id'), window_start(at))
+        groups.setdefault(key, []).append((at, event['actor_id']))
+
+    try:
+        _apply(groups)
+    except IntegrityError:
+        # Another worker inserted one of these aggregates after we looked; it is there to update now
+        _apply(groups)
+
+
+def _apply(groups):
+    lookup = Q()
+    for recipient_id, verb, post_id, start in groups:
+        lookup |= Q(recipient_id=recipient_id, verb=verb, post_id=post_id, window_start=start)
+
+    with transaction.atomic():
+        existing = {
+            (n.recipient_id, n.verb, n.post_id, n.window_start): n
+            for n in Notification.objects.select_for_update().filter(lookup)
+        }
+
+        to_create = []
+        to_update = []
+        newly_unread = {}
+        for key, actions in groups.items():
+            actions.sort()
+            notification = existing.get(key)
+            if notification is None:
+                recipient_id, verb, post_id, start = key
+                notification = Notification(
+                    recipient_id=recipient_id, verb=verb, post_id=post_id, window_start=start,
+                    created_at=actions[0][0],
+                )
+                to_create.append(notification)
+            else:
+                to_update.append(notification)
+
+            for at, actor_id in actions:
+                if actor_id in notification.actor_ids:
+                    continue
+                if len(notification.actor_ids) < Notification.MAX_TRACKED_ACTORS:
+                    notification.actor_ids.append(actor_id)
+                notification.actor_count += 1
+            notification.latest_actor_id = actions[-1][1]
+            notification.updated_at = actions[-1][0]
+
+            if notification.pk is None or notification.is_read:
+                newly_unread[notification.recipient_id] = newly_unread.get(notification.recipient_id, 0) + 1
+            notification.is_read = False
+
+        Notification.objects.bulk_create(to_create)
+        Notification.objects.bulk_update(
+            to_update, ['actor_ids', 'actor_count', 'latest_actor', 'updated_at', 'is_read']
+        )
+        for recipient_id, count in newly_unread.items():
+            User.objects.filter(id=recipient_id).update(
+                unread_notifications=F('unread_notifications') + count
+            )
+        usercache.invalidate_users(newly_unread)
+
+
+def mark_all_read(user):
+    with transaction.atomic():
+        Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        User.objects.filter(id=user.id).update(unread_notifications=0)
+        usercache.invalidate_user(user.id)
+    user.unread_notifications = 0
+
+
+def recount_unread(user_ids):
+    """Recompute the unread counters of `user_ids` from their notifications."""
+    user_ids = list(user_ids)
+    unread = (
+        Notification.objects.filter(recipient=OuterRef('pk'), is_read=False)
+        .values('recipient').annotate(n=Count('id')).values('n')
+    )
+    User.objects.filter(id__in=user_ids).update(unread_notifications=Coalesce(Subquery(unread), 0))
+    usercache.invalidate_users(user_ids)
+
+
+class _PendingRecount:
+    def __init__(self):
+        self.user_ids = set()
+
+    def __call__(self):
+        recount_unread(self.user_ids)
+
+
+def recount_unread_on_commit(user_ids):
+    """recount_unread() for `user_ids` once the current transaction commits.
+
+    All calls in one transaction share a single recount, so a cascade that
+    deletes many notifications recounts each recipient once.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        recount_unread(user_ids)
+        return
+    # Looked up rather than remembered: a rollback discards the callback along with the ids
+    pending = next((func for _, func, _ in connection.run_on_commit if isinstance(func, _PendingRecount)), None)
+    if pending is None:
+        pending = _PendingRecount()
+        transaction.on_commit(pending)
+    pending.user_ids.update(user_ids)
@@ -0,0 +1,197 @@
+"""
+Sampling profiler for slow requests.
+
+Two kinds of captures are written by core.middleware.ProfilingMiddleware:
+
+* a random SAMPLE_RATE fraction of requests runs under cProfile from start
+  to finish, with every SQL statement recorded;
+* any other request still running after SLOW_THRESHOLD_MS is picked up by a
+  watchdog thread, which samples its Python stack every few milliseconds,
+  along with the SQL statement it is waiting on, if any. Nothing is
+  installed on these requests' connections, and the watchdog sleeps while
+  no request is in flight.
+
+Captures go to a bounded on-disk ring buffer (oldest files are dropped once
+MAX_PROFILES is reached) and can be browsed from the admin.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.0,
+    'SLOW_THRESHOLD_MS': 1000,
+    'SAMPLE_INTERVAL_MS': 5,
+    'DIRECTORY': None,
+    'MAX_PROFILES': 50,
+}
+
+_SAFE_NAME = re.compile(r'^[\w.-]+$')
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+    if config['DIRECTORY'] is None:
+        config['DIRECTORY'] = Path(settings.BASE_DIR) / 'profiles'
+    return config
+
+
+class ProfileStore:
+    def __init__(self, directory, max_profiles):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, meta, prof=None):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+        name = f"{stamp}-{meta['view']}-{int(meta['duration_ms'])}ms"
+        if prof is not None:
+            prof.dump_stats(self.directory / f'{name}.prof')
+            meta['prof_file'] = f'{name}.prof'
+        with open(self.directory / f'{name}.json', 'w') as fh:
+            json.dump(meta, fh, indent=1)
+        self._trim()
+        return name
+
+    def _trim(self):
+        with self._lock:
+            captures = sorted(self.directory.glob('*.json'))
+            for stale in captures[:max(0, len(captures) - self.max_profiles)]:
+                stale.unlink(missing_ok=True)
+                stale.with_suffix('.prof').unlink(missing_ok=True)
+
+    def list(self):
+        if not self.directory.exists():
+            return []
+        captures = []
+        for path in sorted(self.directory.glob('*.json'), reverse=True):
+            try:
+                with open(path) as fh:
+                    meta = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            meta['name'] = path.stem
+            captures.append(meta)
+        return captures
+
+    def path_for(self, filename):
+        # Only plain file names that exist inside the store are served
+        if not _SAFE_NAME.match(filename):
+            return None
+        path = self.directory / filename
+        return path if path.is_file() else None
+
+
+def get_store():
+    config = get_config()
+    return ProfileStore(config['DIRECTORY'], config['MAX_PROFILES'])
+
+
+def format_stats(prof, limit=40):
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+class InFlight:
+    """State for one request the watchdog is allowed to sample.
+
+    The record itself identifies the request: under ASGI concurrent requests
+    share a thread, so `thread_id` only says where to look for its stack.
+    """
+
+    def __init__(self, thread_id, threshold):
+        self.thread_id = thread_id
+        self.deadline = time.perf_counter() + threshold
+        self.slow = False
+        self.stacks = Counter()
+        # SQL statement -> samples taken while it was executing
+        self.sql = Counter()
+
+
+_EXECUTE_FRAMES = {'_execute', '_executemany'}
+_BACKEND_UTILS = os.path.join('django', 'db', 'backends', 'utils.py')
+
+
+def _executing_sql(frame):
+    # The innermost CursorWrapper._execute frame holds the statement being waited on
+    while frame is not None:
+        if frame.f_code.co_name in _EXECUTE_FRAMES and frame.f_code.co_filename.endswith(_BACKEND_UTILS):
+            return frame.f_locals.get('sql')
+        frame = frame.f_back
+    return None
+
+
+class Watchdog(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='slow-request-watchdog', daemon=True)
+        self.interval = interval
+        self.requests = set()
+        self._changed = threading.Condition()
+
+    def track(self, record):
+        with self._changed:
+            self.requests.add(record)
+            self._changed.notify()
+
+    def untrack(self, record):
+        with self._changed:
+            self.requests.discard(record)
+
+    def run(self):
+        while True:
+            # Blocks while nothing is in flight instead of waking every interval
+            with self._changed:
+                self._changed.wait_for(lambda: self.requests)
+            time.sleep(self.interval)
+            with self._changed:
+                records = list(self.requests)
+            self.sample(records)
+
+    def sample(self, records):
+        now = time.perf_counter()
+        frames = None
+        for record in records:
+            if now < record.deadline:
+                continue
+            record.slow = True
+            if frames is None:
+                frames = sys._current_frames()
+            frame = frames.get(record.thread_id)
+            if frame is not None:
+                stack = ';'.join(
+                    f'{os.path.basename(f.filename)}:{f.name}:{f.lineno}'
+                    for f in traceback.extract_stack(frame)
+                )
+                record.stacks[stack] += 1
+                sql = _executing_sql(frame)
+                if sql:
+                    record.sql[sql] += 1
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def get_watchdog(interval):
+    global _watchdog
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = Watchdog(interval)
+            _watchdog.start()
+    return _watchdog
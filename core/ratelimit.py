@@ -0,0 +1,267 @@
+"""
+Per-user throttling and poll coalescing.
+
+`ratelimit(endpoint_class)` guards a view with a token bucket keyed by the
+user (or client IP when anonymous) and the endpoint class, e.g. all write
+endpoints share one bucket per user. Buckets hold up to CAPACITY tokens and
+refill at PER_MINUTE tokens a minute; a request that finds the bucket empty
+gets a 429 with Retry-After.
+
+Buckets live in settings.RATE_LIMITS['STORE']. MemoryStore is per process;
+CacheStore keeps them in the Django cache so every worker shares one budget
+when the cache is shared (Redis, Memcached). Any class with the same
+`consume()` method can be plugged in; async views use `aconsume()` when the
+store has one.
+
+`coalesce` makes concurrent identical GETs from the same user share one
+execution: the first request runs the view, the others wait for it and get
+a copy of its response.
+
+Both decorators accept async views and then return async wrappers.
+"""
+
+import asyncio
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.utils.module_loading import import_string
+
+from .middleware import auser
+
+DEFAULTS = {
+    'ENABLED': True,
+    'STORE': 'core.ratelimit.MemoryStore',
+    'CLASSES': {},
+    'COALESCE_TIMEOUT': 5,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RATE_LIMITS', {})}
+
+
+def _refill(tokens, updated, now, capacity, per_second):
+    return min(capacity, tokens + (now - updated) * per_second)
+
+
+class MemoryStore:
+    """Token buckets in a dict; each worker process throttles on its own."""
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def consume(self, key, capacity, per_second, cost=1):
+        """Take `cost` tokens. Returns (allowed, seconds until enough tokens)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._evict(now, capacity, per_second)
+        return allowed, 0 if allowed else (cost - tokens) / per_second
+
+    async def aconsume(self, key, capacity, per_second, cost=1):
+        # Never blocks for long, so it is fine to run on the event loop
+        return self.consume(key, capacity, per_second, cost)
+
+    def _evict(self, now, capacity, per_second):
+        # Buckets that have refilled completely are indistinguishable from new ones
+        idle = capacity / per_second
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated >= idle:
+                del self._buckets[key]
+
+
+class CacheStore:
+    """Token buckets in the Django cache, shared by every worker using it.
+
+    Read-modify-write is not atomic, so under heavy concurrency a few extra
+    requests can slip through; the limit is still enforced over time.
+    """
+
+    def consume(self, key, capacity, per_second, cost=1):
+        now = time.time()
+        cache_key = f'ratelimit:{key}'
+        tokens, updated = cache.get(cache_key, (capacity, now))
+        tokens = _refill(tokens, updated, now, capacity, per_second)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        cache.set(cache_key, (tokens, now), int(capacity / per_second) + 1)
+        return allowed, 0 if allowed else (cost - tokens) / per_second
+
+    async def aconsume(self, key, capacity, per_second, cost=1):
+        now = time.time()
+        cache_key = f'ratelimit:{key}'
+        tokens, updated = await cache.aget(cache_key, (capacity, now))
+        tokens = _refill(tokens, updated, now, capacity, per_second)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        await cache.aset(cache_key, (tokens, now), int(capacity / per_second) + 1)
+        return allowed, 0 if allowed else (cost - tokens) / per_second
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path):
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = import_string(path)()
+        return _stores[path]
+
+
+def _client_key(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _limits(endpoint_class):
+    config = get_config()
+    limits = config['CLASSES'].get(endpoint_class)
+    if not config['ENABLED'] or not limits:
+        return None, None
+    return get_store(config['STORE']), limits
+
+
+def _too_many_requests(retry_after):
+    response = JsonResponse({'success': False, 'message': 'Too many requests'}, status=429)
+    response['Retry-After'] = str(max(1, round(retry_after)))
+    return response
+
+
+def ratelimit(endpoint_class):
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                store, limits = _limits(endpoint_class)
+                if store is None:
+                    return await view(request, *args, **kwargs)
+
+                await auser(request)
+                key = f'{endpoint_class}:{_client_key(request)}'
+                per_second = limits['PER_MINUTE'] / 60
+                if hasattr(store, 'aconsume'):
+                    allowed, retry_after = await store.aconsume(key, limits['CAPACITY'], per_second)
+                else:
+                    allowed, retry_after = store.consume(key, limits['CAPACITY'], per_second)
+                if not allowed:
+                    return _too_many_requests(retry_after)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            store, limits = _limits(endpoint_class)
+            if store is None:
+                return view(request, *args, **kwargs)
+
+            allowed, retry_after = store.consume(
+                f'{endpoint_class}:{_client_key(request)}', limits['CAPACITY'], limits['PER_MINUTE'] / 60
+            )
+            if not allowed:
+                return _too_many_requests(retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _copy_response(response):
+    copy = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        copy[header] = value
+    return copy
+
+
+def coalesce(view):
+    if asyncio.iscoroutinefunction(view):
+        return _coalesce_async(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+
+        key = (view.__module__, view.__name__, _client_key(request), request.get_full_path())
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = _Flight()
+
+        if not leader:
+            # Share the leader's result; fall back to running the view if it fails or stalls
+            if flight.done.wait(get_config()['COALESCE_TIMEOUT']) and flight.response is not None:
+                return _copy_response(flight.response)
+            return view(request, *args, **kwargs)
+
+        try:
+            response = view(request, *args, **kwargs)
+            if not response.streaming:
+                flight.response = response
+            return response
+        finally:
+            with _flights_lock:
+                _flights.pop(key, None)
+            flight.done.set()
+    return wrapper
+
+
+# Keyed by event loop too: a future can only be awaited on the loop that created it
+_async_flights = {}
+
+
+def _coalesce_async(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return await view(request, *args, **kwargs)
+
+        await auser(request)
+        loop = asyncio.get_running_loop()
+        key = (loop, view.__module__, view.__name__, _client_key(request), request.get_full_path())
+        flight = _async_flights.get(key)
+
+        if flight is not None:
+            try:
+                response = await asyncio.wait_for(asyncio.shield(flight), get_config()['COALESCE_TIMEOUT'])
+            except asyncio.TimeoutError:
+                response = None
+            if response is not None:
+                return _copy_response(response)
+            return await view(request, *args, **kwargs)
+
+        flight = _async_flights[key] = loop.create_future()
+        response = None
+        try:
+            response = await view(request, *args, **kwargs)
+            return response
+        finally:
+            _async_flights.pop(key, None)
+            flight.set_result(None if response is None or response.streaming else response)
+    return wrapper
@@ -0,0 +1,162 @@
+"""
+Full-text search over posts, comments and the viewer's own messages.
+
+Searchable text is copied into SearchDocument rows when content is saved
+(see core.signals); foreign keys to the source rows remove documents when
+their post, comment, message or conversation is deleted, as long as it is
+in the same database (messages on other shards are unindexed by hand). The text index
+itself is maintained by the database: an FTS5 external-content table kept
+in sync by triggers on SQLite, and a GIN index on to_tsvector() on
+PostgreSQL. Other backends fall back to a LIKE scan.
+
+Results are ordered newest first and paginated with a `before` id cursor,
+so every page is an index range scan no matter how deep it is.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+
+from . import conversations, sharding
+from .models import Comment, Friendship, Message, Post, SearchDocument
+
+PAGE_SIZE = 20
+MAX_TERMS = 8
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def _terms(query):
+    return _TERM.findall(query.lower())[:MAX_TERMS]
+
+
+_has_fts = None
+
+
+def _fts_available():
+    global _has_fts
+    if _has_fts is None:
+        with connection.cursor() as cursor:
+            _has_fts = 'core_searchdocument_fts' in connection.introspection.table_names(cursor)
+    return _has_fts
+
+
+def _match(terms):
+    table = SearchDocument._meta.db_table
+    if connection.vendor == 'sqlite' and _fts_available():
+        expression = ' AND '.join(f'"{term}"*' for term in terms)
+        return RawSQL(
+            f'{table}.id IN (SELECT rowid FROM core_searchdocument_fts WHERE core_searchdocument_fts MATCH %s)',
+            [expression],
+            output_field=BooleanField(),
+        )
+    if connection.vendor == 'postgresql':
+        expression = ' & '.join(f'{term}:*' for term in terms)
+        return RawSQL(
+            f"to_tsvector('simple', {table}.content) @@ to_tsquery('simple', %s)",
+            [expression],
+            output_field=BooleanField(),
+        )
+    condition = Q()
+    for term in terms:
+        condition &= Q(content__icontains=term)
+    return condition
+
+
+def _visible_to(user):
+    friend_ids = Friendship.objects.filter(user=user).values('friend_id')
+    conversation_ids = conversations.conversation_ids(user)
+    # Soft-deleted posts and accounts drop out at once; core.deletion purges their documents later
+    return Q(author__deleted_at__isnull=True) & ((
+        Q(kind__in=[SearchDocument.KIND_POST, SearchDocument.KIND_COMMENT], post__deleted_at__isnull=True)
+        & (Q(post_owner=user) | Q(post_owner_id__in=friend_ids))
+    ) | Q(kind=SearchDocument.KIND_MESSAGE, conversation_id__in=conversation_ids))
+
+
+def search(user, query, kinds=None, before=None, limit=PAGE_SIZE):
+    """Return (documents, next_cursor) for `query` as seen by `user`."""
+    terms = _terms(query)
+    if not terms:
+        return [], None
+
+    documents = SearchDocument.objects.filter(_match(terms)).filter(_visible_to(user))
+    if kinds:
+        documents = documents.filter(kind__in=kinds)
+    if before:
+        documents = documents.filter(id__lt=before)
+    page = list(documents.select_related('author').order_by('-id')[:limit + 1])
+
+    next_cursor = page[limit - 1].id if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def _document_for(instance):
+    if isinstance(instance, Post):
+        return SearchDocument(
+            kind=SearchDocument.KIND_POST, object_id=instance.id, author_id=instance.user_id,
+            post_id=instance.id, post_owner_id=instance.user_id,
+            content=instance.content, created_at=instance.created_at,
+        )
+    if isinstance(instance, Comment):
+        return SearchDocument(
+            kind=SearchDocument.KIND_COMMENT, object_id=instance.id, author_id=instance.user_id,
+            post_id=instance.post_id, post_owner_id=instance.post.user_id, comment_id=instance.id,
+            content=instance.content, created_at=instance.created_at,
+        )
+    return SearchDocument(
+        kind=SearchDocument.KIND_MESSAGE, object_id=instance.id, author_id=instance.sender_id,
+        conversation_id=instance.conversation_id, message_id=instance.id,
+        content=instance.content, created_at=instance.created_at,
+    )
+
+
+def index(instance):
+    document = _document_for(instance)
+    if not document.content:
+        unindex(instance)
+        return
+    SearchDocument.objects.update_or_create(
+        kind=document.kind, object_id=document.object_id,
+        defaults={
+            'author_id': document.author_id,
+            'post_id': document.post_id,
+            'post_owner_id': document.post_owner_id,
+            'conversation_id': document.conversation_id,
+            'comment_id': document.comment_id,
+            'message_id': document.message_id,
+            'content': document.content,
+            'created_at': document.created_at,
+        },
+    )
+
+
+def unindex(instance):
+    kind = _document_for(instance).kind
+    SearchDocument.objects.filter(kind=kind, object_id=instance.id).delete()
+
+
+def bulk_index(queryset, batch_size=1000):
+    """Index every post, comment or message in `queryset` with bulk inserts. Returns the number written."""
+    if queryset.model is Comment:
+        queryset = queryset.select_related('post')
+    written = 0
+    batch = []
+    for instance in queryset.exclude(content='').order_by('id').iterator(chunk_size=batch_size):
+        batch.append(_document_for(instance))
+        if len(batch) >= batch_size:
+            SearchDocument.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def rebuild(batch_size=1000):
+    """Re-index everything from scratch. Returns the number of documents written."""
+    SearchDocument.objects.all().delete()
+    return sum(
+        bulk_index(queryset, batch_size)
+        for queryset in (Post.objects.all(), Comment.objects.all(), *sharding.each_shard(Message.objects.all()))
+    )
@@ -0,0 +1,173 @@
+"""
+Horizontal sharding of the messaging tables by conversation id.
+
+Conversation, ConversationMember, Message and MessageArchiveSegment rows
+live on one of the databases named in settings.MESSAGE_SHARDS, the one at
+`conversation_id % len(MESSAGE_SHARDS)`, so chat traffic is spread over
+several databases and kept off the one serving feeds. Everything else stays
+in 'default'. With the default MESSAGE_SHARDS = ['default'] nothing moves.
+
+Every database carries the full schema; a shard's copies of the other
+tables simply stay empty. The foreign keys that cross databases
+(Message.sender, ConversationMember.user and SearchDocument's conversation
+and message) have no database constraint, and queries on a shard never
+join the user table: senders and members are looked up in 'default'.
+
+Ids stay unique across shards, so a row keeps its id when it moves:
+- conversation ids are handed out by ConversationDirectory in 'default',
+  which also keeps a one-to-one conversation's direct_key unique;
+- shard number i hands out message ids from i * ID_SPACING upwards
+  (reserve_message_ids, run after every migrate).
+
+Code working on one conversation picks its database with
+`.for_conversation(conversation_id)` on the messaging models' managers;
+related managers, Model.save() and Manager.create() are routed by
+MessageShardRouter. Queries over all of a user's conversations run once per
+shard. Changing the shard list means moving rows: see the reshard_messages
+command. Appending a shard is fine; reordering them is not.
+"""
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max
+
+ID_SPACING = 2 ** 40
+
+SHARDED_MODELS = {'core.conversation', 'core.conversationmember', 'core.message', 'core.messagearchivesegment'}
+
+# Backends whose id counter reserve_message_ids can move; core.checks rejects shards on anything else
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+
+def aliases():
+    return list(getattr(settings, 'MESSAGE_SHARDS', None) or [DEFAULT_DB_ALIAS])
+
+
+def shard_for(conversation_id, shards=None):
+    shards = shards or aliases()
+    return shards[conversation_id % len(shards)]
+
+
+def is_sharded(model_or_instance):
+    return model_or_instance._meta.label_lower in SHARDED_MODELS
+
+
+def group_by_shard(conversation_ids, shards=None):
+    """{alias: [conversation ids]} for the shards holding `conversation_ids`."""
+    groups = {}
+    for conversation_id in conversation_ids:
+        groups.setdefault(shard_for(conversation_id, shards), []).append(conversation_id)
+    return groups
+
+
+def each_shard(queryset):
+    """`queryset` once per shard, for queries that span conversations."""
+    return [queryset.using(alias) for alias in aliases()]
+
+
+def _conversation_id(instance):
+    if instance._meta.label_lower == 'core.conversation':
+        return instance.pk
+    return instance.conversation_id
+
+
+def bulk_create(model, objs, **kwargs):
+    """`model.objects.bulk_create(objs)` with every row sent to its conversation's shard."""
+    by_shard = {}
+    for obj in objs:
+        by_shard.setdefault(shard_for(_conversation_id(obj)), []).append(obj)
+    for alias, rows in by_shard.items():
+        model.objects.using(alias).bulk_create(rows, **kwargs)
+    return objs
+
+
+class MessageShardRouter:
+    """Sends the messaging models to their conversation's shard and everything else to 'default'."""
+
+    def _shard(self, model, hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is None or not is_sharded(instance):
+            return None
+        conversation_id = _conversation_id(instance)
+        return shard_for(conversation_id) if conversation_id else None
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if is_sharded(model) and instance is not None and is_sharded(instance) and instance._state.db:
+            # Related rows are read from wherever their instance came from
+            return instance._state.db
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(obj1) != is_sharded(obj2):
+            return True
+        return None
+
+
+def _set_sequence(alias, table, value):
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            current = cursor.fetchone()
+            if current is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, value])
+            else:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [value, table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s, %s)", [table, max(value, 1), value > 0])
+        else:
+            # Unreachable once the checks have passed (see core.checks)
+            raise NotImplementedError(f'Cannot set the message id counter on {connection.vendor}')
+
+
+def _current_sequence(alias, table):
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+        else:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            cursor.execute(f'SELECT last_value FROM {cursor.fetchone()[0]}')
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _top_message_id(alias, low, high):
+    # Archived messages count too: their ids live on in segments
+    Message = apps.get_model('core', 'Message')
+    MessageArchiveSegment = apps.get_model('core', 'MessageArchiveSegment')
+    tops = [
+        Message._base_manager.using(alias).filter(id__gte=low, id__lt=high).aggregate(top=Max('id'))['top'],
+        MessageArchiveSegment._base_manager.using(alias).filter(last_message_id__gte=low, last_message_id__lt=high)
+        .aggregate(top=Max('last_message_id'))['top'],
+    ]
+    return max((top for top in tops if top is not None), default=None)
+
+
+def reserve_message_ids(alias, shards=None, among=None):
+    """Point shard `alias`'s message id counter into its own range, above every id used from it.
+
+    Ids from that range are looked for on the databases in `among` (default:
+    just `alias`). After reshard_messages moves rows around, which keep their
+    ids, every shard has to be checked, and SQLite will have carried on
+    counting from the highest id moved in, whichever range it came from.
+    """
+    shards = shards or aliases()
+    # A single database keeps its own counter, whatever the backend
+    if alias not in shards or len(shards) == 1:
+        return
+    low = shards.index(alias) * ID_SPACING
+    high = low + ID_SPACING
+    table = apps.get_model('core', 'Message')._meta.db_table
+    tops = [_top_message_id(db, low, high) for db in among or [alias]]
+    current = _current_sequence(alias, table)
+    value = max([top for top in tops if top is not None] + [current if low <= current < high else low])
+    if value != current:
+        _set_sequence(alias, table, value)
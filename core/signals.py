@@ -0,0 +1,88 @@
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import conversations, notifications, search, sharding, trending, usercache
+from .models import Comment, Conversation, ConversationMember, FriendRequest, Like, Message, Notification, Post, User
+from .notifications import notify
+
+
+@receiver(post_save, sender=Like)
+def notify_like(sender, instance, created, **kwargs):
+    if created:
+        notify(Notification.VERB_LIKE, None, instance.user_id, instance.post_id)
+
+
+@receiver(post_save, sender=Comment)
+def notify_comment(sender, instance, created, **kwargs):
+    if created:
+        notify(Notification.VERB_COMMENT, None, instance.user_id, instance.post_id)
+
+
+@receiver(post_save, sender=FriendRequest)
+def notify_friend_request(sender, instance, created, **kwargs):
+    if created:
+        notify(Notification.VERB_FRIEND_REQUEST, instance.to_user_id, instance.from_user_id)
+
+
+# Unread rows removed by cascades (a purged post, a deleted actor, the admin) leave the badge
+@receiver(post_delete, sender=Notification)
+def recount_unread_notifications(sender, instance, **kwargs):
+    if not instance.is_read:
+        notifications.recount_unread_on_commit([instance.recipient_id])
+
+
+# Engagement feeds the trending scores; unlikes are recorded by likes.toggle_like
+@receiver(post_save, sender=Like)
+def score_like(sender, instance, created, **kwargs):
+    if created:
+        trending.record(instance.post_id, 'like')
+
+
+@receiver(post_save, sender=Comment)
+def score_comment(sender, instance, created, **kwargs):
+    if created:
+        trending.record(instance.post_id, 'comment')
+
+
+@receiver(post_save, sender=Post)
+def score_share(sender, instance, created, **kwargs):
+    if created and instance.shared_from_id:
+        trending.record(instance.shared_from_id, 'share')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Message)
+def update_search_index(sender, instance, **kwargs):
+    search.index(instance)
+
+
+# Membership changes made outside core.conversations (participants.add, the admin)
+@receiver(post_save, sender=ConversationMember)
+@receiver(post_delete, sender=ConversationMember)
+def invalidate_conversation_members(sender, instance, **kwargs):
+    conversations.invalidate_members(instance.conversation_id)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_conversation_participants(sender, instance, action, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, Conversation):
+        conversations.invalidate_members(instance.id)
+    else:
+        for conversation_id in pk_set or ():
+            conversations.invalidate_members(conversation_id)
+
+
+# Profile edits, password changes and logins all go through User.save()
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    usercache.invalidate_user(instance.id)
+
+
+# Each shard hands out message ids from its own range
+@receiver(post_migrate)
+def reserve_shard_message_ids(sender, using, **kwargs):
+    if sender.name == 'core':
+        sharding.reserve_message_ids(using)
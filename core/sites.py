@@ -0,0 +1,35 @@
+"""
+The project's admin site: Django's, plus staff-only pages for the sampling
+profiler's ring buffer (see core.profiling). Installed as admin.site by
+core.apps.CoreAdminConfig.
+"""
+
+from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from . import profiling
+
+
+class AdminSite(admin.AdminSite):
+    def get_urls(self):
+        return [
+            path('profiles/', self.admin_view(self.profile_list_view), name='profiles'),
+            path('profiles/<str:filename>', self.admin_view(self.profile_download_view), name='profile_download'),
+        ] + super().get_urls()
+
+    def profile_list_view(self, request):
+        context = {
+            **self.each_context(request),
+            'title': 'Request profiles',
+            'captures': profiling.get_store().list(),
+            'config': profiling.get_config(),
+        }
+        return TemplateResponse(request, 'admin/profiles.html', context)
+
+    def profile_download_view(self, request, filename):
+        path = profiling.get_store().path_for(filename)
+        if path is None:
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
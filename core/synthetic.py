@@ -0,0 +1,170 @@
+"""
+Synthetic data generator for benchmarks and staging.
+
+Builds a deterministic (seeded) social graph: users, a power-law friend
+graph grown by preferential attachment, posts, comments, likes and
+one-to-one conversations. Everything is written with bulk_create, and all
+users share one precomputed password hash.
+"""
+
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .comments import reconcile_comment_counts
+from . import sharding
+from .conversations import bulk_create as bulk_create_conversations, direct_key
+from .likes import reconcile_like_counts
+from .models import Comment, Conversation, ConversationMember, Friendship, Like, Message, Post, User
+
+DEFAULT_PASSWORD = 'benchmark123'
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+    'incididunt ut labore et dolore magna aliqua weekend coffee travel music photo '
+    'friends family today tomorrow happy great awesome new project city'
+).split()
+
+
+def _sentence(rng, low=4, high=20):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _preferential_attachment_edges(rng, n, m):
+    # Barabasi-Albert: each new node links to m existing nodes, picked proportionally to degree
+    edges = set()
+    repeated = []
+    for source in range(min(m, n), n):
+        chosen = set()
+        while len(chosen) < min(m, source):
+            pool = repeated if repeated and rng.random() < 0.9 else range(source)
+            chosen.add(rng.choice(pool))
+        for target in chosen:
+            edges.add((source, target))
+            repeated.extend([source, target])
+    return edges
+
+
+def generate(users=100, friends_per_user=3, posts_per_user=5, comments_per_post=3,
+             likes_per_post=5, conversations_per_user=2, messages_per_conversation=20,
+             seed=42, batch_size=1000, prefix='bench'):
+    """Create a synthetic data set and return a summary dict of row counts."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password(DEFAULT_PASSWORD)
+
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [
+                User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password)
+                for i in range(users)
+            ],
+            batch_size=batch_size,
+        )
+        user_ids = list(
+            User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True)
+        )[:users]
+
+        edges = _preferential_attachment_edges(rng, len(user_ids), friends_per_user)
+        friendships = []
+        for a, b in edges:
+            friendships.append(Friendship(user_id=user_ids[a], friend_id=user_ids[b]))
+            friendships.append(Friendship(user_id=user_ids[b], friend_id=user_ids[a]))
+        Friendship.objects.bulk_create(friendships, batch_size=batch_size, ignore_conflicts=True)
+
+        posts = [
+            Post(
+                user_id=user_id,
+                content=_sentence(rng),
+                created_at=now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+            )
+            for user_id in user_ids
+            for _ in range(rng.randint(0, posts_per_user * 2))
+        ]
+        posts = Post.objects.bulk_create(posts, batch_size=batch_size)
+        post_ids = [post.id for post in posts]
+
+        comments = []
+        likes = set()
+        for post in posts:
+            for _ in range(rng.randint(0, comments_per_post * 2)):
+                comments.append(Comment(
+                    post_id=post.id,
+                    user_id=rng.choice(user_ids),
+                    content=_sentence(rng, 2, 12),
+                    created_at=post.created_at + timedelta(minutes=rng.randint(1, 600)),
+                ))
+            for _ in range(rng.randint(0, likes_per_post * 2)):
+                likes.add((post.id, rng.choice(user_ids)))
+        Comment.objects.bulk_create(comments, batch_size=batch_size)
+        Like.objects.bulk_create(
+            [Like(post_id=post_id, user_id=user_id) for post_id, user_id in likes],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        for start in range(0, len(post_ids), batch_size):
+            reconcile_like_counts(post_ids[start:start + batch_size])
+            reconcile_comment_counts(post_ids[start:start + batch_size])
+
+        pairs = set()
+        for user_id in user_ids:
+            for _ in range(conversations_per_user):
+                other = rng.choice(user_ids)
+                if other != user_id:
+                    pairs.add(tuple(sorted((user_id, other))))
+        pairs = sorted(pairs)
+        conversations = bulk_create_conversations(
+            [Conversation(direct_key=direct_key(*pair)) for pair in pairs], batch_size
+        )
+        sharding.bulk_create(
+            ConversationMember,
+            [
+                ConversationMember(conversation_id=conversation.id, user_id=user_id)
+                for conversation, pair in zip(conversations, pairs)
+                for user_id in pair
+            ],
+            batch_size=batch_size,
+        )
+        messages = []
+        for conversation, pair in zip(conversations, pairs):
+            start = now - timedelta(days=rng.randint(0, 60))
+            for i in range(rng.randint(1, messages_per_conversation * 2)):
+                messages.append(Message(
+                    conversation_id=conversation.id,
+                    sender_id=rng.choice(pair),
+                    content=_sentence(rng, 1, 15),
+                    created_at=start + timedelta(minutes=i * 3),
+                ))
+        sharding.bulk_create(Message, messages, batch_size=batch_size)
+        # Everyone has read their conversations up to the latest message
+        latest = Message.objects.filter(conversation_id=OuterRef('conversation_id')).order_by('-id').values('id')[:1]
+        for shard, ids in sharding.group_by_shard([conversation.id for conversation in conversations]).items():
+            for start in range(0, len(ids), batch_size):
+                ConversationMember.objects.using(shard).filter(
+                    conversation_id__in=ids[start:start + batch_size]
+                ).update(last_read_message_id=Coalesce(Subquery(latest), 0))
+
+    return {
+        'users': len(user_ids),
+        'friendships': len(friendships),
+        'posts': len(posts),
+        'comments': len(comments),
+        'likes': len(likes),
+        'conversations': len(conversations),
+        'messages': len(messages),
+    }
+
+
+def hub_user(prefix='bench'):
+    # The best-connected synthetic user; benchmarks view the site as them
+    return (
+        User.objects.filter(username__startswith=prefix)
+        .annotate(degree=Count('friendships'))
+        .order_by('-degree', 'id')
+        .first()
+    )
@@ -0,0 +1,69 @@
+"""
+Background job handlers. See core.jobs for the queue itself.
+"""
+
+from datetime import timedelta
+
+from django.utils.dateparse import parse_datetime
+
+from . import deletion, jobs, trending
+from .comments import reconcile_comment_counts
+from .jobs import task
+from .likes import reconcile_like_counts
+from .models import User
+from .notifications import record_events
+
+
+@task(batch=True)
+def touch_last_active(payloads):
+    # Collapse many presence updates into one UPDATE per distinct timestamp bucket
+    latest = {}
+    for payload in payloads:
+        seen = parse_datetime(payload['at'])
+        if payload['user_id'] not in latest or seen > latest[payload['user_id']]:
+            latest[payload['user_id']] = seen
+    by_time = {}
+    for user_id, seen in latest.items():
+        by_time.setdefault(seen.replace(microsecond=0), []).append(user_id)
+    for seen, user_ids in by_time.items():
+        User.objects.filter(id__in=user_ids, last_active__lt=seen).update(last_active=seen)
+
+
+@task(batch=True)
+def reconcile_counters(payloads):
+    post_ids = set()
+    for payload in payloads:
+        post_ids.update(payload.get('post_ids', []))
+    reconcile_like_counts(post_ids or None)
+    reconcile_comment_counts(post_ids or None)
+
+
+@task(batch=True)
+def record_notifications(payloads):
+    record_events(payloads)
+
+
+@task(batch=True)
+def score_engagement(payloads):
+    trending.apply_events(payloads)
+
+
+@task(batch=True)
+def refresh_trending(payloads):
+    # Any number of queued refreshes collapse into one run
+    trending.refresh()
+    trending.schedule_refresh(delay=timedelta(seconds=trending.get_config()['REFRESH_SECONDS']))
+
+
+@task(batch=True)
+def purge_deleted(payloads):
+    # One bounded batch per run; the next is queued after a pause so other writers get a turn
+    if deletion.purge_batch():
+        deletion.schedule_purge(delay=timedelta(seconds=deletion.get_config()['PAUSE_SECONDS']))
+
+
+@task(batch=True)
+def maintain_queue(payloads):
+    jobs.release_stale_jobs()
+    jobs.purge_finished_jobs()
+    jobs.schedule_maintenance(delay=jobs.MAINTENANCE_INTERVAL)
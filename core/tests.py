@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import nullcontext
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, connections
+from django.core.management import CommandError, call_command
+from django.http import Http404, JsonResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    archive, async_views, checks, comments, conversations, deletion, export, friendships, importer, jobs,
+    notifications, profiling, ratelimit, search, sharding, synthetic, trending, views,
+)
+from .management.commands import benchmark
+from .metrics import registry
+from .middleware import InstrumentationMiddleware, ProfilingMiddleware
+from .conversations import unread_counts
+from .friendships import import_friends
+from .likes import toggle_like
+from .models import (
+    Comment, Conversation, ConversationDirectory, ConversationMember, FriendRequest, Friendship, Job, Like, Message,
+    Notification, Post, TrendingScore, User,
+)
+from .notifications import mark_all_read, record_events
+
+
+# SQLite reports lock contention instead of blocking; threads retry like a client would, but not forever
+LOCK_RETRIES = 200
+
+
+def retry_locked(func, *args):
+    for _ in range(LOCK_RETRIES):
+        try:
+            return func(*args)
+        except OperationalError:
+            time.sleep(0.001)
+    raise AssertionError(f'{func.__name__} still locked out after {LOCK_RETRIES} attempts')
+
+
+class LikeToggleTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='secret123')
+        self.post = Post.objects.create(user=self.author, content='hello')
+
+    def test_toggle_returns_state_and_count(self):
+        self.assertEqual(toggle_like(self.post.id, self.author.id), (True, 1))
+        self.assertEqual(toggle_like(self.post.id, self.author.id), (False, 0))
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+
+
+@override_settings(JOB_QUEUE_EAGER=False)
+class ConcurrentLikeToggleTests(TransactionTestCase):
+    THREADS = 8
+    TOGGLES_PER_THREAD = 10
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='secret123')
+        self.post = Post.objects.create(user=self.author, content='hello')
+        self.users = [
+            User.objects.create_user(username=f'fan{i}', password='secret123')
+            for i in range(self.THREADS)
+        ]
+
+    def test_counter_matches_rows_under_concurrency(self):
+        errors = []
+        start = threading.Barrier(self.THREADS * 2)
+
+        def hammer(user_id):
+            try:
+                start.wait()
+                for _ in range(self.TOGGLES_PER_THREAD):
+                    retry_locked(toggle_like, self.post.id, user_id)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        # Two threads per user simulate double clicks from separate tabs
+        threads = [
+            threading.Thread(target=hammer, args=(user.id,))
+            for user in self.users for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, Like.objects.filter(post=self.post).count())
+
+
+class FriendshipTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.carol = User.objects.create_user(username='carol', password='secret123')
+
+    def pairs(self):
+        return set(Friendship.objects.values_list('user__username', 'friend__username'))
+
+    def test_accept_writes_both_directions_once(self):
+        friend_request = FriendRequest.objects.create(from_user=self.bob, to_user=self.alice)
+        self.assertTrue(friendships.accept_request(friend_request))
+        self.assertFalse(friendships.accept_request(friend_request))
+        self.assertEqual(self.pairs(), {('alice', 'bob'), ('bob', 'alice')})
+        self.assertFalse(FriendRequest.objects.exists())
+
+    def test_accept_all_and_unfriend(self):
+        FriendRequest.objects.create(from_user=self.bob, to_user=self.alice)
+        FriendRequest.objects.create(from_user=self.carol, to_user=self.alice)
+        self.assertEqual(friendships.accept_all_requests(self.alice), 2)
+        self.assertEqual(Friendship.objects.count(), 4)
+        self.assertFalse(FriendRequest.objects.exists())
+
+        friendships.unfriend(self.bob, self.alice)
+        self.assertEqual(self.pairs(), {('alice', 'carol'), ('carol', 'alice')})
+
+    def test_import_command(self):
+        FriendRequest.objects.create(from_user=self.carol, to_user=self.alice)
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as fh:
+            fh.write('bob\ncarol\n\nnobody\nalice\n')
+        self.addCleanup(os.unlink, fh.name)
+        out = StringIO()
+        call_command('import_friends', 'alice', fh.name, stdout=out)
+
+        self.assertIn('friends with 2 of 4', out.getvalue())
+        self.assertEqual(self.pairs(), {
+            ('alice', 'bob'), ('bob', 'alice'), ('alice', 'carol'), ('carol', 'alice'),
+        })
+        self.assertFalse(FriendRequest.objects.exists())
+
+
+@override_settings(JOB_QUEUE_EAGER=False)
+class ConcurrentFriendAcceptTests(TransactionTestCase):
+    THREADS = 6
+
+    def test_double_accept_befriends_once(self):
+        alice = User.objects.create_user(username='alice', password='secret123')
+        bob = User.objects.create_user(username='bob', password='secret123')
+        friend_request = FriendRequest.objects.create(from_user=bob, to_user=alice)
+        results = []
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def accept():
+            try:
+                start.wait()
+                results.append(retry_locked(friendships.accept_request, friend_request))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        # Several tabs accepting the same request at once
+        threads = [threading.Thread(target=accept) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Friendship.objects.count(), 2)
+        self.assertFalse(FriendRequest.objects.exists())
+
+
+@override_settings(JOB_QUEUE_EAGER=False)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        # Register the real handlers first so the patched registry keeps them
+        jobs._load_tasks()
+        self.enterContext(mock.patch.dict(jobs._registry))
+        jobs.task(name='collect', batch=True)(self.calls.append)
+
+        def explode(**payload):
+            raise ValueError('boom')
+        jobs.task(name='explode', max_attempts=2)(explode)
+
+    def test_claims_are_exclusive_and_batch_tasks_get_every_payload_at_once(self):
+        jobs.enqueue_many('collect', [{'n': i} for i in range(3)])
+        self.assertEqual(len(jobs.claim_jobs(batch_size=2)), 2)
+        self.assertEqual(len(jobs.claim_jobs(batch_size=2)), 1)
+        self.assertEqual(jobs.claim_jobs(), [])
+
+        Job.objects.all().delete()
+        jobs.enqueue_many('collect', [{'n': i} for i in range(3)])
+        jobs.enqueue('collect', delay=timezone.timedelta(hours=1), n=3)
+        self.assertEqual(jobs.run_jobs(), 3)
+        self.assertEqual(self.calls, [[{'n': 0}, {'n': 1}, {'n': 2}]])
+        self.assertEqual(Job.objects.filter(status=Job.STATUS_DONE).count(), 3)
+        self.assertEqual(Job.objects.get(status=Job.STATUS_PENDING).payload, {'n': 3})
+
+    def test_failures_back_off_then_give_up_after_max_attempts(self):
+        job = jobs.enqueue('explode', n=1)
+        before = timezone.now()
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_PENDING, 1))
+        self.assertIn('boom', job.last_error)
+        self.assertGreaterEqual(job.run_at, before + timezone.timedelta(seconds=2))
+        self.assertEqual(jobs.run_jobs(), 0)
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+
+    def test_maintenance_releases_stale_jobs_purges_old_ones_and_requeues_itself(self):
+        long_ago = timezone.now() - timezone.timedelta(days=30)
+        old = Job.objects.create(task='collect', status=Job.STATUS_DONE, run_at=long_ago)
+        recent = Job.objects.create(task='collect', status=Job.STATUS_DONE)
+        stale = Job.objects.create(task='collect', status=Job.STATUS_RUNNING, locked_by='gone', locked_at=long_ago)
+
+        jobs.schedule_maintenance()
+        jobs.schedule_maintenance()
+        self.assertEqual(jobs.run_jobs(), 1)
+        self.assertFalse(Job.objects.filter(id=old.id).exists())
+        self.assertTrue(Job.objects.filter(id=recent.id).exists())
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.locked_by), (Job.STATUS_PENDING, ''))
+        upcoming = Job.objects.get(task='maintain_queue', status=Job.STATUS_PENDING)
+        self.assertGreater(upcoming.run_at, timezone.now() + jobs.MAINTENANCE_INTERVAL / 2)
+
+
+class NotificationAggregationTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='secret123')
+        self.post = Post.objects.create(user=self.author, content='hello')
+        self.fans = [User.objects.create_user(username=f'fan{i}', password='secret123') for i in range(5)]
+
+    def like_event(self, user):
+        return {
+            'verb': Notification.VERB_LIKE,
+            'recipient_id': None,
+            'actor_id': user.id,
+            'post_id': self.post.id,
+            'at': timezone.now().isoformat(),
+        }
+
+    def test_likes_in_one_window_share_a_row(self):
+        record_events([self.like_event(fan) for fan in self.fans[:3]])
+        record_events([self.like_event(fan) for fan in self.fans[2:]])
+
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.actor_count, 5)
+        self.assertEqual(notification.get_message(), 'fan4 and 4 others liked your post')
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notifications, 1)
+
+    def test_read_row_becomes_unread_again(self):
+        record_events([self.like_event(self.fans[0])])
+        mark_all_read(self.author)
+        record_events([self.like_event(self.fans[1])])
+
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notifications, 1)
+
+    def test_own_actions_are_ignored(self):
+        record_events([self.like_event(self.author)])
+        self.assertFalse(Notification.objects.exists())
+
+    def test_concurrent_insert_of_the_same_aggregate_is_folded_in(self):
+        record_events([self.like_event(self.fans[0])])
+        # As if another worker inserted the row after this one looked for it
+        missed = [Notification.objects.none(), Notification.objects.select_for_update()]
+        with mock.patch.object(Notification.objects, 'select_for_update', side_effect=missed):
+            record_events([self.like_event(self.fans[1])])
+        self.assertEqual(Notification.objects.get().actor_count, 2)
+
+    def test_deleting_unread_notifications_recounts_the_badge(self):
+        record_events([self.like_event(self.fans[0])])
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.all_objects.filter(id=self.post.id).delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notifications, 0)
+
+    def test_bulk_delete_recounts_each_recipient_once(self):
+        fan = self.fans[0]
+        posts = [Post.objects.create(user=author, content='hi') for author in self.fans[1:] for _ in range(3)]
+        record_events([{**self.like_event(fan), 'post_id': post.id} for post in posts])
+        self.assertEqual(Notification.objects.count(), 12)
+
+        with mock.patch.object(notifications, 'recount_unread', wraps=notifications.recount_unread) as recount:
+            with self.captureOnCommitCallbacks(execute=True):
+                User.objects.filter(id=fan.id).delete()
+        recount.assert_called_once()
+        self.assertEqual(set(recount.call_args.args[0]), {author.id for author in self.fans[1:]})
+        self.assertFalse(User.objects.filter(unread_notifications__gt=0).exists())
+
+    def test_opening_the_dropdown_lists_and_clears_notifications(self):
+        record_events([self.like_event(self.fans[0])])
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(reverse('home')), 'id="notification-badge"')
+        listed = self.client.get(reverse('notifications')).json()
+        self.assertEqual([n['message'] for n in listed['notifications']], ['fan0 liked your post'])
+        self.assertEqual(listed['unread_count'], 1)
+
+        self.client.post(reverse('mark_notifications_read'))
+        self.assertNotContains(self.client.get(reverse('home')), 'id="notification-badge"')
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.users = [User.objects.create_user(username=f'user{i}', password='secret123') for i in range(3)]
+        self.enterContext(override_settings(INSTRUMENTATION={
+            'ENABLED': True, 'DEFAULT_QUERY_BUDGET': 2, 'N_PLUS_ONE_THRESHOLD': 3, 'METRICS_TOKEN': 'sesame',
+        }))
+
+    def one_query_per_user(self, request):
+        return JsonResponse({'names': [User.objects.get(id=user.id).username for user in self.users]})
+
+    def test_over_budget_and_repeated_queries_are_logged_and_counted(self):
+        middleware = InstrumentationMiddleware(self.one_query_per_user)
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            middleware(RequestFactory().get('/names/'))
+        self.assertIn('Query budget exceeded for unmatched (/names/): 3 queries, budget 2', logs.output[0])
+        self.assertIn('Possible N+1 in unmatched (/names/): 3x SELECT ... FROM', logs.output[1])
+
+        metrics = registry.render()
+        self.assertIn('socialconnect_db_queries_per_request_sum{view="unmatched"} 3', metrics)
+        self.assertIn('socialconnect_query_budget_exceeded_total{view="unmatched"} 1', metrics)
+        self.assertIn('socialconnect_n_plus_one_total{view="unmatched"} 1', metrics)
+
+    def test_requests_that_raise_are_recorded(self):
+        def broken(request):
+            User.objects.count()
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            InstrumentationMiddleware(broken)(RequestFactory().get('/broken/'))
+        self.assertIn('socialconnect_request_duration_seconds_count{view="unmatched"} 1', registry.render())
+
+    async def test_async_views_stay_async_and_are_counted(self):
+        async def names(request):
+            return await sync_to_async(self.one_query_per_user)(request)
+
+        # Loaded on the thread the ORM runs on, whose test connection is already open
+        middleware = await sync_to_async(InstrumentationMiddleware)(names)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.assertLogs('core.middleware', 'WARNING'):
+            await middleware(RequestFactory().get('/names/'))
+        self.assertIn('socialconnect_db_queries_per_request_sum{view="unmatched"} 3', registry.render())
+
+    def test_metrics_endpoint_needs_the_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer sesame')
+        self.assertEqual(response.status_code, 200)
+        # The scrape itself went through the middleware before the registry was rendered
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer sesame')
+        self.assertIn('socialconnect_request_duration_seconds_count{view="metrics"} 2', response.content.decode())
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.admin = User.objects.create_user(username='admin', password='secret123', is_staff=True, is_superuser=True)
+
+    def profiling(self, **config):
+        return override_settings(PROFILING={
+            'ENABLED': True, 'SAMPLE_RATE': 0, 'SLOW_THRESHOLD_MS': None, 'SAMPLE_INTERVAL_MS': 5,
+            'DIRECTORY': self.directory.name, 'MAX_PROFILES': 2, **config,
+        })
+
+    def test_sampled_requests_are_captured_and_browsable_by_staff(self):
+        self.client.force_login(self.admin)
+        with self.profiling(SAMPLE_RATE=1):
+            for _ in range(3):
+                self.client.get(reverse('notifications'))
+        captures = profiling.ProfileStore(self.directory.name, 2).list()
+        # The ring buffer keeps only MAX_PROFILES
+        self.assertEqual(len(captures), 2)
+        self.assertEqual((captures[0]['kind'], captures[0]['view']), ('sampled', 'notifications'))
+        self.assertTrue(captures[0]['sql'])
+
+        with self.profiling():
+            listing = self.client.get(reverse('admin:profiles'))
+            self.assertContains(listing, captures[0]['name'])
+            download = self.client.get(reverse('admin:profile_download', args=[captures[0]['prof_file']]))
+            self.assertEqual(download.status_code, 200)
+            self.assertEqual(self.client.get(reverse('admin:profile_download', args=['..'])).status_code, 404)
+
+    def test_watchdog_samples_requests_that_overrun_the_threshold(self):
+        wrappers = []
+
+        def slow_view(request):
+            wrappers.extend(connection.execute_wrappers)
+            connection.ensure_connection()
+            connection.connection.create_function('sleep_ms', 1, lambda ms: time.sleep(ms / 1000))
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT sleep_ms(60)')
+            return JsonResponse({})
+
+        before = list(connection.execute_wrappers)
+        with self.profiling(SLOW_THRESHOLD_MS=10):
+            middleware = ProfilingMiddleware(slow_view)
+            middleware(RequestFactory().get('/slow/'))
+        # Watched requests run without a wrapper of their own on the connections
+        self.assertEqual(wrappers, before)
+        [capture] = profiling.ProfileStore(self.directory.name, 2).list()
+        self.assertEqual(capture['kind'], 'slow')
+        self.assertTrue(any('slow_view' in frame for entry in capture['stacks'] for frame in entry['stack']))
+        self.assertEqual([statement['sql'] for statement in capture['sql']], ['SELECT sleep_ms(60)'])
+
+    async def test_async_requests_are_sampled_and_watched(self):
+        async def slow_view(request):
+            await sync_to_async(User.objects.count)()
+            await asyncio.sleep(0.05)
+            return JsonResponse({})
+
+        with self.profiling(SAMPLE_RATE=1):
+            middleware = ProfilingMiddleware(slow_view)
+            self.assertTrue(iscoroutinefunction(middleware))
+            await middleware(RequestFactory().get('/sampled/'))
+        with self.profiling(SLOW_THRESHOLD_MS=10):
+            await ProfilingMiddleware(slow_view)(RequestFactory().get('/slow/'))
+
+        slow, sampled = await sync_to_async(profiling.ProfileStore(self.directory.name, 2).list)()
+        self.assertEqual((sampled['kind'], sampled['path']), ('sampled', '/sampled/'))
+        self.assertEqual(len(sampled['sql']), 1)
+        self.assertEqual((slow['kind'], slow['path']), ('slow', '/slow/'))
+
+    def test_watchdog_sleeps_while_nothing_is_in_flight(self):
+        watchdog = profiling.Watchdog(interval=0.001)
+        sampled = threading.Event()
+        with mock.patch.object(watchdog, 'sample', side_effect=lambda records: sampled.set()):
+            watchdog.start()
+            self.assertFalse(sampled.wait(0.05))
+            record = profiling.InFlight(threading.get_ident(), threshold=0)
+            watchdog.track(record)
+            self.assertTrue(sampled.wait(1))
+            watchdog.untrack(record)
+
+    def test_watchdog_tracks_requests_sharing_a_thread_separately(self):
+        watchdog = profiling.Watchdog(interval=1)
+        first = profiling.InFlight(threading.get_ident(), threshold=1)
+        second = profiling.InFlight(threading.get_ident(), threshold=1)
+        watchdog.track(first)
+        watchdog.track(second)
+        watchdog.untrack(first)
+        self.assertEqual(watchdog.requests, {second})
+
+
+class SearchTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.carol = User.objects.create_user(username='carol', password='secret123')
+        import_friends(self.alice, ['bob'])
+
+    def search_ids(self, user, query, **kwargs):
+        documents, _ = search.search(user, query, **kwargs)
+        return [(doc.kind, doc.object_id) for doc in documents]
+
+    def test_respects_friendship_and_conversation_visibility(self):
+        friend_post = Post.objects.create(user=self.bob, content='Sunny weekend hiking')
+        stranger_post = Post.objects.create(user=self.carol, content='Rainy weekend reading')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.bob, self.carol)
+        message = Message.objects.create(conversation=conversation, sender=self.carol, content='weekend plans?')
+
+        self.assertEqual(self.search_ids(self.alice, 'weekend'), [('post', friend_post.id)])
+        self.assertEqual(
+            self.search_ids(self.carol, 'weekend'),
+            [('message', message.id), ('post', stranger_post.id)],
+        )
+
+    def test_prefix_match_and_keyset_pages(self):
+        posts = [Post.objects.create(user=self.alice, content=f'photography tip {i}') for i in range(5)]
+        first, cursor = search.search(self.alice, 'photo', limit=3)
+        second, last_cursor = search.search(self.alice, 'photo', limit=3, before=cursor)
+        self.assertEqual([d.object_id for d in first + second], [p.id for p in reversed(posts)])
+        self.assertIsNone(last_cursor)
+
+    def test_deleting_content_removes_it_from_results(self):
+        post = Post.objects.create(user=self.alice, content='secret recipe')
+        Comment.objects.create(post=post, user=self.bob, content='recipe looks great')
+        self.assertEqual(len(self.search_ids(self.alice, 'recipe')), 2)
+        post.delete()
+        self.assertEqual(self.search_ids(self.alice, 'recipe'), [])
+
+
+class MessageArchiveTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        old = timezone.now() - timezone.timedelta(days=400)
+        for i in range(120):
+            sender = self.alice if i % 2 else self.bob
+            created_at = old if i < 100 else timezone.now()
+            Message.objects.create(conversation=self.conversation, sender=sender, content=f'm{i}', created_at=created_at)
+
+    def test_archive_moves_old_messages_into_segments(self):
+        call_command('archive_messages', days=180, segment_size=40, stdout=StringIO())
+        self.assertEqual(self.conversation.messages.count(), 20)
+        self.assertEqual(
+            list(self.conversation.archive_segments.values_list('message_count', flat=True)), [40, 40, 20]
+        )
+
+    def test_history_pages_from_hot_table_into_archive(self):
+        call_command('archive_messages', days=180, segment_size=40, stdout=StringIO())
+        self.client.force_login(self.alice)
+        url = reverse('get_message_history', args=[self.conversation.id])
+
+        seen = []
+        before_id = ''
+        while True:
+            data = self.client.get(url, {'before_id': before_id}).json()
+            seen = [m['content'] for m in data['messages']] + seen
+            if not data['has_more']:
+                break
+            before_id = data['messages'][0]['id']
+
+        self.assertEqual(seen, [f'm{i}' for i in range(120)])
+
+
+class ReadWatermarkTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.bob, content=f'm{i}')
+        self.url = reverse('get_messages_json', args=[self.conversation.id])
+
+    def test_polling_advances_watermark_once(self):
+        self.assertEqual(unread_counts(self.alice), {self.conversation.id: 3})
+        self.client.force_login(self.alice)
+        self.client.get(self.url)
+        self.assertEqual(unread_counts(self.alice), {})
+
+        # Nothing new since the last poll: no UPDATE is issued
+        with CaptureQueriesContext(connections[sharding.shard_for(self.conversation.id)]) as queries:
+            self.client.get(self.url)
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE')])
+
+    def test_read_receipts_follow_other_watermark(self):
+        self.client.force_login(self.bob)
+        self.assertFalse(any(m['seen'] for m in self.client.get(self.url).json()['messages']))
+        self.conversation.memberships.filter(user=self.alice).update(
+            last_read_message_id=self.conversation.messages.order_by('id')[1].id
+        )
+        seen = [m['seen'] for m in self.client.get(self.url).json()['messages']]
+        self.assertEqual(seen, [True, True, False])
+
+    def test_polls_after_id_return_only_newer_messages_up_to_a_window(self):
+        self.client.force_login(self.alice)
+        first = self.client.get(self.url).json()
+        self.assertTrue(first['reset'])
+        last_id = first['messages'][-1]['id']
+
+        empty = self.client.get(self.url, {'after_id': last_id}).json()
+        self.assertEqual((empty['messages'], empty['reset']), ([], False))
+        newer = Message.objects.create(conversation=self.conversation, sender=self.bob, content='new')
+        polled = self.client.get(self.url, {'after_id': last_id}).json()
+        self.assertEqual([m['content'] for m in polled['messages']], ['new'])
+        self.assertEqual(polled['watermarks'], [0])
+
+        # Falling a whole window behind starts the client over from the latest window
+        for i in range(views.CONVERSATION_WINDOW + 5):
+            Message.objects.create(conversation=self.conversation, sender=self.bob, content=f'n{i}')
+        behind = self.client.get(self.url, {'after_id': newer.id}).json()
+        self.assertTrue(behind['reset'])
+        self.assertEqual(len(behind['messages']), views.CONVERSATION_WINDOW)
+        self.assertEqual(behind['messages'][-1]['content'], f'n{views.CONVERSATION_WINDOW + 4}')
+
+
+class DirectConversationTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+
+    def test_start_conversation_is_idempotent_for_both_sides(self):
+        self.client.force_login(self.alice)
+        first = self.client.get(reverse('start_conversation', args=['bob']))
+        self.client.force_login(self.bob)
+        second = self.client.get(reverse('start_conversation', args=['alice']))
+
+        self.assertEqual(first.url, second.url)
+        conversation_id = ConversationDirectory.objects.get().id
+        conversation = Conversation.objects.for_conversation(conversation_id).get()
+        self.assertEqual(conversation.direct_key, f'{self.alice.id}:{self.bob.id}')
+        self.assertEqual(set(conversations.members(conversation.id)), {self.alice.id, self.bob.id})
+
+
+class GroupConversationTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='secret123')
+        self.friends = [User.objects.create_user(username=f'friend{i}', password='secret123') for i in range(5)]
+        self.stranger = User.objects.create_user(username='stranger', password='secret123')
+        import_friends(self.owner, [friend.username for friend in self.friends])
+        self.client.force_login(self.owner)
+
+    def create_group(self, usernames):
+        self.client.post(reverse('create_group_conversation'), {'title': 'Team', 'members': usernames})
+        group_id = ConversationDirectory.objects.get().id
+        return Conversation.objects.for_conversation(group_id).get(is_group=True)
+
+    def test_create_group_only_invites_friends(self):
+        group = self.create_group(['friend0', 'friend1', 'stranger'])
+        self.assertEqual(
+            set(User.objects.filter(id__in=list(conversations.members(group.id))).values_list('username', flat=True)),
+            {'owner', 'friend0', 'friend1'},
+        )
+        self.assertTrue(group.memberships.get(user=self.owner).is_admin)
+
+    def test_add_members_is_one_insert_and_refreshes_cached_membership(self):
+        group = self.create_group(['friend0'])
+        self.assertEqual(len(conversations.members(group.id)), 2)
+        Message.objects.create(conversation=group, sender=self.owner, content='before you joined')
+
+        with CaptureQueriesContext(connections[group._state.db]) as queries:
+            self.client.post(
+                reverse('add_conversation_members', args=[group.id]), {'members': ['friend2', 'friend3', 'friend4']}
+            )
+        inserts = [
+            q for q in queries if q['sql'].startswith('INSERT') and '"core_conversation_participants"' in q['sql']
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len(conversations.members(group.id)), 5)
+        # Joining does not flood the newcomer with unread history
+        self.assertEqual(unread_counts(self.friends[2]), {})
+
+    def test_leaving_admin_hands_over_and_member_loses_access(self):
+        group = self.create_group(['friend0', 'friend1'])
+        self.client.post(reverse('remove_conversation_member', args=[group.id, self.owner.id]))
+
+        self.assertEqual(self.client.get(reverse('conversation_members', args=[group.id])).status_code, 404)
+        self.assertEqual(list(group.memberships.filter(is_admin=True).values_list('user_id', flat=True)),
+                         [self.friends[0].id])
+
+    def test_removal_revokes_access_even_with_a_stale_membership_cache(self):
+        group = self.create_group(['friend0', 'friend1'])
+        self.client.force_login(self.friends[1])
+        stale = conversations.members(group.id)
+        group.memberships.filter(user=self.friends[1]).delete()
+        # As another process with its own cache would still see it
+        cache.set(conversations._members_key(group.id), stale)
+
+        for name in ('conversation_members', 'get_message_history'):
+            self.assertEqual(self.client.get(reverse(name, args=[group.id])).status_code, 404)
+
+    def test_only_admins_remove_others(self):
+        group = self.create_group(['friend0', 'friend1'])
+        self.client.force_login(self.friends[0])
+        response = self.client.post(reverse('remove_conversation_member', args=[group.id, self.friends[1].id]))
+        self.assertEqual(response.status_code, 403)
+
+        data = self.client.get(reverse('conversation_members', args=[group.id])).json()
+        self.assertEqual([m['username'] for m in data['members']], ['friend0', 'friend1', 'owner'])
+
+
+@override_settings(RATE_LIMITS={'CLASSES': {'write': {'CAPACITY': 3, 'PER_MINUTE': 6}}})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit._stores.clear()
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.post = Post.objects.create(user=self.bob, content='hello')
+        self.url = reverse('like_post', args=[self.post.id])
+
+    def test_bucket_is_per_user_and_reports_retry_after(self):
+        self.client.force_login(self.alice)
+        throttled = [self.client.post(self.url).status_code == 429 for _ in range(4)]
+        self.assertEqual(throttled, [False, False, False, True])
+        self.assertEqual(self.client.post(self.url)['Retry-After'], '10')
+
+        self.client.force_login(self.bob)
+        self.assertNotEqual(self.client.post(self.url).status_code, 429)
+
+
+class CoalesceTests(TestCase):
+    def test_concurrent_identical_requests_share_one_execution(self):
+        calls = []
+        release = threading.Event()
+
+        @ratelimit.coalesce
+        def slow_view(request):
+            calls.append(1)
+            release.wait(5)
+            return JsonResponse({'calls': len(calls)})
+
+        user = User.objects.create_user(username='poller', password='secret123')
+        factory = RequestFactory()
+        responses = []
+
+        def poll():
+            request = factory.get('/poll/?since=1')
+            request.user = user
+            responses.append(slow_view(request))
+
+        threads = [threading.Thread(target=poll) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while not calls:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.content for r in responses], [b'{"calls": 1}'] * 5)
+
+
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    AUTH_USER_CACHE={'ENABLED': True},
+)
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.client.force_login(self.alice)
+        self.url = reverse('unread_notification_count')
+
+    def test_warm_request_needs_no_session_or_user_query(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).json(), {'unread_count': 0})
+
+    def test_updates_invalidate_the_cached_user(self):
+        self.client.get(self.url)
+        record_events([{
+            'verb': Notification.VERB_FRIEND_REQUEST,
+            'recipient_id': self.alice.id,
+            'actor_id': User.objects.create_user(username='bob').id,
+            'at': timezone.now().isoformat(),
+        }])
+        self.assertEqual(self.client.get(self.url).json(), {'unread_count': 1})
+
+        self.client.post(reverse('profile'), {'bio': 'new bio'})
+        self.assertEqual(self.client.get(reverse('profile')).context['user'].bio, 'new bio')
+
+    def test_password_change_logs_out_cached_sessions(self):
+        self.client.get(self.url)
+        self.alice.set_password('changed123')
+        self.alice.save()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class PostFragmentTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='secret123')
+        self.client.force_login(self.user)
+
+    def test_create_post_returns_rendered_card(self):
+        response = self.client.post(reverse('create_post'), {'content': 'Hello feed'})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        post = Post.objects.get(id=data['post']['id'])
+        self.assertEqual(post.user, self.user)
+        self.assertIn(f'data-post-id="{post.id}"', data['html'])
+        self.assertIn('Hello feed', data['html'])
+
+    def test_create_post_requires_content(self):
+        response = self.client.post(reverse('create_post'), {'content': '  '})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Post.objects.exists())
+
+    def test_comment_fragment_is_escaped(self):
+        post = Post.objects.create(user=self.user, content='Post')
+        response = self.client.post(
+            reverse('add_comment', args=[post.id]), {'content': '<b>hi</b>'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        data = response.json()
+        self.assertEqual(data['comment_count'], 1)
+        self.assertIn('&lt;b&gt;hi&lt;/b&gt;', data['html'])
+
+    def test_profile_posts_get_the_paged_comment_section(self):
+        Post.objects.create(user=self.user, content='First')
+        Post.objects.create(user=self.user, content='Second')
+        response = self.client.get(reverse('profile', args=['author']))
+        self.assertContains(response, 'class="comments-more-btn"', count=2)
+        self.assertContains(response, "js/comments.js")
+
+    def test_profile_liked_state_does_not_cost_a_query_per_post(self):
+        other = User.objects.create_user(username='other', password='secret123')
+        original = Post.objects.create(user=other, content='Original')
+        liked = Post.objects.create(user=self.user, content='Liked', shared_from=original)
+        Post.objects.create(user=self.user, content='Not liked')
+        toggle_like(liked.id, self.user.id)
+        url = reverse('profile', args=['author'])
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertContains(response, 'like-btn liked', count=1)
+
+        for i in range(5):
+            Post.objects.create(user=self.user, content=f'More {i}', shared_from=original)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(many), len(few))
+
+
+class AsyncViewTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.conversation, _ = conversations.get_or_create_direct(self.alice, self.bob)
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.bob, content=f'm{i}')
+        self.url = reverse('get_messages_json', args=[self.conversation.id])
+        self.factory = AsyncRequestFactory()
+
+    def request(self, user, method='get', path=None, **kwargs):
+        request = getattr(self.factory, method)(path or self.url, **kwargs)
+        request.user = user
+        return request
+
+    async def test_messages_match_sync_view_and_advance_watermark(self):
+        response = await async_views.get_messages_json(self.request(self.alice), self.conversation.id)
+        self.assertEqual(len(json.loads(response.content)['messages']), 3)
+        self.assertEqual(await sync_to_async(unread_counts)(self.alice), {})
+
+        sync_response = await sync_to_async(views.get_messages_json)(self.request(self.bob), self.conversation.id)
+        async_response = await async_views.get_messages_json(self.request(self.bob), self.conversation.id)
+        self.assertEqual(json.loads(async_response.content), json.loads(sync_response.content))
+
+    async def test_non_members_and_anonymous_users_are_turned_away(self):
+        carol = await User.objects.acreate(username='carol')
+        with self.assertRaises(Http404):
+            await async_views.get_messages_json(self.request(carol), self.conversation.id)
+        response = await async_views.get_messages_json(self.request(AnonymousUser()), self.conversation.id)
+        self.assertEqual(response.status_code, 302)
+
+    async def test_like_post_toggles(self):
+        post = await Post.objects.acreate(user=self.bob, content='Post')
+        path = reverse('like_post', args=[post.id])
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+        first = await async_views.like_post(self.request(self.alice, 'post', path, headers=headers), post.id)
+        second = await async_views.like_post(self.request(self.alice, 'post', path, headers=headers), post.id)
+        self.assertEqual(json.loads(first.content), {'success': True, 'liked': True, 'like_count': 1})
+        self.assertEqual(json.loads(second.content), {'success': True, 'liked': False, 'like_count': 0})
+
+    async def test_coalesce_shares_one_execution(self):
+        calls = []
+        release = asyncio.Event()
+
+        @ratelimit.coalesce
+        async def slow_view(request):
+            calls.append(1)
+            await release.wait()
+            return JsonResponse({'calls': len(calls)})
+
+        pending = asyncio.gather(*[slow_view(self.request(self.alice, path='/poll/')) for _ in range(5)])
+        await asyncio.sleep(0.05)
+        release.set()
+        responses = await pending
+        self.assertEqual(calls, [1])
+        self.assertEqual({response.content for response in responses}, {b'{"calls": 1}'})
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='secret123')
+        self.post = Post.objects.create(user=self.user, content='Viral')
+        self.client.force_login(self.user)
+
+    def test_replies_join_the_top_level_thread_and_bump_counters(self):
+        top, _ = comments.add_comment(self.post, self.user, 'first')
+        reply, _ = comments.add_comment(self.post, self.user, 'reply', parent=top)
+        nested, count = comments.add_comment(self.post, self.user, 'reply to reply', parent=reply)
+        self.assertEqual(nested.parent_id, top.id)
+        self.assertEqual(count, 3)
+        top.refresh_from_db()
+        self.assertEqual(top.reply_count, 2)
+
+        data = self.client.get(reverse('get_comment_replies', args=[top.id])).json()
+        self.assertEqual([c['content'] for c in data['comments']], ['reply', 'reply to reply'])
+        self.assertEqual(data['count'], 2)
+
+    def test_top_level_comments_are_keyset_paginated_without_counting(self):
+        Comment.objects.bulk_create([
+            Comment(post=self.post, user=self.user, content=f'c{i}') for i in range(comments.COMMENT_PAGE_SIZE + 5)
+        ])
+        comments.reconcile_comment_counts([self.post.id])
+        url = reverse('get_comments', args=[self.post.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url).json()
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+        self.assertEqual(len(first['comments']), comments.COMMENT_PAGE_SIZE)
+        self.assertEqual(first['count'], comments.COMMENT_PAGE_SIZE + 5)
+
+        second = self.client.get(url, {'after': first['next_cursor']}).json()
+        self.assertEqual([c['content'] for c in second['comments']], [f'c{i}' for i in range(20, 25)])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_reconcile_repairs_counts_after_deletes(self):
+        top, _ = comments.add_comment(self.post, self.user, 'first')
+        reply, _ = comments.add_comment(self.post, self.user, 'reply', parent=top)
+        reply.delete()
+        comments.reconcile_comment_counts()
+        self.post.refresh_from_db()
+        top.refresh_from_db()
+        self.assertEqual((self.post.comment_count, top.reply_count), (1, 0))
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='poster', password='secret123')
+        self.quiet = Post.objects.create(user=self.user, content='Quiet')
+        self.busy = Post.objects.create(user=self.user, content='Busy')
+
+    def event(self, post, kind, sign=1, ago=0):
+        at = timezone.now() - timezone.timedelta(seconds=ago)
+        return {'post_id': post.id, 'kind': kind, 'sign': sign, 'at': at.isoformat()}
+
+    def test_engagement_is_scored_incrementally_with_decay(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.user, post=self.busy)
+        trending.apply_events([self.event(self.quiet, 'like', ago=3600), self.event(self.quiet, 'comment', ago=3600)])
+        self.assertEqual(trending.top_post_ids('hour'), [self.busy.id, self.quiet.id])
+
+        # Unliking more than was liked floors the score at zero, which drops it from the ranking
+        trending.apply_events([self.event(self.quiet, 'like', sign=-1), self.event(self.quiet, 'like', sign=-1)])
+        self.assertEqual(TrendingScore.objects.get(window='hour', post=self.quiet).score, 0)
+        trending.refresh()
+        self.assertEqual(trending.top_post_ids('hour'), [self.busy.id])
+
+    def test_refresh_moves_rows_to_the_current_landmark_and_prunes_dead_ones(self):
+        half_life = trending.get_config()['WINDOWS']['day']
+        epoch = trending._epoch(timezone.now().timestamp(), half_life)
+        TrendingScore.objects.create(window='day', post=self.busy, epoch=epoch - 1, score=1e40)
+        TrendingScore.objects.create(window='day', post=self.quiet, epoch=epoch - 1, score=1.0)
+
+        trending.refresh()
+        row = TrendingScore.objects.get(window='day')
+        self.assertEqual((row.post_id, row.epoch), (self.busy.id, epoch))
+        self.assertAlmostEqual(row.score / 1e40, 2.0 ** -trending.EPOCH_HALF_LIVES)
+        self.assertEqual(cache.get('trending:day'), [self.busy.id])
+
+    def test_popular_tab_renders_ranked_posts(self):
+        trending.apply_events([self.event(self.quiet, 'like'), self.event(self.busy, 'share')])
+        trending.refresh()
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('home'), {'tab': 'popular', 'window': 'day'})
+        self.assertEqual([post.id for post in response.context['posts']], [self.busy.id, self.quiet.id])
+        # Windows are half-lives, so the tabs do not promise a time period
+        self.assertNotContains(response, 'past hour')
+        self.assertEqual(self.client.get(reverse('home'), {'tab': 'popular', 'window': 'year'}).context['window'], 'day')
+
+
+class SoftDeleteTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.post = Post.objects.create(user=self.alice, content='Going away')
+        self.other = Post.objects.create(user=self.bob, content='Staying')
+
+    def purge(self, batch_size):
+        batches = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            while deletion.purge_batch(batch_size):
+                batches += 1
+        return batches
+
+    def test_deleted_post_is_hidden_at_once_and_purged_in_batches(self):
+        for i in range(3):
+            comments.add_comment(self.post, self.bob, f'c{i}')
+        toggle_like(self.post.id, self.bob.id)
+        self.client.force_login(self.alice)
+
+        response = self.client.post(reverse('delete_post', args=[self.post.id]))
+        self.assertTrue(response.json()['success'])
+        self.assertFalse(Post.objects.filter(id=self.post.id).exists())
+        self.assertEqual(Comment.objects.filter(post_id=self.post.id).count(), 3)
+
+        # Three comments and a like, two rows per batch, then the post
+        self.assertEqual(self.purge(batch_size=2), 4)
+        self.assertFalse(Post.all_objects.filter(id=self.post.id).exists())
+        self.assertFalse(Comment.objects.filter(post_id=self.post.id).exists())
+        self.assertTrue(Post.objects.filter(id=self.other.id).exists())
+
+    def test_deleted_account_is_deactivated_then_purged_with_counters_repaired(self):
+        comments.add_comment(self.other, self.alice, 'bye')
+        toggle_like(self.other.id, self.alice.id)
+        Friendship.objects.create(user=self.alice, friend=self.bob)
+        Friendship.objects.create(user=self.bob, friend=self.alice)
+
+        deletion.delete_users([self.alice.id])
+        self.assertFalse(self.client.login(username='alice', password='secret123'))
+        self.assertFalse(Post.objects.filter(user=self.alice).exists())
+
+        self.purge(batch_size=100)
+        self.assertFalse(User.objects.filter(id=self.alice.id).exists())
+        self.assertFalse(Friendship.objects.exists())
+        self.other.refresh_from_db()
+        self.assertEqual((self.other.like_count, self.other.comment_count), (0, 0))
+
+    def test_purge_drops_deleted_users_archived_messages(self):
+        conversation, _ = conversations.get_or_create_direct(self.alice, self.bob)
+        old = timezone.now() - timezone.timedelta(days=400)
+        for i in range(3):
+            conversation.messages.create(sender=self.alice, content=f'from alice {i}', created_at=old)
+            conversation.messages.create(sender=self.bob, content=f'from bob {i}', created_at=old)
+        solo, _ = conversations.get_or_create_direct(self.alice, User.objects.create_user(username='carol'))
+        solo.messages.create(sender=self.alice, content='only alice', created_at=old)
+        call_command('archive_messages', days=180, segment_size=4, stdout=StringIO())
+
+        deletion.delete_users([self.alice.id])
+        self.purge(batch_size=100)
+
+        remaining = archive.archived_before(conversation.id)
+        self.assertEqual([m.content for m in remaining], ['from bob 0', 'from bob 1', 'from bob 2'])
+        self.assertEqual(
+            sorted(conversation.archive_segments.values_list('message_count', flat=True)), [1, 2]
+        )
+        self.assertFalse(solo.archive_segments.exists())
+
+    def test_purge_keeps_images_that_shares_still_use(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        original = Post.objects.create(
+            user=self.alice, content='Holiday', image=SimpleUploadedFile('beach.jpg', b'not really a jpeg')
+        )
+        share = Post.objects.create(user=self.bob, content='Holiday', image=original.image, shared_from=original)
+        path = original.image.path
+
+        deletion.delete_posts([original.id])
+        self.purge(batch_size=100)
+        self.assertTrue(os.path.exists(path))
+
+        deletion.delete_posts([share.id])
+        self.purge(batch_size=100)
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(JOB_QUEUE_EAGER=False)
+    def test_deleted_rows_are_hidden_before_the_purge(self):
+        Friendship.objects.create(user=self.bob, friend=self.alice)
+        Post.objects.create(user=self.alice, content='secretword reply')
+        share = Post.objects.create(user=self.bob, content='Going away', shared_from=self.post)
+        comments.add_comment(self.other, self.alice, 'secretword comment')
+        conversation, _ = conversations.get_or_create_direct(self.alice, self.bob)
+        conversation.messages.create(sender=self.alice, content='secretword message')
+        self.assertEqual(len(search.search(self.bob, 'secretword')[0]), 3)
+
+        deletion.delete_posts([self.post.id])
+        self.client.force_login(self.bob)
+        self.assertNotContains(self.client.get(reverse('profile', args=['bob'])), 'Shared from')
+        self.assertTrue(Post.objects.filter(id=share.id).exists())
+
+        deletion.delete_users([self.alice.id])
+        self.assertEqual(search.search(self.bob, 'secretword')[0], [])
+        self.assertEqual(self.client.get(reverse('get_comments', args=[self.other.id])).json()['comments'], [])
+        response = self.client.get(reverse('get_messages_json', args=[conversation.id]))
+        self.assertEqual(response.json()['messages'], [])
+        self.assertIsNone(conversations.inbox(self.bob)[0].last_message)
+
+
+class ExportTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.post = Post.objects.create(
+            user=self.alice, content='Holiday', image=SimpleUploadedFile('beach.jpg', b'not really a jpeg')
+        )
+        comments.add_comment(self.post, self.alice, 'Nice')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.alice, self.bob)
+        old = timezone.now() - timezone.timedelta(days=400)
+        Message.objects.create(conversation=conversation, sender=self.bob, content='old', created_at=old)
+        call_command('archive_messages', days=180, stdout=StringIO())
+        Message.objects.create(conversation=conversation, sender=self.alice, content='new')
+
+    def read(self, archive_bytes):
+        archive = zipfile.ZipFile(BytesIO(archive_bytes))
+        rows = {
+            name: [json.loads(line) for line in archive.read(name).splitlines()]
+            for name in archive.namelist() if name.endswith('.ndjson')
+        }
+        return archive, rows
+
+    def test_export_endpoint_streams_a_zip_of_the_account(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('export_data'))
+        self.assertTrue(response.streaming)
+        self.assertIn('alice-export.zip', response['Content-Disposition'])
+
+        archive, rows = self.read(b''.join(response.streaming_content))
+        self.assertEqual([row['content'] for row in rows['posts.ndjson']], ['Holiday'])
+        self.assertEqual([row['content'] for row in rows['comments.ndjson']], ['Nice'])
+        # Hot messages first, then the archived ones
+        self.assertEqual([row['content'] for row in rows['messages.ndjson']], ['new', 'old'])
+        self.assertEqual(archive.read(f'media/{self.post.image.name}'), b'not really a jpeg')
+
+    @override_settings(ASYNC_VIEWS=True)
+    async def test_export_is_pulled_a_chunk_at_a_time_under_asgi(self):
+        produced = []
+        real_chunks = export.export_chunks
+
+        def counted_chunks(user):
+            for chunk in real_chunks(user):
+                produced.append(chunk)
+                yield chunk
+
+        await sync_to_async(self.async_client.force_login)(self.alice)
+        with mock.patch.object(export, 'export_chunks', counted_chunks), mock.patch.object(export, 'CHUNK_SIZE', 16):
+            response = await self.async_client.get(reverse('export_data'))
+            self.assertTrue(response.is_async)
+            received = []
+            async for chunk in response.streaming_content:
+                # Nothing is built ahead of what has been sent
+                self.assertEqual(len(produced), len(received) + 1)
+                received.append(chunk)
+        self.assertGreater(len(received), 5)
+        _, rows = self.read(b''.join(received))
+        self.assertEqual([row['content'] for row in rows['posts.ndjson']], ['Holiday'])
+
+    def test_export_command_writes_the_archive_in_chunks(self):
+        output = os.path.join(self.media.name, 'out.zip')
+        with mock.patch.object(export, 'CHUNK_SIZE', 16):
+            chunks = list(export.export_chunks(self.alice))
+        self.assertGreater(len(chunks), 5)
+
+        call_command('export_user', 'alice', output=output, stdout=StringIO())
+        with open(output, 'rb') as fh:
+            _, rows = self.read(fh.read())
+        self.assertEqual(rows['friends.ndjson'], [])
+        self.assertEqual({row['user__username'] for row in rows['conversations.ndjson']}, {'alice', 'bob'})
+
+
+class ImporterTests(TestCase):
+    databases = '__all__'
+
+    def write(self, directory, name, content):
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as fh:
+            fh.write(content)
+
+    def test_import_directory_bulk_loads_and_rebuilds_counters(self):
+        hashed = make_password('imported1')
+        with tempfile.TemporaryDirectory() as directory:
+            self.write(directory, 'users.csv', f'username,email,password_hash\nann,ann@example.com,{hashed}\nben,,\ncat,,\n')
+            self.write(directory, 'friendships.csv', 'user,friend\nann,ben\nben,ann\nann,nobody\n')
+            self.write(directory, 'posts.ndjson', '{"id": "p1", "user": "ann", "content": "Hello import"}\n')
+            self.write(directory, 'comments.ndjson', "\n".join([
+                '{"id": "c1", "post": "p1", "user": "ben", "content": "hi"}',
+                '{"id": "c2", "post": "p1", "user": "cat", "content": "re", "parent": "c1"}',
+                '{"id": "c3", "post": "p1", "user": "ann", "content": "re re", "parent": "c2"}',
+            ]))
+            self.write(directory, 'likes.csv', 'post,user\np1,ben\np1,cat\np1,ben\n')
+            self.write(directory, 'conversations.ndjson', '{"id": 7, "members": ["ann", "ben"]}\n')
+            self.write(directory, 'messages.csv', 'conversation,sender,content\n7,ben,yo\n7,ann,hey\n')
+
+            out = StringIO()
+            call_command('import_data', directory, batch_size=2, password='default1', stdout=out)
+            self.assertIn('rows/s', out.getvalue())
+            # Users and friendships have natural keys, so importing them again adds nothing
+            again = importer.Importer()
+            again.import_file('users', os.path.join(directory, 'users.csv'))
+            again.import_file('friendships', os.path.join(directory, 'friendships.csv'))
+
+        self.assertEqual(User.objects.count(), 3)
+        ann = User.objects.get(username='ann')
+        self.assertTrue(ann.check_password('imported1'))
+        self.assertTrue(User.objects.get(username='ben').check_password('default1'))
+        self.assertEqual(Friendship.objects.count(), 2)
+
+        post = Post.objects.get(user=ann)
+        self.assertEqual((post.like_count, post.comment_count), (2, 3))
+        top = Comment.objects.get(content='hi')
+        self.assertEqual(top.reply_count, 2)
+        self.assertEqual(set(Comment.objects.filter(parent=top).values_list('content', flat=True)), {'re', 're re'})
+
+        conversation_id, = conversations.conversation_ids(ann)
+        conversation = Conversation.objects.for_conversation(conversation_id).get()
+        self.assertEqual(
+            conversation.memberships.get(user=ann).last_read_message_id, conversation.messages.latest('id').id
+        )
+        self.assertEqual([p.content for p in search.search(ann, 'import')[0]], ['Hello import'])
+
+    def test_duplicate_users_are_counted_as_skipped(self):
+        User.objects.create_user(username='ann', password='secret123')
+        with tempfile.TemporaryDirectory() as directory:
+            self.write(directory, 'users.csv', 'username,email\nann,ann@example.com\nben,ben@example.com\nben,\ncat,\n')
+            stats = importer.Importer(batch_size=3).import_file('users', os.path.join(directory, 'users.csv'))
+
+        self.assertEqual((stats['rows'], stats['skipped']), (2, 2))
+        self.assertEqual(User.objects.get(username='ben').email, 'ben@example.com')
+        self.assertEqual(User.objects.count(), 3)
+
+
+class BenchmarkTests(TestCase):
+    databases = '__all__'
+
+    def test_generate_writes_the_counts_it_reports(self):
+        summary = synthetic.generate(users=12, seed=7)
+        self.assertEqual(summary['users'], 12)
+        self.assertEqual(summary, {
+            'users': User.objects.filter(username__startswith='bench').count(),
+            'friendships': Friendship.objects.count(),
+            'posts': Post.objects.count(),
+            'comments': Comment.objects.count(),
+            'likes': Like.objects.count(),
+            'conversations': sum(shard.count() for shard in sharding.each_shard(Conversation.objects.all())),
+            'messages': sum(shard.count() for shard in sharding.each_shard(Message.objects.all())),
+        })
+        members = sum(shard.count() for shard in sharding.each_shard(ConversationMember.objects.all()))
+        self.assertEqual(members, 2 * summary['conversations'])
+        # Friendships are symmetric and counters match the rows
+        pairs = set(Friendship.objects.values_list('user_id', 'friend_id'))
+        self.assertEqual(pairs, {(b, a) for a, b in pairs})
+        post = Post.objects.order_by('-like_count').first()
+        self.assertEqual(post.like_count, post.likes.count())
+
+    def test_benchmark_command_writes_and_compares_a_report(self):
+        output = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'baseline.json')
+        # Already inside the test database, so the command's own throwaway databases are skipped
+        with mock.patch.multiple(
+            benchmark, test_databases=nullcontext,
+            setup_test_environment=mock.DEFAULT, teardown_test_environment=mock.DEFAULT,
+        ):
+            call_command('benchmark', sizes='10', repeat=2, output=output, stdout=StringIO())
+
+        with open(output) as fh:
+            report = json.load(fh)
+        self.assertEqual(set(report['meta']), {'commit', 'created_at', 'python', 'django', 'database', 'repeat', 'seed'})
+        self.assertEqual(report['meta']['repeat'], 2)
+        results = report['results']['10']
+        self.assertEqual(results['data']['users'], 10)
+        self.assertTrue({'home_view', 'profile_view', 'messages_view', 'find_friends_view'} <= set(results))
+        for name, row in results.items():
+            if name != 'data':
+                self.assertEqual(set(row), {'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'queries', 'peak_kib'})
+
+        command = benchmark.Command(stdout=StringIO())
+        command.compare(report, output, max_slowdown=0.25)
+        results['home_view']['queries'] += 1
+        with self.assertRaisesMessage(CommandError, 'home_view'):
+            command.compare(report, output, max_slowdown=0.25)
+
+
+TEST_SHARDS = ['messages_0', 'messages_1']
+
+
+@override_settings(MESSAGE_SHARDS=TEST_SHARDS)
+class ShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        for alias in TEST_SHARDS:
+            sharding.reserve_message_ids(alias)
+        self.alice = User.objects.create_user(username='alice', password='secret123')
+        self.bob = User.objects.create_user(username='bob', password='secret123')
+        self.carol = User.objects.create_user(username='carol', password='secret123')
+
+    def test_checks_reject_unknown_and_unsupported_shards(self):
+        self.assertEqual(checks.check_message_shards(None), [])
+        with override_settings(MESSAGE_SHARDS=[*TEST_SHARDS, 'nowhere']):
+            self.assertEqual([error.id for error in checks.check_message_shards(None)], ['core.E001'])
+        with mock.patch.object(connections['messages_1'], 'vendor', 'mysql'):
+            self.assertEqual([error.id for error in checks.check_message_shards(None)], ['core.E002'])
+
+    def test_conversation_id_picks_the_shard(self):
+        with override_settings(MESSAGE_SHARDS=['a', 'b', 'c']):
+            self.assertEqual([sharding.shard_for(i) for i in range(4)], ['a', 'b', 'c', 'a'])
+            self.assertEqual(sharding.group_by_shard([1, 3, 4, 6]), {'b': [1, 4], 'a': [3, 6]})
+        first, _ = conversations.get_or_create_direct(self.alice, self.bob)
+        message = first.messages.create(sender=self.bob, content='hi')
+        self.assertEqual(message._state.db, sharding.shard_for(first.id))
+        self.assertEqual(Message.objects.for_conversation(first.id).get().sender, self.bob)
+
+    def test_inbox_search_and_deletes_span_shards(self):
+        first, _ = conversations.get_or_create_direct(self.alice, self.bob)
+        second, _ = conversations.get_or_create_direct(self.alice, self.carol)
+        self.assertNotEqual(first._state.db, second._state.db)
+        for conversation, sender in ((first, self.bob), (second, self.carol)):
+            message = conversation.messages.create(sender=sender, content=f'weekend from {sender.username}')
+            # Each shard numbers messages in its own range
+            self.assertEqual(message.id // sharding.ID_SPACING, TEST_SHARDS.index(conversation._state.db))
+
+        inbox = conversations.inbox(self.alice)
+        self.assertEqual([c.other_user for c in inbox], [self.carol, self.bob])
+        self.assertEqual([c.unread_count for c in inbox], [1, 1])
+        self.assertEqual(len(search.search(self.alice, 'weekend')[0]), 2)
+
+        self.client.force_login(self.carol)
+        message_id = second.messages.get().id
+        self.assertTrue(self.client.post(reverse('delete_message', args=[message_id])).json()['success'])
+        self.assertEqual([d.object_id for d in search.search(self.alice, 'weekend')[0]], [first.messages.get().id])
+
+    def test_reshard_moves_conversations_and_keeps_ids(self):
+        # Written while there was only one shard
+        with override_settings(MESSAGE_SHARDS=TEST_SHARDS[:1]):
+            made = [conversations.get_or_create_direct(self.alice, other)[0] for other in (self.bob, self.carol)]
+            archived = [c.messages.create(sender=self.alice, content='old news').id for c in made]
+            call_command('archive_messages', days=0, stdout=StringIO())
+            hot = [c.messages.create(sender=self.alice, content='fresh news').id for c in made]
+
+        moving = [i for i, c in enumerate(made) if sharding.shard_for(c.id) != TEST_SHARDS[0]]
+        self.assertTrue(moving)
+        out = StringIO()
+        call_command('reshard_messages', stdout=out)
+        self.assertIn(f'Moved {len(moving)} conversation(s) and {len(moving)} message(s)', out.getvalue())
+
+        for i in moving:
+            self.assertFalse(Conversation.objects.using(TEST_SHARDS[0]).filter(id=made[i].id).exists())
+            conversation = Conversation.objects.for_conversation(made[i].id).get(id=made[i].id)
+            self.assertEqual(conversation.memberships.count(), 2)
+            self.assertEqual([m.id for m in archive.archived_before(conversation.id)], [archived[i]])
+            self.assertEqual(conversation.messages.get().id, hot[i])
+            # New messages carry on in the new shard's own id range
+            message = conversation.messages.create(sender=self.alice, content='after the move')
+            self.assertEqual(message.id // sharding.ID_SPACING, TEST_SHARDS.index(conversation._state.db))
+        # Search documents point at the same ids and survive the move
+        self.assertEqual(sorted(d.object_id for d in search.search(self.alice, 'fresh')[0]), sorted(hot))
+
+    def test_reshard_appends_a_shard_to_populated_ones(self):
+        grown = TEST_SHARDS + ['messages_2']
+        friends = [User.objects.create_user(username=f'friend{i}', password='secret123') for i in range(7)]
+        made = [conversations.get_or_create_direct(self.alice, friend)[0] for friend in friends]
+        self.assertEqual({c._state.db for c in made}, set(TEST_SHARDS))
+        for conversation in made:
+            conversation.messages.create(sender=self.alice, content='before')
+        call_command('archive_messages', days=0, stdout=StringIO())
+        for conversation in made:
+            conversation.messages.create(sender=self.alice, content='after')
+
+        with override_settings(MESSAGE_SHARDS=grown):
+            sharding.reserve_message_ids('messages_2')
+            call_command('reshard_messages', stdout=StringIO())
+            self.assertEqual({sharding.shard_for(c.id) for c in made}, set(grown))
+            for conversation, friend in zip(made, friends):
+                shard = sharding.shard_for(conversation.id)
+                for alias in grown:
+                    self.assertEqual(Conversation.objects.using(alias).filter(id=conversation.id).exists(), alias == shard)
+                moved = Conversation.objects.using(shard).get(id=conversation.id)
+                self.assertEqual(set(conversations.members(moved.id)), {self.alice.id, friend.id})
+                self.assertEqual(len(archive.archived_before(moved.id)), 1)
+                self.assertEqual(moved.messages.get().content, 'after')
@@ -0,0 +1,144 @@
+"""
+Trending posts, ranked by time-decayed engagement.
+
+Likes, comments and shares are scored with forward decay. An event at time
+t adds weight * 2 ** ((t - landmark) / half_life) to the post's score in
+each window. A window is a half-life, not a cutoff: an event a few
+half-lives old still counts, just very little, which is why the tabs are
+labelled Rising and Hot rather than by time period. Old events are never
+revisited: every score decays at the same rate, so comparing the stored
+values ranks posts exactly as comparing their decayed values now would. Recording events is one UPDATE per post and
+window, and ranking is an ORDER BY over an index. Each window's landmark
+moves every EPOCH_HALF_LIVES half-lives so the stored values stay in float
+range.
+
+Events are queued with record() and applied in batches by the
+`score_engagement` job. An unlike takes back one fresh like's worth, so
+like/unlike cycles cannot pump a score.
+
+The `refresh_trending` job runs every REFRESH_SECONDS and re-queues
+itself. It carries rows over to the current landmark and drops posts
+whose score has decayed to nothing. It then caches the top TOP_K post ids
+per window, so the Popular tab reads K ids from the cache and fetches K
+posts by primary key.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Greatest, Power
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import jobs
+from .models import Job, Post, TrendingScore
+
+DEFAULTS = {
+    # Window name -> half-life in seconds
+    'WINDOWS': {'hour': 15 * 60, 'day': 6 * 60 * 60},
+    'WEIGHTS': {'like': 1.0, 'comment': 2.0, 'share': 3.0},
+    'TOP_K': 50,
+    'REFRESH_SECONDS': 60,
+    'CACHE_TIMEOUT': 300,
+    # Posts whose decayed score falls below this many fresh likes stop trending
+    'MIN_SCORE': 0.05,
+}
+
+EPOCH_HALF_LIVES = 64
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TRENDING', {})}
+
+
+def _epoch(timestamp, half_life):
+    return int(timestamp // (half_life * EPOCH_HALF_LIVES))
+
+
+def _decayed(weight, timestamp, epoch, half_life):
+    landmark = epoch * half_life * EPOCH_HALF_LIVES
+    return weight * 2 ** ((timestamp - landmark) / half_life)
+
+
+def _on_epoch(epoch):
+    # The stored score, expressed against landmark `epoch`
+    return Case(
+        When(epoch=epoch, then=F('score')),
+        default=F('score') * Power(2, (F('epoch') - epoch) * EPOCH_HALF_LIVES),
+        output_field=FloatField(),
+    )
+
+
+def _cache_key(window):
+    return f'trending:{window}'
+
+
+def record(post_id, kind, sign=1):
+    """Queue an engagement event ('like', 'comment' or 'share') on `post_id` for scoring."""
+    jobs.enqueue('score_engagement', post_id=post_id, kind=kind, sign=sign, at=timezone.now().isoformat())
+
+
+def apply_events(events):
+    config = get_config()
+    now = timezone.now().timestamp()
+    post_ids = set(Post.objects.filter(id__in={e['post_id'] for e in events}).values_list('id', flat=True))
+
+    with transaction.atomic():
+        for window, half_life in config['WINDOWS'].items():
+            epoch = _epoch(now, half_life)
+            deltas = {}
+            for event in events:
+                if event['post_id'] not in post_ids:
+                    continue  # Post is gone
+                weight = config['WEIGHTS'][event['kind']] * event.get('sign', 1)
+                at = parse_datetime(event['at']).timestamp()
+                deltas[event['post_id']] = deltas.get(event['post_id'], 0) + _decayed(weight, at, epoch, half_life)
+
+            TrendingScore.objects.bulk_create(
+                [TrendingScore(window=window, post_id=post_id, epoch=epoch) for post_id in deltas],
+                ignore_conflicts=True,
+            )
+            for post_id, delta in deltas.items():
+                TrendingScore.objects.filter(window=window, post_id=post_id).update(
+                    score=Greatest(_on_epoch(epoch) + delta, Value(0.0)), epoch=epoch
+                )
+
+
+def _rank(window, epoch, limit):
+    # Rows still on an older landmark rejoin the ranking at the next refresh()
+    return list(
+        TrendingScore.objects.filter(window=window, epoch=epoch, score__gt=0)
+        .order_by('-score')
+        .values_list('post_id', flat=True)[:limit]
+    )
+
+
+def refresh():
+    """Move scores to the current landmarks, prune dead posts and re-cache each window's top K."""
+    config = get_config()
+    now = timezone.now().timestamp()
+    for window, half_life in config['WINDOWS'].items():
+        epoch = _epoch(now, half_life)
+        scores = TrendingScore.objects.filter(window=window)
+        scores.filter(epoch__lt=epoch).update(score=_on_epoch(epoch), epoch=epoch)
+        scores.filter(score__lt=_decayed(config['MIN_SCORE'], now, epoch, half_life)).delete()
+        cache.set(_cache_key(window), _rank(window, epoch, config['TOP_K']), config['CACHE_TIMEOUT'])
+
+
+def schedule_refresh(delay=None):
+    """Queue the next refresh_trending run unless one is already waiting."""
+    if not Job.objects.filter(task='refresh_trending', status=Job.STATUS_PENDING).exists():
+        jobs.enqueue('refresh_trending', delay=delay)
+
+
+def top_post_ids(window):
+    """Ids of the TOP_K trending posts in `window`, best first."""
+    ids = cache.get(_cache_key(window))
+    if ids is None:
+        # No refresh has run lately; rank from the table, which is still a K-row index read
+        config = get_config()
+        epoch = _epoch(timezone.now().timestamp(), config['WINDOWS'][window])
+        ids = _rank(window, epoch, config['TOP_K'])
+        cache.set(_cache_key(window), ids, config['CACHE_TIMEOUT'])
+    return ids
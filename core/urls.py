@@ -1,29 +1,47 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Under ASGI the polling endpoints are served by their async versions
+polling = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path('post/<int:post_id>/share/', views.share_post, name='share_post'),
     path('', views.home_view, name='home'),
+    path('post/create/', views.create_post, name='create_post'),
     path('signup/', views.signup_view, name='signup'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('profile/', views.profile_view, name='profile'),
     path('profile/<str:username>/', views.profile_view, name='profile'),
+    path('account/export/', views.export_data, name='export_data'),
     path('messages/', views.messages_view, name='messages'),
     path('conversation/<int:conversation_id>/', views.conversation_view, name='conversation'),
-    path('conversation/<int:conversation_id>/messages/', views.get_messages_json, name='get_messages_json'),
+    path('conversation/<int:conversation_id>/messages/', polling.get_messages_json, name='get_messages_json'),
+    path('conversation/<int:conversation_id>/history/', views.get_message_history, name='get_message_history'),
     path('message/<int:message_id>/delete/', views.delete_message, name='delete_message'),
-    path('user/<int:user_id>/status/', views.get_user_status, name='get_user_status'),
-    path('post/<int:post_id>/like/', views.like_post, name='like_post'),
+    path('user/<int:user_id>/status/', polling.get_user_status, name='get_user_status'),
+    path('post/<int:post_id>/like/', polling.like_post, name='like_post'),
     path('post/<int:post_id>/comment/', views.add_comment, name='add_comment'),
-    path('post/<int:post_id>/comments/', views.get_comments, name='get_comments'),
+    path('post/<int:post_id>/comments/', polling.get_comments, name='get_comments'),
+    path('comment/<int:comment_id>/replies/', views.get_comment_replies, name='get_comment_replies'),
     path('post/<int:post_id>/delete/', views.delete_post, name='delete_post'),
     path('friend-request/send/<str:username>/', views.send_friend_request, name='send_friend_request'),
     path('friend-request/cancel/<str:username>/', views.cancel_friend_request, name='cancel_friend_request'),
     path('friend-request/accept/<int:request_id>/', views.accept_friend_request, name='accept_friend_request'),
+    path('friend-request/accept-all/', views.accept_all_friend_requests, name='accept_all_friend_requests'),
     path('friend-request/reject/<int:request_id>/', views.reject_friend_request, name='reject_friend_request'),
     path('unfriend/<str:username>/', views.unfriend, name='unfriend'),
     path('conversation/start/<str:username>/', views.start_conversation, name='start_conversation'),
+    path('conversation/group/create/', views.create_group_conversation, name='create_group_conversation'),
+    path('conversation/<int:conversation_id>/members/', views.get_conversation_members, name='conversation_members'),
+    path('conversation/<int:conversation_id>/members/add/', views.add_conversation_members, name='add_conversation_members'),
+    path('conversation/<int:conversation_id>/members/<int:user_id>/remove/', views.remove_conversation_member, name='remove_conversation_member'),
+    path('notifications/', views.get_notifications, name='notifications'),
+    path('notifications/unread-count/', views.get_unread_notification_count, name='unread_notification_count'),
+    path('notifications/mark-read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('search/', views.search_view, name='search'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('find-friends/', views.find_friends_view, name='find_friends'),
     path('friends/', views.all_friends_view, name='all_friends'),
     path('friends/<str:username>/', views.all_friends_view, name='all_friends'),
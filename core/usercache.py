@@ -0,0 +1,71 @@
+"""
+Cache of authenticated User objects.
+
+core.middleware.CachedAuthenticationMiddleware loads request.user from here
+instead of querying the user table on every request. Entries are keyed by
+a per-user version token: invalidating a user just replaces the token, so
+every process sharing the cache stops using the old entry at once and any
+in-flight request that re-caches stale data does so under a dead key.
+
+User.save() invalidates through a signal (see core.signals); code that
+changes users with queryset.update() calls invalidate_users() itself. The
+one exception is the background last_active touch, which may lag on the
+cached copy by up to TIMEOUT. Only enable this with a cache shared by all
+web and job-worker processes.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+DEFAULTS = {
+    'ENABLED': False,
+    'TIMEOUT': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'AUTH_USER_CACHE', {})}
+
+
+def _version_key(user_id):
+    return f'auth-user:{user_id}:version'
+
+
+def _current_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def get_user(user_id, backend):
+    """The user with `user_id` as loaded by `backend`, from the cache when possible."""
+    key = f'auth-user:{user_id}:{_current_version(user_id)}'
+    user = cache.get(key)
+    if user is None:
+        user = backend.get_user(user_id)
+        if user is not None:
+            cache.set(key, user, get_config()['TIMEOUT'])
+    return user
+
+
+def invalidate_users(user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+
+    def bump():
+        cache.set_many({_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, None)
+
+    bump()
+    # Again after commit, in case a concurrent request cached the pre-commit row
+    transaction.on_commit(bump)
+
+
+def invalidate_user(user_id):
+    invalidate_users([user_id])
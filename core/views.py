@@ -1,13 +1,23 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 from django.utils import timezone
-from .models import User, Post, Comment, Like, Friendship, FriendRequest, Conversation, Message
+from .models import DEFAULT_AVATAR_URL, User, Post, Comment, Like, Friendship, FriendRequest, Conversation, Message, Notification, SearchDocument
+from . import archive, comments, conversations, deletion, export, friendships, jobs, likes, notifications, search, sharding, trending
+from .metrics import registry
+from .ratelimit import coalesce, ratelimit
+from .middleware import get_config as get_instrumentation_config
+
+HISTORY_PAGE_SIZE = 50
+CONVERSATION_WINDOW = 50
 
 @login_required
+@ratelimit('write')
 def share_post(request, post_id):
     if request.method == 'POST':
         original_post = get_object_or_404(Post, id=post_id)
@@ -18,7 +28,12 @@ def share_post(request, post_id):
             image=original_post.image if original_post.image else None,
             shared_from=original_post
         )
-        return JsonResponse({'success': True, 'message': 'Post shared successfully!'})
+        return JsonResponse({
+            'success': True,
+            'message': 'Post shared successfully!',
+            'post': {'id': new_post.id},
+            'html': _render_post_card(request, new_post),
+        })
     return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
 
 
@@ -108,15 +123,29 @@ def home_view(request):
             messages.success(request, 'Post created successfully!')
             return redirect('home')
     
-    # Get posts from user and friends
     friend_ids = Friendship.objects.filter(user=request.user).values_list('friend_id', flat=True)
-    posts = Post.objects.filter(Q(user=request.user) | Q(user_id__in=friend_ids))
+    tab = 'popular' if request.GET.get('tab') == 'popular' else 'latest'
+    window = request.GET.get('window', 'day')
+    if window not in trending.get_config()['WINDOWS']:
+        window = 'day'
+
+    if tab == 'popular':
+        # Trending ids come ranked from the cache; fetch just those posts by primary key
+        ids = trending.top_post_ids(window)
+        by_id = Post.objects.select_related('user', 'shared_from__user').in_bulk(ids)
+        posts = [by_id[post_id] for post_id in ids if post_id in by_id]
+    else:
+        # Get posts from user and friends
+        posts = (
+            Post.objects.filter(Q(user=request.user) | Q(user_id__in=friend_ids))
+            .select_related('user', 'shared_from__user')
+        )
     
     # Get IDs of users who sent requests to current user
     incoming_request_ids = FriendRequest.objects.filter(to_user=request.user).values_list('from_user_id', flat=True)
     
     # Get suggested users (exclude friends and users who sent requests)
-    suggested_users_query = User.objects.exclude(id=request.user.id).exclude(id__in=friend_ids).exclude(id__in=incoming_request_ids)[:5]
+    suggested_users_query = User.objects.filter(deleted_at__isnull=True).exclude(id=request.user.id).exclude(id__in=friend_ids).exclude(id__in=incoming_request_ids)[:5]
     
     # Get pending request IDs (requests sent by current user)
     pending_request_ids = FriendRequest.objects.filter(from_user=request.user).values_list('to_user_id', flat=True)
@@ -132,15 +161,40 @@ def home_view(request):
     context = {
         'posts': posts,
         'user': request.user,
-        'suggested_users': suggested_users
+        'suggested_users': suggested_users,
+        'tab': tab,
+        'window': window,
     }
     return render(request, 'index.html', context)
 
 
+def _render_post_card(request, post):
+    return render_to_string('partials/post_card.html', {'post': post}, request=request)
+
+
+@login_required
+@ratelimit('write')
+def create_post(request):
+    # JSON counterpart of the home page form: returns the new feed card instead of redirecting
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
+
+    content = (request.POST.get('content') or '').strip()
+    if not content:
+        return JsonResponse({'success': False, 'message': 'Post content is required'}, status=400)
+
+    post = Post.objects.create(user=request.user, content=content, image=request.FILES.get('image'))
+    return JsonResponse({
+        'success': True,
+        'post': {'id': post.id},
+        'html': _render_post_card(request, post),
+    }, status=201)
+
+
 @login_required
 def profile_view(request, username=None):
     if username:
-        profile_user = get_object_or_404(User, username=username)
+        profile_user = get_object_or_404(User, username=username, deleted_at__isnull=True)
     else:
         profile_user = request.user
     
@@ -162,7 +216,12 @@ def profile_view(request, username=None):
         messages.success(request, 'Profile updated successfully!')
         return redirect('profile', username=profile_user.username)
     
-    posts = Post.objects.filter(user=profile_user)
+    # Whether the viewer liked each post comes with the posts, not one query per post
+    posts = (
+        Post.objects.filter(user=profile_user)
+        .select_related('user', 'shared_from__user')
+        .annotate(is_liked=Exists(Like.objects.filter(post=OuterRef('pk'), user=request.user)))
+    )
     
     # Get user's friends
     friend_ids = Friendship.objects.filter(user=profile_user).values_list('friend_id', flat=True)
@@ -191,16 +250,17 @@ def profile_view(request, username=None):
 
 @login_required
 def messages_view(request):
-    # Get all conversations for current user
-    conversations = request.user.conversations.all().order_by('-updated_at')
+    # Conversations with their last message, unread badge and other side, gathered shard by shard
+    conversation_list = conversations.inbox(request.user)
     
     # Get user's friends
     friend_ids = Friendship.objects.filter(user=request.user).values_list('friend_id', flat=True)
     friends = User.objects.filter(id__in=friend_ids)
     
     context = {
-        'conversations': conversations,
+        'conversations': conversation_list,
         'friends': friends,
+        'default_avatar_url': DEFAULT_AVATAR_URL,
         'user': request.user
     }
     return render(request, 'messages.html', context)
@@ -208,15 +268,15 @@ def messages_view(request):
 
 @login_required
 def conversation_view(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
+    membership = _get_membership_or_404(conversation_id, request.user)
+    conversation = membership.conversation
     
     if request.method == 'POST':
         content = request.POST.get('content', '')
         attachment = request.FILES.get('attachment')
         
         if content or attachment:
-            message = Message.objects.create(
-                conversation=conversation, 
+            message = conversation.messages.create(
                 sender=request.user, 
                 content=content
             )
@@ -224,9 +284,11 @@ def conversation_view(request, conversation_id):
                 message.attachment = attachment
                 message.save()
             
-            # Update sender's last_active
-            request.user.last_active = timezone.now()
-            request.user.save(update_fields=['last_active'])
+            # Sending implies the sender has read everything up to their own message
+            conversations.mark_read(membership, message.id)
+            
+            # Update sender's last_active in the background
+            jobs.enqueue('touch_last_active', user_id=request.user.id, at=timezone.now().isoformat())
             
             conversation.updated_at = timezone.now()
             conversation.save()
@@ -238,46 +300,204 @@ def conversation_view(request, conversation_id):
             
             return redirect('conversation', conversation_id=conversation_id)
     
-    messages_list = conversation.messages.all().order_by('created_at')
-    # Mark messages as read
-    messages_list.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
+    # Only the latest window is rendered; older pages come from get_message_history
+    recent = conversations.with_senders(conversation.messages.order_by('-id'))[:CONVERSATION_WINDOW]
+    messages_list = conversations.visible(recent)[::-1]
     
-    # Get the other user in the conversation
-    other_user = conversation.participants.exclude(id=request.user.id).first()
+    # Move the read watermark; a no-op when nothing new has arrived
+    if messages_list:
+        conversations.mark_read(membership, messages_list[-1].id)
     
     context = {
         'conversation': conversation,
         'messages': messages_list,
+        'has_older_messages': len(messages_list) == CONVERSATION_WINDOW or conversation.archive_segments.exists(),
         'user': request.user,
-        'other_user': other_user
     }
+    
+    if conversation.is_group:
+        # Member list comes from the cached membership set
+        member_ids = conversations.members(conversation.id)
+        friend_ids = Friendship.objects.filter(user=request.user).values_list('friend_id', flat=True)
+        context.update({
+            'members': conversations.presence(conversation.id),
+            'is_admin': membership.is_admin,
+            'addable_friends': User.objects.filter(id__in=friend_ids).exclude(id__in=list(member_ids)).order_by('username'),
+        })
+    else:
+        # Get the other user in the conversation
+        member_ids = [user_id for user_id in conversations.members(conversation.id) if user_id != request.user.id]
+        context['other_user'] = User.objects.filter(id__in=member_ids).first()
     return render(request, 'conversation.html', context)
 
 
+def _get_membership_or_404(conversation_id, user):
+    membership = conversations.get_membership(conversation_id, user)
+    if membership is None:
+        raise Http404('Conversation not found')
+    return membership
+
+
+@login_required
+def create_group_conversation(request):
+    if request.method != 'POST':
+        return redirect('messages')
+    
+    # Groups can only be started with friends
+    friend_ids = Friendship.objects.filter(user=request.user).values_list('friend_id', flat=True)
+    invited = list(User.objects.filter(username__in=request.POST.getlist('members'), id__in=friend_ids))
+    if not invited:
+        return redirect('messages')
+    
+    title = request.POST.get('title', '').strip()[:100] or ', '.join(sorted(u.username for u in invited))[:100]
+    conversation = conversations.create_group(request.user, title, invited)
+    return redirect('conversation', conversation_id=conversation.id)
+
+
+@login_required
+def add_conversation_members(request, conversation_id):
+    membership = _get_membership_or_404(conversation_id, request.user)
+    conversation = membership.conversation
+    if request.method != 'POST' or not conversation.is_group:
+        return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
+    
+    friend_ids = Friendship.objects.filter(user=request.user).values_list('friend_id', flat=True)
+    invited = User.objects.filter(username__in=request.POST.getlist('members'), id__in=friend_ids)
+    added = conversations.add_members(conversation, invited)
+    
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': True, 'added': added})
+    return redirect('conversation', conversation_id=conversation.id)
+
+
+@login_required
+def remove_conversation_member(request, conversation_id, user_id):
+    membership = _get_membership_or_404(conversation_id, request.user)
+    conversation = membership.conversation
+    if request.method != 'POST' or not conversation.is_group:
+        return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
+    
+    # Anyone can leave; only admins can remove someone else
+    if user_id != request.user.id and not membership.is_admin:
+        return JsonResponse({'success': False, 'message': 'Only group admins can remove members'}, status=403)
+    if not conversations.is_member(conversation.id, user_id):
+        raise Http404('Member not found')
+    conversations.remove_member(conversation, user_id)
+    
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': True})
+    if user_id == request.user.id:
+        return redirect('messages')
+    return redirect('conversation', conversation_id=conversation.id)
+
+
 @login_required
+@ratelimit('poll')
+@coalesce
+def get_conversation_members(request, conversation_id):
+    if not conversations.is_member(conversation_id, request.user.id):
+        raise Http404('Conversation not found')
+    members = conversations.presence(conversation_id)
+    return JsonResponse({
+        'members': members,
+        'online_count': sum(1 for member in members if member['is_online'])
+    })
+
+
+@login_required
+@ratelimit('poll')
+@coalesce
 def get_messages_json(request, conversation_id):
     from django.http import JsonResponse
-    conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
-    messages_list = conversation.messages.all().order_by('created_at')
+    membership = _get_membership_or_404(conversation_id, request.user)
+    conversation = membership.conversation
+    after_id = _after_id(request)
+    fetched = list(_polled_messages(conversation, after_id))[::-1]
+    messages_list = conversations.visible(fetched)
     
-    # Mark messages as read
-    messages_list.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
+    # Polling only writes when new messages have arrived since the last poll
+    if fetched:
+        conversations.mark_read(membership, fetched[-1].id)
     
+    # Own messages at or below another participant's watermark have been seen
+    watermarks = conversations.other_watermarks(conversation.id, request.user)
+    return JsonResponse(_messages_payload(conversation, messages_list, watermarks, request.user, _is_reset(after_id, fetched)))
+
+
+def _after_id(request):
+    after_id = request.GET.get('after_id', '')
+    return int(after_id) if after_id.isdigit() else None
+
+
+def _polled_messages(conversation, after_id):
+    """Newest first: the latest window, or at most a window of the messages after `after_id`."""
+    messages = conversations.with_senders(conversation.messages.order_by('-id'))
+    if after_id is not None:
+        messages = messages.filter(id__gt=after_id)
+    return messages[:CONVERSATION_WINDOW]
+
+
+def _is_reset(after_id, fetched):
+    # A full window after `after_id` may have skipped messages, so the client starts over from it
+    return after_id is None or len(fetched) == CONVERSATION_WINDOW
+
+
+def _messages_payload(conversation, messages_list, watermarks, user, reset=True):
     messages_data = []
     for msg in messages_list:
-        messages_data.append({
-            'id': msg.id,
-            'content': msg.content,
-            'sender_username': msg.sender.username,
-            'sender_avatar': msg.sender.get_profile_photo_url(),
-            'is_own': msg.sender == request.user,
-            'created_at': msg.created_at.strftime('%I:%M %p'),
-            'has_attachment': bool(msg.attachment),
-            'attachment_url': msg.get_attachment_url(),
-            'is_image': msg.is_image()
-        })
+        data = _message_json(msg, msg.sender, user)
+        data['seen_by'] = conversations.seen_by(watermarks, msg.id) if data['is_own'] else 0
+        data['seen'] = data['seen_by'] > 0
+        messages_data.append(data)
+    # `watermarks` lets the client update read receipts on messages it already shows
+    return {'messages': messages_data, 'is_group': conversation.is_group, 'reset': reset, 'watermarks': watermarks}
+
+
+def _message_json(msg, sender, user):
+    return {
+        'id': msg.id,
+        'content': msg.content,
+        'sender_username': sender.username,
+        'sender_avatar': sender.get_profile_photo_url(),
+        'is_own': sender.id == user.id,
+        'created_at': msg.created_at.strftime('%I:%M %p'),
+        'has_attachment': bool(msg.attachment),
+        'attachment_url': msg.get_attachment_url(),
+        'is_image': msg.is_image(),
+        'archived': getattr(msg, 'archived', False)
+    }
+
+
+@login_required
+def get_message_history(request, conversation_id):
+    if not conversations.is_member(conversation_id, request.user.id):
+        raise Http404('Conversation not found')
+    conversation = get_object_or_404(Conversation.objects.for_conversation(conversation_id), id=conversation_id)
+    before_id = request.GET.get('before_id', '')
+    before_id = int(before_id) if before_id.isdigit() else None
+    
+    # Recent history comes from the hot table, anything older from archive segments
+    hot = conversations.with_senders(conversation.messages.all())
+    if before_id is not None:
+        hot = hot.filter(id__lt=before_id)
+    page = list(hot.order_by('-id')[:HISTORY_PAGE_SIZE])[::-1]
+    if len(page) < HISTORY_PAGE_SIZE:
+        oldest_id = page[0].id if page else before_id
+        page = archive.archived_before(conversation.id, oldest_id, HISTORY_PAGE_SIZE - len(page)) + page
+    
+    archived_sender_ids = {msg.sender_id for msg in page if getattr(msg, 'archived', False)}
+    senders = User.objects.in_bulk(archived_sender_ids) if archived_sender_ids else {}
+    
+    messages_data = []
+    for msg in page:
+        sender = senders.get(msg.sender_id) if getattr(msg, 'archived', False) else msg.sender
+        if sender is not None and sender.deleted_at is None:
+            messages_data.append(_message_json(msg, sender, request.user))
     
-    return JsonResponse({'messages': messages_data})
+    return JsonResponse({
+        'messages': messages_data,
+        'has_more': len(page) == HISTORY_PAGE_SIZE
+    })
 
 
 @login_required
@@ -287,36 +507,44 @@ def delete_message(request, message_id):
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid method'}, status=400)
     
-    message = get_object_or_404(Message, id=message_id, sender=request.user)
+    # Message ids are unique across shards, so at most one of them has it
+    for messages_on_shard in sharding.each_shard(Message.objects.filter(id=message_id, sender=request.user)):
+        message = messages_on_shard.first()
+        if message:
+            break
+    else:
+        raise Http404('No Message matches the given query.')
+    # Its search document is in the default database, out of reach of the delete's cascade
+    search.unindex(message)
     message.delete()
     
     return JsonResponse({'success': True})
 
 
 @login_required
+@ratelimit('poll')
+@coalesce
 def get_user_status(request, user_id):
     from django.http import JsonResponse
     user = get_object_or_404(User, id=user_id)
-    return JsonResponse({
+    return JsonResponse(_status_payload(user))
+
+
+def _status_payload(user):
+    return {
         'is_online': user.is_online(),
         'status': user.get_last_active_display()
-    })
+    }
 
 
 @login_required
+@ratelimit('write')
 def like_post(request, post_id):
     from django.http import JsonResponse
     
-    post = get_object_or_404(Post, id=post_id)
-    like, created = Like.objects.get_or_create(post=post, user=request.user)
-    
-    if not created:
-        like.delete()
-        liked = False
-    else:
-        liked = True
-    
-    like_count = post.likes.count()
+    if not Post.objects.filter(id=post_id).exists():
+        raise Http404('No Post matches the given query.')
+    liked, like_count = likes.toggle_like(post_id, request.user.id)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.content_type == 'application/json':
         return JsonResponse({
@@ -329,57 +557,76 @@ def like_post(request, post_id):
 
 
 @login_required
+@ratelimit('write')
 def add_comment(request, post_id):
     from django.http import JsonResponse
     
     if request.method == 'POST':
         post = get_object_or_404(Post, id=post_id)
         content = request.POST.get('content')
+        parent_id = request.POST.get('parent_id', '')
+        parent = get_object_or_404(Comment, id=parent_id, post=post) if parent_id.isdigit() else None
         
         if content:
-            comment = Comment.objects.create(post=post, user=request.user, content=content)
+            comment, comment_count = comments.add_comment(post, request.user, content, parent)
             
             # If AJAX request, return JSON
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or 'X-CSRFToken' in request.headers:
                 return JsonResponse({
                     'success': True,
-                    'comment': {
-                        'id': comment.id,
-                        'content': comment.content,
-                        'user': comment.user.username,
-                        'avatar': comment.user.get_profile_photo_url(),
-                        'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S')
-                    },
-                    'comment_count': post.comments.count()
+                    'comment': _comment_json(comment),
+                    'comment_count': comment_count,
+                    'html': render_to_string('partials/comment.html', {'comment': comment}, request=request),
                 })
     
     return redirect('home')
 
 
+def _page_cursor(request):
+    after = request.GET.get('after', '')
+    return int(after) if after.isdigit() else None
+
+
 @login_required
 def get_comments(request, post_id):
-    from django.http import JsonResponse
-    
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all().order_by('created_at')
-    
-    comments_data = []
-    for comment in comments:
-        comments_data.append({
-            'id': comment.id,
-            'content': comment.content,
-            'user': comment.user.username,
-            'avatar': comment.user.get_profile_photo_url(),
-            'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        })
-    
-    return JsonResponse({
-        'comments': comments_data,
-        'count': comments.count()
-    })
+    post = get_object_or_404(Post.objects.only('id', 'comment_count'), id=post_id)
+    rows = list(comments.top_level(post.id, _page_cursor(request)))
+    page, next_cursor = comments.split_page(rows, comments.COMMENT_PAGE_SIZE)
+    return JsonResponse(_comments_payload(request, page, post.comment_count, next_cursor))
+
+
+@login_required
+def get_comment_replies(request, comment_id):
+    parent = get_object_or_404(Comment.objects.only('id', 'reply_count'), id=comment_id)
+    rows = list(comments.replies(parent.id, _page_cursor(request)))
+    page, next_cursor = comments.split_page(rows, comments.REPLY_PAGE_SIZE)
+    return JsonResponse(_comments_payload(request, page, parent.reply_count, next_cursor))
+
+
+def _comment_json(comment):
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'user': comment.user.username,
+        'avatar': comment.user.get_profile_photo_url(),
+        'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'parent_id': comment.parent_id,
+        'reply_count': comment.reply_count,
+    }
+
+
+def _comments_payload(request, page, count, next_cursor):
+    # `count` is the denormalized total, not the size of this page
+    return {
+        'comments': [_comment_json(comment) for comment in page],
+        'count': count,
+        'next_cursor': next_cursor,
+        'html': render_to_string('partials/comment_list.html', {'comments': page}, request=request),
+    }
 
 
 @login_required
+@ratelimit('write')
 def send_friend_request(request, username):
     to_user = get_object_or_404(User, username=username)
     
@@ -409,12 +656,8 @@ def cancel_friend_request(request, username):
 def accept_friend_request(request, request_id):
     friend_request = get_object_or_404(FriendRequest, id=request_id, to_user=request.user)
     
-    # Create friendship both ways
-    Friendship.objects.create(user=request.user, friend=friend_request.from_user)
-    Friendship.objects.create(user=friend_request.from_user, friend=request.user)
-    
-    # Delete the request
-    friend_request.delete()
+    # Create friendship both ways and delete the request in one transaction
+    friendships.accept_request(friend_request)
     
     messages.success(request, f'You are now friends with {friend_request.from_user.username}')
     
@@ -425,6 +668,19 @@ def accept_friend_request(request, request_id):
     return redirect('home')
 
 
+@login_required
+def accept_all_friend_requests(request):
+    if request.method == 'POST':
+        accepted = friendships.accept_all_requests(request.user)
+        if accepted:
+            messages.success(request, f'You accepted {accepted} friend request{"s" if accepted != 1 else ""}')
+    
+    referer = request.META.get('HTTP_REFERER')
+    if referer:
+        return redirect(referer)
+    return redirect('home')
+
+
 @login_required
 def reject_friend_request(request, request_id):
     friend_request = get_object_or_404(FriendRequest, id=request_id, to_user=request.user)
@@ -446,8 +702,7 @@ def unfriend(request, username):
     friend_user = get_object_or_404(User, username=username)
     
     # Delete friendship both ways
-    Friendship.objects.filter(user=request.user, friend=friend_user).delete()
-    Friendship.objects.filter(user=friend_user, friend=request.user).delete()
+    friendships.unfriend(request.user, friend_user)
     
     messages.success(request, f'You are no longer friends with {friend_user.username}')
     
@@ -461,13 +716,11 @@ def unfriend(request, username):
 @login_required
 def start_conversation(request, username):
     other_user = get_object_or_404(User, username=username)
+    if other_user == request.user:
+        return redirect('messages')
     
-    # Check if conversation already exists
-    conversation = Conversation.objects.filter(participants=request.user).filter(participants=other_user).first()
-    
-    if not conversation:
-        conversation = Conversation.objects.create()
-        conversation.participants.add(request.user, other_user)
+    # Single probe on the unique pair key; safe against double clicks
+    conversation, _ = conversations.get_or_create_direct(request.user, other_user)
     
     return redirect('conversation', conversation_id=conversation.id)
 
@@ -481,7 +734,7 @@ def find_friends_view(request):
     incoming_request_ids = FriendRequest.objects.filter(to_user=request.user).values_list('from_user_id', flat=True)
     
     # Get all users except current user, friends, and users who sent requests
-    all_users = User.objects.exclude(id=request.user.id).exclude(id__in=friend_ids).exclude(id__in=incoming_request_ids)
+    all_users = User.objects.filter(deleted_at__isnull=True).exclude(id=request.user.id).exclude(id__in=friend_ids).exclude(id__in=incoming_request_ids)
     
     # Get list of users who have pending requests (sent by current user)
     pending_request_ids = FriendRequest.objects.filter(from_user=request.user).values_list('to_user_id', flat=True)
@@ -505,7 +758,7 @@ def find_friends_view(request):
 @login_required
 def all_friends_view(request, username=None):
     if username:
-        profile_user = get_object_or_404(User, username=username)
+        profile_user = get_object_or_404(User, username=username, deleted_at__isnull=True)
     else:
         profile_user = request.user
     
@@ -530,9 +783,98 @@ def delete_post(request, post_id):
         
         # Check if user owns the post
         if post.user == request.user:
-            post.delete()
+            # Hidden now; likes, comments and the image are purged in the background
+            deletion.delete_posts([post.id])
             return JsonResponse({'success': True, 'message': 'Post deleted successfully'})
         else:
             return JsonResponse({'success': False, 'message': 'You do not have permission to delete this post'}, status=403)
     
     return JsonResponse({'success': False, 'message': 'Invalid request'}, status=400)
+
+
+@login_required
+@ratelimit('write')
+def export_data(request):
+    # The zip is built while it is sent, so memory stays flat however big the account is
+    chunks = export.aexport_chunks(request.user) if settings.ASYNC_VIEWS else export.export_chunks(request.user)
+    response = StreamingHttpResponse(chunks, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{request.user.username}-export.zip"'
+    return response
+
+
+@login_required
+def get_notifications(request):
+    items = Notification.objects.filter(recipient=request.user).select_related('latest_actor', 'post')[:20]
+    
+    notifications_data = []
+    for item in items:
+        notifications_data.append({
+            'id': item.id,
+            'verb': item.verb,
+            'message': item.get_message(),
+            'actor_avatar': item.latest_actor.get_profile_photo_url(),
+            'post_id': item.post_id,
+            'is_read': item.is_read,
+            'updated_at': item.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+        })
+    
+    return JsonResponse({
+        'notifications': notifications_data,
+        'unread_count': request.user.unread_notifications
+    })
+
+
+@login_required
+def get_unread_notification_count(request):
+    # Served from the counter on the already-loaded user row, no COUNT query
+    return JsonResponse({'unread_count': request.user.unread_notifications})
+
+
+@login_required
+def mark_notifications_read(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=400)
+    
+    notifications.mark_all_read(request.user)
+    return JsonResponse({'success': True})
+
+
+def metrics_view(request):
+    config = get_instrumentation_config()
+    if not config['ENABLED']:
+        raise Http404
+    
+    # Scrapers authenticate with a bearer token; otherwise only staff may look
+    token = config['METRICS_TOKEN']
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:
+        return HttpResponse(status=403)
+    
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+def search_view(request):
+    query = request.GET.get('q', '').strip()
+    kinds = [kind for kind in request.GET.getlist('type') if kind in dict(SearchDocument.KIND_CHOICES)]
+    before = request.GET.get('before')
+    before = int(before) if before and before.isdigit() else None
+    
+    documents, next_cursor = search.search(request.user, query, kinds=kinds, before=before)
+    
+    results = []
+    for doc in documents:
+        results.append({
+            'type': doc.kind,
+            'id': doc.object_id,
+            'content': doc.content[:300],
+            'user': doc.author.username,
+            'avatar': doc.author.get_profile_photo_url(),
+            'post_id': doc.post_id,
+            'conversation_id': doc.conversation_id,
+            'created_at': doc.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        })
+    
+    return JsonResponse({'results': results, 'next_before': next_cursor})
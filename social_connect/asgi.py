@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_connect.settings')
+# Serve the polling endpoints from core.async_views (settings.ASYNC_VIEWS)
+os.environ.setdefault('SOCIAL_CONNECT_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
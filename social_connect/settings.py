@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,7 +32,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    'core.apps.CoreAdminConfig',  # django.contrib.admin with the profile pages
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -41,11 +42,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,6 +85,26 @@ DATABASES = {
     }
 }
 
+# Conversations, their members, messages and archive segments are sharded
+# by conversation id over MESSAGE_SHARDS (see core/sharding.py). Setting
+# SOCIAL_CONNECT_MESSAGE_SHARDS=N spreads them over N local SQLite files,
+# messages_0.sqlite3 ...; migrate each one with --database and move existing
+# rows with `manage.py reshard_messages`. Only ever append shards.
+MESSAGE_SHARDS = [
+    f'messages_{i}' for i in range(int(os.environ.get('SOCIAL_CONNECT_MESSAGE_SHARDS', '0')))
+] or ['default']
+for alias in MESSAGE_SHARDS:
+    if alias != 'default':
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'{alias}.sqlite3',
+        }
+
+DATABASE_ROUTERS = ['core.sharding.MessageShardRouter']
+
+# Adds the spare shard databases the sharding tests run on
+TEST_RUNNER = 'social_connect.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -136,3 +159,93 @@ LOGOUT_REDIRECT_URL = 'login'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Background jobs (see core/jobs.py). When eager, jobs run in-process after
+# the request's transaction commits instead of waiting for `run_jobs`.
+JOB_QUEUE_EAGER = DEBUG
+
+# Per-request query/latency instrumentation (see core/middleware.py).
+# Metrics are served in Prometheus text format at /metrics/.
+INSTRUMENTATION = {
+    'ENABLED': False,
+    'DEFAULT_QUERY_BUDGET': 50,
+    'QUERY_BUDGETS': {
+        'get_messages_json': 10,
+        'get_user_status': 3,
+        'get_comments': 10,
+        'like_post': 8,
+    },
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'METRICS_TOKEN': None,
+}
+
+# Sampling profiler (see core/profiling.py). Captures a SAMPLE_RATE fraction
+# of requests plus any request slower than SLOW_THRESHOLD_MS into a bounded
+# ring buffer under DIRECTORY, browsable at /admin/profiles/.
+PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.001,
+    'SLOW_THRESHOLD_MS': 1000,
+    'SAMPLE_INTERVAL_MS': 5,
+    'DIRECTORY': BASE_DIR / 'profiles',
+    'MAX_PROFILES': 50,
+}
+
+# Token-bucket throttling per user and endpoint class (see core/ratelimit.py).
+# Each bucket holds CAPACITY requests and refills at PER_MINUTE. Switch STORE
+# to 'core.ratelimit.CacheStore' with a shared cache to throttle across workers.
+RATE_LIMITS = {
+    'ENABLED': True,
+    'STORE': 'core.ratelimit.MemoryStore',
+    'CLASSES': {
+        'write': {'CAPACITY': 20, 'PER_MINUTE': 30},
+        'poll': {'CAPACITY': 30, 'PER_MINUTE': 120},
+    },
+    'COALESCE_TIMEOUT': 5,
+}
+
+# Trending posts for the Popular tabs (see core/trending.py). WINDOWS maps each
+# window to the half-life engagement decays with; it is not a cutoff, so old
+# engagement still counts a little ('hour' is the Rising tab, 'day' is Hot).
+# The top TOP_K posts per window are re-ranked and cached every
+# REFRESH_SECONDS by the job worker.
+TRENDING = {
+    'WINDOWS': {'hour': 15 * 60, 'day': 6 * 60 * 60},
+    'TOP_K': 50,
+    'REFRESH_SECONDS': 60,
+}
+
+# Background purge of deleted posts and accounts (see core/deletion.py). Each
+# batch deletes at most BATCH_SIZE rows of one table in its own transaction;
+# the worker waits PAUSE_SECONDS before the next.
+DELETION = {
+    'BATCH_SIZE': 500,
+    'PAUSE_SECONDS': 1,
+}
+
+# Session/auth mode.
+#   'db'     - Django defaults: every authenticated request reads the session
+#              table and the user table.
+#   'cached' - cached_db sessions plus request.user served from the cache
+#              (core/usercache.py), so neither query runs on a cache hit.
+#   'cookie' - signed-cookie sessions (no session storage at all) plus the
+#              cached user.
+# The cached modes need a CACHES backend shared by every web and job-worker
+# process (Redis, Memcached); with the per-process default, logouts and
+# profile updates would not reach the other processes.
+SESSION_AUTH_MODE = 'db'
+
+if SESSION_AUTH_MODE == 'cached':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+elif SESSION_AUTH_MODE == 'cookie':
+    SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
+AUTH_USER_CACHE = {
+    'ENABLED': SESSION_AUTH_MODE != 'db',
+    'TIMEOUT': 300,
+}
+
+# Serve the polling endpoints (messages, user status, comments, likes) from
+# core/async_views.py. social_connect/asgi.py turns this on; under WSGI the
+# sync views avoid running an event loop per request.
+ASYNC_VIEWS = os.environ.get('SOCIAL_CONNECT_ASYNC_VIEWS') == '1'
@@ -0,0 +1,26 @@
+"""
+Test runner for `manage.py test`.
+
+The suite always gets three spare message shard databases, so the sharded
+code paths run under override_settings(MESSAGE_SHARDS=[...]) whatever is
+configured (see core/sharding.py). They are only added here, never in the
+settings a server loads.
+"""
+
+from django.conf import settings
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+SHARD_ALIASES = ('messages_0', 'messages_1', 'messages_2')
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        # Before the suite is built, so tests with databases='__all__' see the shards too
+        for alias in SHARD_ALIASES:
+            settings.DATABASES.setdefault(alias, {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': settings.BASE_DIR / f'{alias}.sqlite3',
+            })
+        connections.configure_settings(settings.DATABASES)
+        super().setup_test_environment(**kwargs)
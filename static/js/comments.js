@@ -0,0 +1,162 @@
+/* ==========================================================================
+   Comments Module - paged comment threads for the feed and profile pages
+   ========================================================================== */
+
+// Comments and replies come a page at a time as server-rendered HTML
+// (partials/comment_list.html), so every page that shows posts renders
+// them the same way. Expects the markup of partials/post_comments.html.
+window.Comments = (function() {
+    'use strict';
+
+    function getCookie(name) {
+        let cookieValue = null;
+        if (document.cookie && document.cookie !== '') {
+            const cookies = document.cookie.split(';');
+            for (let i = 0; i < cookies.length; i++) {
+                const cookie = cookies[i].trim();
+                if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                    cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                    break;
+                }
+            }
+        }
+        return cookieValue;
+    }
+
+    function fetchPage(url, after) {
+        return fetch(after ? `${url}?after=${after}` : url)
+            .then(response => response.ok ? response.json() : Promise.reject(response));
+    }
+
+    // Next page of top-level comments; the first call loads the first page
+    function load(container) {
+        const postId = container.closest('.post-card').dataset.postId;
+        const list = container.querySelector('.comments-container');
+        const moreBtn = container.querySelector('.comments-more-btn');
+
+        fetchPage(`/post/${postId}/comments/`, moreBtn ? moreBtn.dataset.after : '')
+            .then(data => {
+                list.insertAdjacentHTML('beforeend', data.html);
+                if (moreBtn) {
+                    moreBtn.dataset.after = data.next_cursor || '';
+                    moreBtn.hidden = !data.next_cursor;
+                }
+            })
+            .catch(error => console.error('Error loading comments:', error));
+    }
+
+    function loadReplies(btn) {
+        const item = btn.closest('.comment-item');
+        const replies = item.querySelector('.comment-replies');
+
+        btn.disabled = true;
+        fetchPage(`/comment/${item.dataset.commentId}/replies/`, btn.dataset.after)
+            .then(data => {
+                replies.insertAdjacentHTML('beforeend', data.html);
+                if (data.next_cursor) {
+                    btn.dataset.after = data.next_cursor;
+                    btn.textContent = 'View more replies';
+                    btn.disabled = false;
+                } else {
+                    btn.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading replies:', error);
+                btn.disabled = false;
+            });
+    }
+
+    function startReply(btn) {
+        const item = btn.closest('.comment-item');
+        const input = btn.closest('.post-comments').querySelector('.comment-input');
+        const author = item.querySelector('.comment-author').textContent;
+
+        input.dataset.parentId = item.dataset.commentId;
+        input.placeholder = `Reply to ${author}...`;
+        input.focus();
+    }
+
+    // "View more comments", "View replies" and "Reply"; returns true if the click was one of them
+    function handleClick(target) {
+        const moreBtn = target.closest('.comments-more-btn');
+        const repliesBtn = target.closest('.comment-replies-btn');
+        const replyBtn = target.closest('.comment-reply-btn');
+
+        if (moreBtn) {
+            load(moreBtn.closest('.post-comments'));
+        } else if (repliesBtn) {
+            loadReplies(repliesBtn);
+        } else if (replyBtn) {
+            startReply(replyBtn);
+        }
+        return Boolean(moreBtn || repliesBtn || replyBtn);
+    }
+
+    // Wires the comment form; onPosted(postCard, data) updates the page's comment count
+    function setupForm(container, onPosted) {
+        const postCard = container.closest('.post-card');
+        const postId = postCard.dataset.postId;
+        const input = container.querySelector('.comment-input');
+        const postBtn = container.querySelector('.comment-publish-btn');
+
+        if (!input || !postBtn) return;
+
+        const postComment = () => {
+            const text = input.value.trim();
+
+            if (!text) return;
+
+            // Disable button to prevent double submission
+            postBtn.disabled = true;
+
+            const formData = new FormData();
+            formData.append('content', text);
+            if (input.dataset.parentId) {
+                formData.append('parent_id', input.dataset.parentId);
+            }
+
+            fetch('/post/' + postId + '/comment/', {
+                method: 'POST',
+                headers: {
+                    'X-CSRFToken': getCookie('csrftoken')
+                },
+                body: formData
+            })
+            .then(response => response.ok ? response.json() : Promise.reject(response))
+            .then(data => {
+                // Add the server-rendered comment, under its thread for replies
+                const list = container.querySelector('.comments-container');
+                const parent = data.comment.parent_id &&
+                    container.querySelector(`.comment-item[data-comment-id="${data.comment.parent_id}"] .comment-replies`);
+                (parent || list).insertAdjacentHTML('beforeend', data.html);
+                input.value = '';
+                delete input.dataset.parentId;
+                input.placeholder = 'Write a comment...';
+
+                if (onPosted) onPosted(postCard, data);
+
+                postBtn.disabled = false;
+            })
+            .catch(error => {
+                console.error('Error posting comment:', error);
+                alert('Failed to post comment');
+                postBtn.disabled = false;
+            });
+        };
+
+        input.addEventListener('keydown', (e) => {
+            if (e.key === 'Enter') {
+                e.preventDefault();
+                postComment();
+            } else if (e.key === 'Escape' && input.dataset.parentId) {
+                delete input.dataset.parentId;
+                input.placeholder = 'Write a comment...';
+            }
+        });
+
+        postBtn.addEventListener('click', postComment);
+    }
+
+    return { load, loadReplies, startReply, handleClick, setupForm };
+})();
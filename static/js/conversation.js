@@ -251,8 +251,9 @@ document.addEventListener('DOMContentLoaded', function() {
     function updateUserStatus() {
         if (typeof otherUserId !== 'undefined') {
             fetch(`/user/${otherUserId}/status/`)
-                .then(response => response.json())
+                .then(response => response.status === 429 ? null : response.json())
                 .then(data => {
+                    if (!data) return;
                     const statusEl = document.getElementById('chat-user-status');
                     if (statusEl) {
                         statusEl.textContent = data.status;
@@ -262,9 +263,131 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // --- GROUP MEMBER PRESENCE ---
+    function updateGroupPresence() {
+        if (typeof isGroup === 'undefined' || typeof conversationId === 'undefined') return;
+        fetch(`/conversation/${conversationId}/members/`)
+            .then(response => response.status === 429 ? null : response.json())
+            .then(data => {
+                if (!data) return;
+                const statusEl = document.getElementById('chat-user-status');
+                if (statusEl) {
+                    statusEl.textContent = `${data.members.length} members · ${data.online_count} online`;
+                }
+                data.members.forEach(member => {
+                    const memberStatus = document.querySelector(`.group-member[data-member-id="${member.id}"] .group-member-status`);
+                    if (memberStatus) {
+                        memberStatus.textContent = member.status;
+                        memberStatus.classList.toggle('online', member.is_online);
+                    }
+                });
+            })
+            .catch(error => console.error('Error fetching members:', error));
+    }
+
     // Update status immediately and every 10 seconds
     updateUserStatus();
-    setInterval(updateUserStatus, 10000);
+    updateGroupPresence();
+    setInterval(() => {
+        updateUserStatus();
+        updateGroupPresence();
+    }, 10000);
+
+    // --- LOAD OLDER HISTORY ON SCROLL ---
+    let loadingHistory = false;
+    let hasMoreHistory = typeof hasOlderMessages === 'undefined' ? true : hasOlderMessages;
+
+    function oldestMessageId() {
+        const first = messagesList ? messagesList.querySelector('.message[data-message-id]') : null;
+        return first ? first.dataset.messageId : '';
+    }
+
+    function createHistoryElement(msg) {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = `message ${msg.is_own ? 'sent' : 'received'}`;
+        messageDiv.setAttribute('data-message-id', msg.id);
+
+        const bubble = document.createElement('div');
+        bubble.className = 'message-bubble';
+        if (msg.has_attachment) {
+            if (msg.is_image) {
+                const img = document.createElement('img');
+                img.src = msg.attachment_url;
+                img.alt = 'Attachment';
+                img.className = 'message-image';
+                bubble.appendChild(img);
+            } else {
+                const link = document.createElement('a');
+                link.href = msg.attachment_url;
+                link.className = 'message-file';
+                link.target = '_blank';
+                link.textContent = '📎 ' + msg.attachment_url.split('/').pop();
+                bubble.appendChild(link);
+            }
+        }
+        if (msg.content) {
+            const p = document.createElement('p');
+            p.textContent = msg.content;
+            bubble.appendChild(p);
+        }
+
+        const content = document.createElement('div');
+        content.className = 'message-content';
+        if (!msg.is_own && typeof isGroup !== 'undefined') {
+            const sender = document.createElement('span');
+            sender.className = 'message-sender';
+            sender.textContent = msg.sender_username;
+            content.appendChild(sender);
+        }
+        content.appendChild(bubble);
+        const time = document.createElement('time');
+        time.className = 'message-time';
+        time.textContent = msg.created_at;
+        content.appendChild(time);
+
+        if (!msg.is_own) {
+            const avatar = document.createElement('img');
+            avatar.src = msg.sender_avatar;
+            avatar.alt = msg.sender_username;
+            avatar.className = 'message-avatar';
+            messageDiv.appendChild(avatar);
+        }
+        messageDiv.appendChild(content);
+        return messageDiv;
+    }
+
+    function loadOlderMessages() {
+        if (loadingHistory || !hasMoreHistory || typeof conversationId === 'undefined') return;
+        loadingHistory = true;
+
+        fetch(`/conversation/${conversationId}/history/?before_id=${oldestMessageId()}`)
+            .then(response => response.json())
+            .then(data => {
+                hasMoreHistory = data.has_more;
+                if (!data.messages.length) return;
+
+                // Keep the viewport anchored while prepending
+                const previousHeight = messagesArea.scrollHeight;
+                const placeholder = messagesList.querySelector('.no-messages');
+                if (placeholder) placeholder.remove();
+                const fragment = document.createDocumentFragment();
+                data.messages.forEach(msg => fragment.appendChild(createHistoryElement(msg)));
+                messagesList.insertBefore(fragment, messagesList.firstChild);
+                messagesArea.scrollTop += messagesArea.scrollHeight - previousHeight;
+            })
+            .catch(error => console.error('Error loading history:', error))
+            .finally(() => {
+                loadingHistory = false;
+            });
+    }
+
+    if (messagesArea) {
+        messagesArea.addEventListener('scroll', function() {
+            if (messagesArea.scrollTop < 80) {
+                loadOlderMessages();
+            }
+        });
+    }
 
     // --- AUTO-SCROLL TO BOTTOM ---
     if (messagesArea) {
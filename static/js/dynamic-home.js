@@ -110,7 +110,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // Submit
         if (submitBtn) {
-            submitBtn.addEventListener('click', submitPost);
+            submitBtn.addEventListener('click', () => submitPost(closeModal));
         }
 
         // Modal Toolbar Actions
@@ -189,46 +189,53 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // --- Post Submission ---
-    function submitPost() {
+    function submitPost(onCreated) {
         const textarea = document.getElementById('modal-post-content');
         const content = textarea.value.trim();
+        const submitBtn = document.getElementById('submit-post');
         
         if (content.length === 0) return;
 
-        // Use form submission to Django
         const form = document.getElementById('post-form');
-        if (form) {
-            form.submit();
-        } else {
-            // Fallback: create form dynamically
-            const formData = new FormData();
-            formData.append('content', content);
-            formData.append('csrfmiddlewaretoken', csrftoken);
-            
-            // If there's a file
-            if (fileInput && fileInput.files.length > 0) {
-                formData.append('image', fileInput.files[0]);
+        const formData = form ? new FormData(form) : new FormData();
+        formData.set('content', content);
+        if (!form && fileInput && fileInput.files.length > 0) {
+            formData.append('image', fileInput.files[0]);
+        }
+
+        submitBtn.disabled = true;
+        fetch('/post/create/', {
+            method: 'POST',
+            body: formData,
+            headers: {
+                'X-CSRFToken': csrftoken,
+                'X-Requested-With': 'XMLHttpRequest'
             }
+        })
+        .then(response => response.json().then(data => ({ ok: response.ok, data })))
+        .then(({ ok, data }) => {
+            if (!ok || !data.success) {
+                alert(data.message || 'Failed to create post');
+                submitBtn.disabled = false;
+                return;
+            }
+            // Insert the server-rendered card at the top of the feed
+            insertPostCard(data.html);
+            onCreated();
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('Failed to create post');
+            submitBtn.disabled = false;
+        });
+    }
 
-            fetch('/', {
-                method: 'POST',
-                body: formData,
-                headers: {
-                    'X-CSRFToken': csrftoken
-                }
-            })
-            .then(response => {
-                if (response.ok) {
-                    window.location.reload();
-                } else {
-                    alert('Failed to create post');
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('Failed to create post');
-            });
-        }
+    function insertPostCard(html) {
+        const container = document.querySelector('.posts-container');
+        if (!container) return;
+        const empty = container.querySelector('.no-posts');
+        if (empty) empty.remove();
+        container.insertAdjacentHTML('afterbegin', html);
     }
     
     // --- Helpers: Feelings & Location Selectors ---
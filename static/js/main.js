@@ -208,6 +208,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 handleComment(commentBtn);
             } else if (shareBtn) {
                 handleShare(shareBtn);
+            } else {
+                Comments.handleClick(e.target);
             }
         });
     }
@@ -263,9 +265,10 @@ document.addEventListener('DOMContentLoaded', function() {
         
         if (isHidden) {
             commentsSection.style.display = 'block';
-            // Only load interface if it hasn't been initialized
+            // Only load interface and the first page of comments if it hasn't been initialized
             if (!commentsSection.dataset.initialized) {
-                loadCommentsInterface(commentsSection);
+                Comments.setupForm(commentsSection, updateCommentCount);
+                Comments.load(commentsSection);
                 commentsSection.dataset.initialized = 'true';
             }
         } else {
@@ -273,87 +276,9 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    function loadCommentsInterface(container) {
-        const postCard = container.closest('.post-card');
-        const postId = postCard.dataset.postId;
-        
-        // Attach event listeners to existing or new form
-        const input = container.querySelector('.comment-input');
-        const postBtn = container.querySelector('.comment-publish-btn');
-        
-        if (!input || !postBtn) return;
-
-        const postComment = () => {
-            const text = input.value.trim();
-            
-            if (!text) return;
-            
-            // Disable button to prevent double submission
-            postBtn.disabled = true;
-            
-            // Send to Django backend
-            const formData = new FormData();
-            formData.append('content', text);
-            
-            fetch('/post/' + postId + '/comment/', {
-                method: 'POST',
-                headers: {
-                    'X-CSRFToken': csrftoken
-                },
-                body: formData
-            })
-            .then(response => {
-                if (response.ok) {
-                    // Add comment to UI
-                    let list = container.querySelector('.comments-container');
-                    if (!list) {
-                        list = document.createElement('div');
-                        list.className = 'comments-container';
-                        list.style.marginBottom = '15px';
-                        container.insertBefore(list, container.querySelector('.comment-form'));
-                    }
-                    
-                    const newComment = document.createElement('div');
-                    newComment.className = 'comment-item';
-                    newComment.style.cssText = 'display: flex; align-items: flex-start; margin-bottom: 12px;';
-                    newComment.innerHTML = `
-                        <img src="${currentUser.avatar}" class="comment-avatar" 
-                             style="width: 32px; height: 32px; border-radius: 50%; margin-right: 10px; flex-shrink: 0;">
-                        <div class="comment-content" style="flex: 1;">
-                            <div class="comment-bubble" style="background: #ffffff; border-radius: 16px; padding: 8px 12px; display: inline-block; border: 1px solid #e4e6ea; box-shadow: 0 1px 2px rgba(0,0,0,0.1);">
-                                <div class="comment-author" style="font-weight: 600; font-size: 13px; color: #050505; margin-bottom: 2px;">${currentUser.name}</div>
-                                <div class="comment-text" style="font-size: 14px; color: #050505; line-height: 1.3;">${text}</div>
-                            </div>
-                        </div>`;
-                    list.appendChild(newComment);
-                    input.value = '';
-                    
-                    // Update count
-                    const countSpan = postCard.querySelector('.comment-btn .action-count');
-                    let c = parseInt(countSpan.textContent) || 0;
-                    countSpan.textContent = c + 1;
-                    
-                    postBtn.disabled = false;
-                } else {
-                    alert('Failed to post comment');
-                    postBtn.disabled = false;
-                }
-            })
-            .catch(error => {
-                console.error('Error posting comment:', error);
-                alert('Failed to post comment');
-                postBtn.disabled = false;
-            });
-        };
-        
-        input.addEventListener('keydown', (e) => {
-            if (e.key === 'Enter') {
-                e.preventDefault();
-                postComment();
-            }
-        });
-
-        postBtn.addEventListener('click', postComment);
+    function updateCommentCount(postCard, data) {
+        const countSpan = postCard.querySelector('.comment-btn .action-count');
+        countSpan.textContent = data.comment_count;
     }
     
     function handleShare(btn) {
@@ -369,7 +294,14 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                alert('Post shared to your profile!');
+                const feed = document.querySelector('.posts-container');
+                if (feed && data.html) {
+                    const empty = feed.querySelector('.no-posts');
+                    if (empty) empty.remove();
+                    feed.insertAdjacentHTML('afterbegin', data.html);
+                } else {
+                    alert('Post shared to your profile!');
+                }
             } else {
                 alert('Failed to share post: ' + (data.message || 'Unknown error'));
             }
@@ -424,5 +356,73 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
             });
         }
+        
+        setupNotifications();
+    }
+    
+    // Notifications dropdown: opening it lists the latest notifications and marks them read
+    function setupNotifications() {
+        const button = document.getElementById('notifications-btn');
+        const dropdown = document.getElementById('notifications-dropdown');
+        if (!button || !dropdown) return;
+        
+        button.addEventListener('click', function(e) {
+            e.preventDefault();
+            e.stopPropagation();
+            
+            if (dropdown.style.display === 'block') {
+                dropdown.style.display = 'none';
+                return;
+            }
+            const rect = button.getBoundingClientRect();
+            dropdown.style.position = 'fixed';
+            dropdown.style.top = (rect.bottom + 8) + 'px';
+            dropdown.style.right = '16px';
+            dropdown.style.display = 'block';
+            
+            fetch(button.dataset.listUrl)
+                .then(response => response.json())
+                .then(data => {
+                    dropdown.innerHTML = '';
+                    if (!data.notifications.length) {
+                        const empty = document.createElement('div');
+                        empty.className = 'dropdown-item notification-item';
+                        empty.textContent = 'No notifications yet';
+                        dropdown.appendChild(empty);
+                    }
+                    data.notifications.forEach(item => {
+                        const row = document.createElement('div');
+                        row.className = 'dropdown-item notification-item' + (item.is_read ? '' : ' unread');
+                        const avatar = document.createElement('img');
+                        avatar.src = item.actor_avatar;
+                        avatar.alt = '';
+                        avatar.className = 'notification-avatar';
+                        const message = document.createElement('span');
+                        message.textContent = item.message;
+                        row.append(avatar, message);
+                        dropdown.appendChild(row);
+                    });
+                    if (data.unread_count) markNotificationsRead(button);
+                })
+                .catch(error => console.error('Error loading notifications:', error));
+        });
+        
+        document.addEventListener('click', function(e) {
+            if (!button.contains(e.target) && !dropdown.contains(e.target)) {
+                dropdown.style.display = 'none';
+            }
+        });
+    }
+    
+    function markNotificationsRead(button) {
+        fetch(button.dataset.markReadUrl, {
+            method: 'POST',
+            headers: { 'X-CSRFToken': getCookie('csrftoken') }
+        })
+            .then(response => {
+                const badge = document.getElementById('notification-badge');
+                if (response.ok && badge) badge.remove();
+            })
+            .catch(error => console.error('Error marking notifications read:', error));
     }
 });
\ No newline at end of file
@@ -14,6 +14,8 @@ document.addEventListener('DOMContentLoaded', function() {
     let activeConversationId = null;
     let activeConversationData = null;
     let statusUpdateInterval = null;
+    // Newest message on screen; polls only ask for messages after it
+    let lastMessageId = null;
 
     // --- Initialize ---
     initMessagesPage();
@@ -37,8 +39,9 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!userId) return;
         
         fetch(`/user/${userId}/status/`)
-            .then(response => response.json())
+            .then(response => response.status === 429 ? null : response.json())
             .then(data => {
+                if (!data) return;
                 const statusElement = document.getElementById('chat-user-status');
                 if (statusElement) {
                     statusElement.textContent = data.status;
@@ -60,9 +63,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 const userName = this.dataset.userName;
                 const userAvatar = this.dataset.userAvatar;
                 const userId = this.dataset.userId;
+                const memberCount = this.dataset.memberCount;
                 
                 setActiveConversation(this);
-                loadConversation(convId, userName, userAvatar, userId);
+                loadConversation(convId, userName, userAvatar, userId, memberCount);
             });
         });
     }
@@ -77,8 +81,9 @@ document.addEventListener('DOMContentLoaded', function() {
         element.classList.add('active');
     }
 
-    function loadConversation(convId, userName, userAvatar, userId) {
+    function loadConversation(convId, userName, userAvatar, userId, memberCount) {
         activeConversationId = convId;
+        lastMessageId = null;
         activeConversationData = { userName, userAvatar, userId };
 
         // Toggle Views - hide no-conversation and show active-chat
@@ -105,14 +110,25 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         if (conversationInput) conversationInput.value = convId;
 
-        // Update user status
-        updateUserStatus(userId);
-        
         // Clear previous status update interval
         if (statusUpdateInterval) {
             clearInterval(statusUpdateInterval);
         }
         
+        // Groups show their size; presence lives on the conversation page
+        if (memberCount) {
+            const statusElement = document.getElementById('chat-user-status');
+            if (statusElement) {
+                statusElement.textContent = `${memberCount} members`;
+                statusElement.style.color = '#65676b';
+            }
+            fetchMessages(convId);
+            return;
+        }
+        
+        // Update user status
+        updateUserStatus(userId);
+        
         // Set up new status update interval (every 10 seconds)
         statusUpdateInterval = setInterval(() => {
             updateUserStatus(userId);
@@ -122,32 +138,41 @@ document.addEventListener('DOMContentLoaded', function() {
         fetchMessages(convId);
     }
 
-    function fetchMessages(convId) {
-        fetch(`/conversation/${convId}/messages/`)
-            .then(response => response.json())
+    function fetchMessages(convId, reload) {
+        if (reload) lastMessageId = null;
+        const afterId = lastMessageId;
+        const query = afterId === null ? '' : `?after_id=${afterId}`;
+        fetch(`/conversation/${convId}/messages/${query}`)
+            .then(response => response.status === 429 ? null : response.json())
             .then(data => {
+                // Throttled, or another conversation was opened meanwhile: try again on the next tick
+                if (!data || convId !== activeConversationId || afterId !== lastMessageId) return;
                 const messagesList = document.getElementById('messages-list');
                 if (!messagesList) {
                     console.error('messages-list element not found');
                     return;
                 }
                 
-                // Clear existing messages
-                messagesList.innerHTML = '';
-                
-                // Add date divider
-                const dateDivider = document.createElement('div');
-                dateDivider.className = 'date-divider';
-                dateDivider.innerHTML = '<span class="date-text">Today</span>';
-                messagesList.appendChild(dateDivider);
+                if (data.reset) {
+                    // Clear existing messages
+                    messagesList.innerHTML = '';
+                    
+                    // Add date divider
+                    const dateDivider = document.createElement('div');
+                    dateDivider.className = 'date-divider';
+                    dateDivider.innerHTML = '<span class="date-text">Today</span>';
+                    messagesList.appendChild(dateDivider);
+                }
                 
-                // Render each message
+                // Render only what is new
                 data.messages.forEach(msg => {
-                    const messageDiv = createMessageElement(msg);
+                    const messageDiv = createMessageElement(msg, data.is_group);
                     messagesList.appendChild(messageDiv);
+                    lastMessageId = msg.id;
                 });
+                updateReadReceipts(messagesList, data.watermarks, data.is_group);
                 
-                scrollToBottom();
+                if (data.reset || data.messages.length) scrollToBottom();
             })
             .catch(error => {
                 console.error('Error fetching messages:', error);
@@ -158,7 +183,19 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
-    function createMessageElement(msg) {
+    // Messages already on screen get their "Seen" label from the latest watermarks
+    function updateReadReceipts(messagesList, watermarks, isGroup) {
+        messagesList.querySelectorAll('.message.sent[data-message-id]').forEach(messageDiv => {
+            const messageId = Number(messageDiv.dataset.messageId);
+            const seenBy = watermarks.filter(watermark => watermark >= messageId).length;
+            const time = messageDiv.querySelector('.message-time');
+            if (time) {
+                time.textContent = time.dataset.time + (seenBy ? (isGroup ? ` · Seen by ${seenBy}` : ' · Seen') : '');
+            }
+        });
+    }
+    
+    function createMessageElement(msg, isGroup) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${msg.is_own ? 'sent' : 'received'}`;
         
@@ -188,7 +225,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         ${contentHtml}
                     </div>
                     <div class="message-actions">
-                        <time class="message-time">${msg.created_at}</time>
+                        <time class="message-time" data-time="${msg.created_at}">${msg.created_at}${msg.seen ? (isGroup ? ` · Seen by ${msg.seen_by}` : ' · Seen') : ''}</time>
                         <button class="message-menu-btn" data-message-id="${msg.id}" type="button">⋯</button>
                     </div>
                 </div>
@@ -197,6 +234,7 @@ document.addEventListener('DOMContentLoaded', function() {
             messageDiv.innerHTML = `
                 <img src="${msg.sender_avatar}" alt="${msg.sender_username}" class="message-avatar" />
                 <div class="message-content">
+                    ${isGroup ? `<span class="message-sender">${escapeHtml(msg.sender_username)}</span>` : ''}
                     <div class="message-bubble">
                         ${contentHtml}
                     </div>
@@ -310,16 +348,16 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(response => response.json())
         .then(data => {
-            // Always refresh messages since deletion likely succeeded
-            if (currentConversationId) {
-                fetchMessages(currentConversationId);
+            // Always reload messages since deletion likely succeeded
+            if (activeConversationId) {
+                fetchMessages(activeConversationId, true);
             }
         })
         .catch(error => {
             console.error('Error deleting message:', error);
-            // Still refresh to check if it was deleted
-            if (currentConversationId) {
-                fetchMessages(currentConversationId);
+            // Still reload to check if it was deleted
+            if (activeConversationId) {
+                fetchMessages(activeConversationId, true);
             }
         });
     };
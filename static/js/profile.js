@@ -65,25 +65,25 @@ document.addEventListener('DOMContentLoaded', function() {
             const commentBtn = target.closest('.comment-btn');
             if (commentBtn) {
                 e.preventDefault();
-                const post = commentBtn.closest('.post-card');
-                let section = post?.querySelector('.post-comments');
-                
-                if (!section) {
-                    section = document.createElement('div');
-                    section.className = 'post-comments';
-                    section.style.display = 'none';
-                    post.appendChild(section);
-                }
-                
-                const isHidden = window.getComputedStyle(section).display === 'none';
+                const section = commentBtn.closest('.post-card').querySelector('.post-comments');
+                const isHidden = section.style.display === 'none';
                 section.style.display = isHidden ? 'block' : 'none';
                 
-                if (isHidden && section.innerHTML.trim() === '') {
-                    loadCommentsInterface(section);
+                // First page and the form only on first open, like the feed
+                if (isHidden && !section.dataset.initialized) {
+                    Comments.setupForm(section, updateCommentCount);
+                    Comments.load(section);
+                    section.dataset.initialized = 'true';
                 }
                 return;
             }
 
+            // --- MORE COMMENTS / REPLIES / REPLY ---
+            if (Comments.handleClick(target)) {
+                e.preventDefault();
+                return;
+            }
+
             // --- SHARE BUTTON ---
             const shareBtn = target.closest('.share-btn');
             if (shareBtn) {
@@ -238,115 +238,12 @@ document.addEventListener('DOMContentLoaded', function() {
         return cookieValue;
     }
 
-    // --- LOAD COMMENTS INTERFACE ---
-    function loadCommentsInterface(container) {
-        const post = container.closest('.post-card');
-        const commentBtn = post.querySelector('.comment-btn');
-        const postId = commentBtn.dataset.postId;
-        
-        container.style.cssText = `
-            padding: 15px;
-            background: #f8f9fa;
-            border-top: 1px solid #e4e6ea;
-            margin-top: 10px;
-        `;
-        
-        // Fetch comments from server
-        fetch(`/post/${postId}/comments/`)
-            .then(response => response.json())
-            .then(data => {
-                let commentsHTML = '<div class="comments-container" style="margin-bottom: 15px;">';
-                
-                data.comments.forEach(comment => {
-                    commentsHTML += `
-                        <div class="comment-item" style="display: flex; align-items: flex-start; margin-bottom: 12px;">
-                            <img src="${comment.avatar}" class="comment-avatar" 
-                                 style="width: 32px; height: 32px; border-radius: 50%; margin-right: 10px;">
-                            <div class="comment-content" style="flex: 1;">
-                                <div class="comment-bubble" style="background: #fff; border-radius: 16px; padding: 8px 12px; display: inline-block; border: 1px solid #e4e6ea;">
-                                    <div class="comment-author" style="font-weight: 600; font-size: 13px;">${comment.user}</div>
-                                    <div class="comment-text" style="font-size: 14px;">${escapeHtml(comment.content)}</div>
-                                </div>
-                            </div>
-                        </div>`;
-                });
-                
-                commentsHTML += '</div>';
-                
-                // Add comment form
-                commentsHTML += `
-                    <div class="comment-form" style="display: flex; align-items: center; background: #fff; border-radius: 20px; padding: 8px; border: 1px solid #e4e6ea;">
-                        <img src="${currentUser ? currentUser.avatar : '/media/defaults/default-avatar.jpg'}" class="comment-avatar" 
-                             style="width: 32px; height: 32px; border-radius: 50%; margin-right: 10px;">
-                        <input type="text" class="comment-input" placeholder="Write a comment..." 
-                               style="flex: 1; border: none; outline: none; font-size: 14px; padding: 6px;">
-                        <button class="comment-publish-btn" data-post-id="${postId}" type="button" style="background: #1877f2; color: white; border: none; border-radius: 16px; padding: 6px 12px; font-weight: 600; cursor: pointer; margin-left: 8px;">Post</button>
-                    </div>`;
-                
-                container.innerHTML = commentsHTML;
-                
-                // Setup comment posting
-                const input = container.querySelector('.comment-input');
-                const postBtn = container.querySelector('.comment-publish-btn');
-                
-                const postComment = () => {
-                    if (input.value.trim()) {
-                        const formData = new FormData();
-                        formData.append('content', input.value);
-                        
-                        fetch(`/post/${postId}/comment/`, {
-                            method: 'POST',
-                            headers: {
-                                'X-CSRFToken': getCookie('csrftoken')
-                            },
-                            body: formData
-                        })
-                        .then(response => response.json())
-                        .then(data => {
-                            if (data.success) {
-                                const list = container.querySelector('.comments-container');
-                                const newComment = document.createElement('div');
-                                newComment.className = 'comment-item';
-                                newComment.style.cssText = 'display: flex; align-items: flex-start; margin-bottom: 12px;';
-                                newComment.innerHTML = `
-                                    <img src="${data.comment.avatar}" class="comment-avatar" 
-                                         style="width: 32px; height: 32px; border-radius: 50%; margin-right: 10px;">
-                                    <div class="comment-content" style="flex: 1;">
-                                        <div class="comment-bubble" style="background: #fff; border-radius: 16px; padding: 8px 12px; display: inline-block; border: 1px solid #e4e6ea;">
-                                            <div class="comment-author" style="font-weight: 600; font-size: 13px;">${data.comment.user}</div>
-                                            <div class="comment-text" style="font-size: 14px;">${escapeHtml(data.comment.content)}</div>
-                                        </div>
-                                    </div>`;
-                                list.appendChild(newComment);
-                                input.value = '';
-                                
-                                // Update count
-                                const commentsCountSpan = post?.querySelector('.comments-count');
-                                if (commentsCountSpan) {
-                                    commentsCountSpan.textContent = `${data.comment_count} comment${data.comment_count === 1 ? '' : 's'}`;
-                                }
-                            }
-                        })
-                        .catch(error => console.error('Error:', error));
-                    }
-                };
-                
-                input.addEventListener('keydown', (e) => {
-                    if (e.key === 'Enter') {
-                        e.preventDefault();
-                        postComment();
-                    }
-                });
-                
-                postBtn.addEventListener('click', postComment);
-            })
-            .catch(error => console.error('Error loading comments:', error));
-    }
-    
-    function escapeHtml(text) {
-        const div = document.createElement('div');
-        div.textContent = text;
-        return div.innerHTML;
+    // --- COMMENT COUNT ---
+    function updateCommentCount(post, data) {
+        const commentsCountSpan = post.querySelector('.comments-count');
+        if (commentsCountSpan) {
+            commentsCountSpan.textContent = `${data.comment_count} comment${data.comment_count === 1 ? '' : 's'}`;
+        }
     }
 
     // --- POST MENU TOGGLE ---